@@ -0,0 +1,97 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : DyadTableImpactEstimator.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Read only dry run of the Dyad Table ZCTA Reconciler. Estimates what reconciling
+# the dyad table against one or more crosswalks would change: the rows remapped, the duplicate
+# rows merged and the visits lost for every recipient and provider ZCTA, without changing the dyad
+# table or the base ZCTAs. Only the recipient, provider and visit columns are read, once for every
+# crosswalk. The estimating is done by servicearea.reconcile, this script is the toolbox wrapper.
+# ---------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import arcpy
+import os
+from servicearea import checker, reconcile, store, getBackend, telemetry, CsvBackend
+from servicearea.pipeline import crosswalkIndex
+from servicearea.tables import findField
+
+###################################################################################################
+#Input Variable loading and environment declaration
+###################################################################################################
+DyadTable = arcpy.GetParameterAsText(0) #dyad table
+DyadVisits_Field = arcpy.GetParameterAsText(1) or "VISITS_DYAD"
+ZCTAs = arcpy.GetParameterAsText(2) #ZCTAs
+Crosswalks = [c for c in arcpy.GetParameterAsText(3).split(';') if c] #crosswalk tables or crosswalk.npz files to compare
+OutputLocation = arcpy.GetParameterAsText(4) or os.path.dirname(DyadTable.rstrip('/\\')) #folder the impact CSVs are written to
+#the impact CSVs are written next to a geodatabase, not inside it
+OutputLocation = os.path.dirname(OutputLocation) if OutputLocation.lower().endswith('.gdb') else OutputLocation
+DyadBackend = getBackend(DyadTable) #geodatabase tables are read with arcpy, CSV/Parquet files directly
+ZCTABackend = getBackend(ZCTAs)
+Telemetry = telemetry.RunReport('DyadTableImpactEstimator') #stage timings and estimates written next to the impact CSVs
+DyadTable_FieldList = DyadBackend.fields(DyadTable) # create field list from input
+ZCTAs_FieldList = ZCTABackend.fields(ZCTAs) #create field list from input
+
+###################################################################################################
+#Global variables to be used in process
+###################################################################################################
+DyadRec_field = findField(DyadTable_FieldList,'rec') #find rec_ZCTA field within field list
+DyadProv_field = findField(DyadTable_FieldList,'prov') #find prov_ZCTA field within field list
+ZCTA_field = findField(ZCTAs_FieldList,['ZCTA','ZIP'],caseSensitive=True) #find ZCTA field within field list
+DyadName = os.path.splitext(os.path.basename(DyadTable.rstrip('/\\')))[0]
+
+###################################################################################################
+#create a sorted index of ZCTAs from shapefile
+###################################################################################################
+with Telemetry.stage('zctaIndex') as stage:
+	ZCTA_Index = checker.zctaIndex(ZCTABackend.readTable(ZCTAs,[ZCTA_field])[ZCTA_field])
+	stage['rows'] = len(ZCTA_Index)
+arcpy.AddMessage(str(len(ZCTA_Index)) + " ZCTAs in shapefile")
+
+###################################################################################################
+#Read the recipient, provider and visit columns once, dyad stores are read a block at a time from
+#the mapped columns for every crosswalk instead
+###################################################################################################
+with Telemetry.stage('readDyads') as stage:
+	arcpy.SetProgressorLabel("Reading the recipient, provider and visit columns of {0}...".format(DyadTable))
+	if store.isStore(DyadTable):
+		Dyads = store.DyadStore(DyadTable)
+	else:
+		Dyads = DyadBackend.readTable(DyadTable,[DyadRec_field,DyadProv_field,DyadVisits_Field])
+	stage['rows'] = len(Dyads)
+
+###################################################################################################
+#Estimate the impact of reconciling against each crosswalk
+###################################################################################################
+for Crosswalk in Crosswalks:
+	CrosswalkName = os.path.splitext(os.path.basename(Crosswalk.rstrip('/\\')))[0]
+	arcpy.SetProgressorLabel("Estimating the impact of reconciling against {0}...".format(Crosswalk))
+	with Telemetry.stage('estimate ' + CrosswalkName) as stage:
+		Crosswalk_Zips, Crosswalk_ZCTAs = crosswalkIndex(getBackend(Crosswalk),Crosswalk)
+		if store.isStore(DyadTable):
+			Impact = reconcile.estimateStoreImpact(Dyads,ZCTA_Index,Crosswalk_Zips,Crosswalk_ZCTAs,DyadVisits_Field)
+		else:
+			Impact = reconcile.estimateImpact(Dyads[DyadRec_field],Dyads[DyadProv_field],Dyads[DyadVisits_Field],
+				ZCTA_Index,Crosswalk_Zips,Crosswalk_ZCTAs)
+		ImpactFile = os.path.join(OutputLocation,"{0}_impact_{1}.csv".format(DyadName,CrosswalkName))
+		CsvBackend().writeTable(Impact['zctas'],ImpactFile)
+		stage.update((key,value) for key, value in Impact.items() if key != 'zctas')
+		stage['impactFile'] = ImpactFile
+
+	arcpy.AddMessage("{0}:".format(Crosswalk))
+	arcpy.AddMessage("{0:,} of {1:,} rows remapped ({2:,} recipients, {3:,} providers)".format(
+		Impact['rowsRemapped'],Impact['rows'],Impact['recRemapped'],Impact['provRemapped']))
+	arcpy.AddMessage("{0:,} duplicate entries would be merged into {1:,} dyads".format(Impact['merged'],Impact['mergedPairs']))
+	if Impact['visitsTotal'] > 0:
+		arcpy.AddMessage("{0:,.0f} of {1:,.0f} visits ({2:.4%}) lost, {3:,.0f} to recipients and {4:,.0f} to providers without a crosswalk entry".format(
+			Impact['visitsLost'],Impact['visitsTotal'],Impact['visitsLost']/Impact['visitsTotal'],Impact['visitsMissed'],Impact['provVisitsLost']))
+	arcpy.AddMessage("Rows and visits of every missing ZCTA written to {0}".format(ImpactFile))
+
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('DyadTableImpactEstimator',OutputLocation))))
+arcpy.AddMessage("Process Complete! The dyad table and ZCTAs were not changed")
@@ -8,6 +8,7 @@
 # Version		: $1.0$
 # Description	: Simple script to check that all the ZCTAs in the dyad table
 # are also in the ZCTA shapefile to be used in generating service areas.
+# The checking is done by servicearea.checker, this script is the toolbox wrapper.
 # ---------------------------------------------------------------------------
 
 ###################################################################################################
@@ -15,55 +16,52 @@
 ###################################################################################################
 import arcpy
 import os
-import sets
-from itertools import *
+from servicearea import checker, getBackend, store, telemetry
+from servicearea.tables import findField
 
 ###################################################################################################
 #Input Variable loading and environment declaration
 ###################################################################################################
 DyadTable = arcpy.GetParameterAsText(0) #dyad table
-DyadTable_FieldList = [f.name for f in arcpy.ListFields(DyadTable)] # create field list from input
 ZCTAs = arcpy.GetParameterAsText(1) #ZCTAs
-ZCTAs_FieldList = [f.name for f in arcpy.ListFields(ZCTAs)] #create field list from input
-
-###################################################################################################
-# Defining global functions
-###################################################################################################
-
+DyadVisits_Field = arcpy.GetParameterAsText(2) #optional visits field, VISITS_DYAD is used if not given
+DyadBackend = getBackend(DyadTable) #geodatabase tables are read with arcpy, CSV/Parquet files directly
+ZCTABackend = getBackend(ZCTAs)
+Telemetry = telemetry.RunReport('DyadTableZCTAChecker') #stage timings written next to the dyad table
+DyadTable_FieldList = DyadBackend.fields(DyadTable) # create field list from input
+ZCTAs_FieldList = ZCTABackend.fields(ZCTAs) #create field list from input
 
 ###################################################################################################
 #Global variables to be used in process
 ###################################################################################################
-DyadRec_field = [f for f in DyadTable_FieldList if 'rec' in f.lower()][0] #find rec_ZCTA field within field list
-DyadProv_field = [f for f in DyadTable_FieldList if 'prov' in f.lower()][0] #find prov_ZCTA field within field list
-ZCTA_field = [f for f in ZCTAs_FieldList if 'ZCTA' in f or 'ZIP' in f][0] #find ZCTA field within field list
-ZCTA_List = [] # list of ZCTAs from ZCTA file
-rec_ZCTAs_Misssing = [] #list of missing rec ZCTAs
-prov_ZCTAs_Misssing = [] #list of misssing prov ZCTAs
+DyadRec_field = findField(DyadTable_FieldList,'rec') #find rec_ZCTA field within field list
+DyadProv_field = findField(DyadTable_FieldList,'prov') #find prov_ZCTA field within field list
+ZCTA_field = findField(ZCTAs_FieldList,['ZCTA','ZIP'],caseSensitive=True) #find ZCTA field within field list
+if not DyadVisits_Field:
+	DyadVisits_Field = "VISITS_DYAD"
 
 ###################################################################################################
-#create a list of ZCTAs from shapeifle
+#create a sorted index of ZCTAs from shapefile
 ###################################################################################################
-#build a list of ZCTAs from ZCTA file
-with arcpy.da.SearchCursor(ZCTAs,ZCTA_field) as cursor:
-	for row in cursor:
-		ZCTA_List.append(row[0])
-arcpy.AddMessage(str(len(ZCTA_List)) + " ZCTAs in shapefile")
+with Telemetry.stage('zctaIndex') as stage:
+	ZCTA_Index = checker.zctaIndex(ZCTABackend.readTable(ZCTAs,[ZCTA_field])[ZCTA_field])
+	stage['rows'] = len(ZCTA_Index)
+arcpy.AddMessage(str(len(ZCTA_Index)) + " ZCTAs in shapefile")
 
 ###################################################################################################
 #Check that all ZCTAs in the dyad table are in the input ZCTA shapefile
 ###################################################################################################
-
-with arcpy.da.SearchCursor(DyadTable,[DyadRec_field,DyadProv_field]) as cursor:
-	for row in cursor:
-		if str(row[0]) not in ZCTA_List:
-			rec_ZCTAs_Misssing.append(str(row[0]))
-		if str(row[1]) not in ZCTA_List:
-			prov_ZCTAs_Misssing.append(str(row[1]))
-		else:
-			pass
-
-ZCTAs_missing = set(chain(rec_ZCTAs_Misssing,prov_ZCTAs_Misssing)) #create a set of unique missing ZCTAs
+with Telemetry.stage('checkDyads') as stage:
+	if store.isStore(DyadTable):
+		#dyad stores are checked a block at a time straight from the mapped columns
+		DyadStore = store.DyadStore(DyadTable)
+		Result = checker.checkStore(DyadStore,ZCTA_Index,DyadVisits_Field)
+		stage['rows'] = len(DyadStore)
+	else:
+		Dyads = DyadBackend.readTable(DyadTable,[DyadRec_field,DyadProv_field,DyadVisits_Field])
+		Result = checker.checkDyads(Dyads[DyadRec_field],Dyads[DyadProv_field],Dyads[DyadVisits_Field],ZCTA_Index)
+		stage['rows'] = len(Dyads)
+ZCTAs_missing = Result['missing']
 
 ###################################################################################################
 #Final Output and cleaning of temp data/variables
@@ -73,3 +71,13 @@ if len(ZCTAs_missing) == 0:
 else:
 	arcpy.AddMessage(str(len(ZCTAs_missing)) + " ZCTAs in Dyad Table that aren't in the ZCTA shapefile.\nA different shapefile is suggested!")
 	arcpy.AddMessage("Missing ZCTAs: {0}".format(ZCTAs_missing))
+
+	arcpy.AddMessage("Visits not accounted for by missing ZCTA (ZCTA: as recipient, as provider):")
+	for zcta in ZCTAs_missing:
+		arcpy.AddMessage("{0}: {1:,.0f}, {2:,.0f}".format(zcta,Result['recVisits'].get(zcta,0),Result['provVisits'].get(zcta,0)))
+
+	if Result['visitsTotal'] > 0:
+		arcpy.AddWarning("{0:,.0f} of {1:,.0f} visits ({2:.4%}) will not be accounted for".format(
+			Result['visitsMissed'],Result['visitsTotal'],Result['visitsMissed']/Result['visitsTotal']))
+
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('DyadTableZCTAChecker',os.path.dirname(DyadTable)))))
@@ -8,6 +8,10 @@
 # Version		: $1.0$
 # Description	: Simple script to check that all the ZCTAs in the dyad table
 # are also in the ZCTA shapefile to be used in generating service areas.
+# The dyad table is read once, reconciled in memory against the crosswalk by
+# servicearea.reconcile and written back in a single insert. When a state file is given only the
+# recipient groups that changed since the last run are reconciled and rewritten, and a changelog
+# of the changed rows is written.
 # ---------------------------------------------------------------------------
 
 ###################################################################################################
@@ -15,231 +19,143 @@
 ###################################################################################################
 import arcpy
 import os
-import sets
-from itertools import *
-import numpy
+from servicearea import checker, crosswalk, reconcile, store, zcta, getBackend, telemetry, CsvBackend
+from servicearea.tables import fromRows
+from servicearea.tables import findField
 
 ###################################################################################################
 #Input Variable loading and environment declaration
 ###################################################################################################
 DyadTable = arcpy.GetParameterAsText(0) #dyad table
-DyadTable_FieldList = [f.name for f in arcpy.ListFields(DyadTable)] # create field list from input
 DyadVisits_Field = arcpy.GetParameterAsText(1)
 ZCTAs = arcpy.GetParameterAsText(2) #ZCTAs
-ZCTAs_FieldList = [f.name for f in arcpy.ListFields(ZCTAs)] #create field list from input
-Crosswalk = arcpy.GetParameterAsText(3)
-
-###################################################################################################
-# Defining global functions
-###################################################################################################
-
+Crosswalk = arcpy.GetParameterAsText(3) #crosswalk table, or a crosswalk.npz from the crosswalk cache
+StateFile = arcpy.GetParameterAsText(4) #optional state file, reconciles incrementally when given
+Changelog = arcpy.GetParameterAsText(5) or (os.path.splitext(StateFile)[0] + "_changes.csv" if StateFile else "")
+DyadBackend = getBackend(DyadTable) #geodatabase tables are read with arcpy, CSV/Parquet files directly
+ZCTABackend = getBackend(ZCTAs)
+Telemetry = telemetry.RunReport('DyadTableZCTAReconciler') #stage timings written next to the dyad table
+DyadTable_FieldList = DyadBackend.fields(DyadTable) # create field list from input
+ZCTAs_FieldList = ZCTABackend.fields(ZCTAs) #create field list from input
 
 ###################################################################################################
 #Global variables to be used in process
 ###################################################################################################
-DyadRec_field = [f for f in DyadTable_FieldList if 'rec' in f.lower()][0] #find rec_ZCTA field within field list
-DyadProv_field = [f for f in DyadTable_FieldList if 'prov' in f.lower()][0] #find prov_ZCTA field within field list
-ZCTA_field = [f for f in ZCTAs_FieldList if 'ZCTA' in f or 'ZIP' in f][0] #find ZCTA field within field list
-ZCTA_List = [] # list of ZCTAs from ZCTA file
-rec_ZCTAs_Misssing = [] #list of missing rec ZCTAs
-prov_ZCTAs_Misssing = [] #list of misssing prov ZCTAs
+DyadRec_field = findField(DyadTable_FieldList,'rec') #find rec_ZCTA field within field list
+DyadProv_field = findField(DyadTable_FieldList,'prov') #find prov_ZCTA field within field list
+ZCTA_field = findField(ZCTAs_FieldList,['ZCTA','ZIP'],caseSensitive=True) #find ZCTA field within field list
 
-###################################################################################################
-#quickly get sum of visits using numpy array
-###################################################################################################
-VisitArray = arcpy.da.TableToNumPyArray(DyadTable,DyadVisits_Field,skip_nulls=True)
-VisitsTotal = VisitArray[DyadVisits_Field].sum()
-arcpy.AddMessage("{0:,} total visits found in dyad table".format(VisitsTotal))#add total to messages
-del VisitArray #delete visits array, no longer needed
+#add the Dyad_max and VISITS_TOTAL fields if the dyad table doesn't have them yet, the total visits
+#of each recipient go to VISITS_TOTAL so the visits of each dyad are kept
+if "Dyad_max" not in DyadTable_FieldList:
+	DyadBackend.addField(DyadTable,"Dyad_max","SHORT")
+if "VISITS_TOTAL" not in DyadTable_FieldList:
+	DyadBackend.addField(DyadTable,"VISITS_TOTAL","LONG")
 
 ###################################################################################################
 #Build a dictionary of assignments into memory for faster reconciling later
 ###################################################################################################
-Crosswalk_FieldList = [f.name for f in arcpy.ListFields(Crosswalk)]
-Crosswalk_ZipIndex = Crosswalk_FieldList.index([f for f in Crosswalk_FieldList if "zip" in f.lower()][0]) #pull Zip index from field list
-Crosswalk_ZCTAIndex = Crosswalk_FieldList.index([f for f in Crosswalk_FieldList if "zcta" in f.lower()][0]) # pull ZCTA index from field list
-ZipZCTA_Dict = {} #dictionary of assignments
-featureCount = int(arcpy.GetCount_management(Crosswalk).getOutput(0))#get feature count
-
-arcpy.SetProgressor("step","Building dictionary of assignments from crosswalk...",0,featureCount,1)
-with arcpy.da.SearchCursor(Crosswalk,Crosswalk_FieldList) as cursor:
-	for row in cursor:
-		ZipZCTA_Dict[row[Crosswalk_ZipIndex]] = row[Crosswalk_ZCTAIndex]
-		arcpy.SetProgressorPosition()
-
+arcpy.SetProgressorLabel("Building dictionary of assignments from crosswalk...")
+with Telemetry.stage('crosswalk') as stage:
+	if Crosswalk.lower().endswith('.npz'):
+		#the cache already holds the crosswalk as a sorted index
+		Crosswalk_Zips, Crosswalk_ZCTAs = crosswalk.loadIndex(Crosswalk)
+	else:
+		CrosswalkBackend = getBackend(Crosswalk)
+		Crosswalk_FieldList = CrosswalkBackend.fields(Crosswalk)
+		CrosswalkArray = CrosswalkBackend.readTable(Crosswalk,[findField(Crosswalk_FieldList,'zip'),findField(Crosswalk_FieldList,'zcta')])
+		Crosswalk_Zips, Crosswalk_ZCTAs = zcta.crosswalk(CrosswalkArray[CrosswalkArray.dtype.names[0]],
+			CrosswalkArray[CrosswalkArray.dtype.names[1]]) #sorted zip and ZCTA codes to remap the whole table at once
+	stage['rows'] = len(Crosswalk_Zips)
 
 ###################################################################################################
-#create a list of ZCTAs from shapefile
+#create a sorted index of ZCTAs from shapefile
 ###################################################################################################
 arcpy.SetProgressorLabel("Building list of ZCTAs from {0}".format(ZCTAs))
-with arcpy.da.SearchCursor(ZCTAs,ZCTA_field) as cursor:
-	for row in cursor:
-		ZCTA_List.append(row[0])
-
-arcpy.AddMessage(str(len(ZCTA_List)) + " ZCTAs in shapefile")
-
-###################################################################################################
-#Check that all ZCTAs in the dyad table are in the input ZCTA shapefile
-###################################################################################################
-arcpy.SetProgressorLabel("Checking for ZCTAS in Dyad Table not in {0}".format(ZCTAs))
-with arcpy.da.SearchCursor(DyadTable,[DyadRec_field,DyadProv_field]) as cursor:
-	for row in cursor:
-		if str(row[0]) not in ZCTA_List:
-			rec_ZCTAs_Misssing.append(str(row[0]))
-		if str(row[1]) not in ZCTA_List:
-			prov_ZCTAs_Misssing.append(str(row[1]))
-		else:
-			pass
-
-
-ZCTAs_missing = set(chain(rec_ZCTAs_Misssing,prov_ZCTAs_Misssing)) #create a set of unique missing ZCTAs
-arcpy.AddMessage(str(len(ZCTAs_missing)) + " ZCTAs in Dyad Table that aren't in the ZCTA shapefile...")
-
-rec_ZCTAs_Misssing = list(set(rec_ZCTAs_Misssing))#remove duplicates using set, and create a list froms set
-prov_ZCTAs_Misssing = list(set(prov_ZCTAs_Misssing)) #remove duplicates using set, create a list from set
-
-###################################################################################################
-#Reconcile missing recipient ZCTAs in the Dyad Table
-###################################################################################################
-recIndex = DyadTable_FieldList.index([f for f in DyadTable_FieldList if "rec" in f.lower()][0])#get recipient field index
-rec_unresolved = [] # list of those unresolved
-rec_resolved = [] #list of resolved
-Visits_Missed = 0 #track the number of visits
-arcpy.SetProgressor("step","Reconciling recipient ZCTAs...",0,len(rec_ZCTAs_Misssing),1)
-for i in rec_ZCTAs_Misssing:
-	recQuery = DyadRec_field + " = " + i #query
-	with arcpy.da.UpdateCursor(DyadTable,DyadTable_FieldList,recQuery) as cursor:
-		for row in cursor:
-			if str(row[recIndex]) in ZipZCTA_Dict.keys(): #check for entry in the dictionary
-				row[recIndex] = int(ZipZCTA_Dict[str(row[recIndex])]) #reassign if found
-				rec_resolved.append(ZipZCTA_Dict[str(row[recIndex])]) #append the assignment to the resolved list
-				cursor.updateRow(row) #update row
-			else:
-				Visits_Missed += row[DyadTable_FieldList.index("VISITS_DYAD")]
-				rec_unresolved.append(i)
-			arcpy.SetProgressorPosition()
-
-rec_resolved = list(set(rec_resolved))#remove duplicates
-rec_unresolved = list(set(rec_unresolved)) #remove duplicates and create a list
-
-del rec_ZCTAs_Misssing #don't need the orignal list anymore
-###################################################################################################
-#Reconcile missing provider ZCTAs in the Dyad Table
-###################################################################################################
-provIndex = DyadTable_FieldList.index([f for f in DyadTable_FieldList if "prov" in f.lower()][0])#get provider field index
-prov_unresolved = [] #list of those unresolved
-prov_resolved = [] #list of resolved
-arcpy.SetProgressor("step","Reconciling provider ZCTAs...",0,len(prov_ZCTAs_Misssing),1)
-for i in prov_ZCTAs_Misssing:
-	provQuery = DyadRec_field + " = " + i
-	with arcpy.da.UpdateCursor(DyadTable,DyadTable_FieldList,provQuery) as cursor:
-		for row in cursor:
-			if str(row[provIndex]) in ZipZCTA_Dict.keys():
-				row[provIndex] = int(ZipZCTA_Dict[str(row[provIndex])])
-				prov_resolved.append(ZipZCTA_Dict[str(row[provIndex])])
-				cursor.updateRow(row)
-			else:
-				prov_unresolved.append(i)
-
-			arcpy.SetProgressorPosition()
-prov_resolved = list(set(prov_resolved))#remove duplicates
-prov_unresolved = list(set(prov_unresolved))#remove duplicates
-
-del prov_ZCTAs_Misssing #don't need the original list anymore
-arcpy.AddMessage("{0} recipient ZCTAs resolved (found in dyad table with corresponding entry in crosswalk)...".format(len(rec_resolved)))
-arcpy.AddMessage("{0} ZCTAs in Dyad table, but not found in crosswalk...".format(len(rec_unresolved)))
-arcpy.AddMessage("resolved provider ZCTAs: {0}".format(prov_resolved))
-arcpy.AddMessage("unresolved provider ZCTAs: {0}".format(prov_unresolved))
-arcpy.AddMessage("{0:.4%} of visits will be unaccounted for...".format(float(Visits_Missed)/float(VisitsTotal)))
-
-###################################################################################################
-#Check for duplicate entries in the dyayd table, find them, update the visits field accordingly and
-#delete duplicate fields
-###################################################################################################
-arcpy.SetProgressor("step","Checking duplicate recipient ZCTA entries in dyad table...",0,len(rec_resolved),1)
-for i in rec_resolved:
-	recQuery = DyadRec_field + " = " + i #query
-	temp_Rec_List = []
-	#-------------------------------------------------------------------------------------------
-	#Look for duplicate entries of the same recipient and provider. This loop appends all the
-	#providers to a list which will be checked for dupilcate entries
-	#-------------------------------------------------------------------------------------------
-	with arcpy.da.SearchCursor(DyadTable,DyadTable_FieldList,recQuery) as cursor:
-		for row in cursor:
-			temp_Rec_List.append(row[provIndex])
-
-	#look in temp list for repeats (count > 1) and create a new list using set to
-	#remove duplicates
-	prov_Repeats = list(set(x for x in temp_Rec_List if temp_Rec_List.count(x) > 1))
-
-	if not prov_Repeats: #if list is empty pass
-		pass
+with Telemetry.stage('zctaIndex') as stage:
+	ZCTA_Index = checker.zctaIndex(ZCTABackend.readTable(ZCTAs,[ZCTA_field])[ZCTA_field])
+	stage['rows'] = len(ZCTA_Index)
+arcpy.AddMessage(str(len(ZCTA_Index)) + " ZCTAs in shapefile")
+
+###################################################################################################
+#Load the dyad table into memory in a single pass and reconcile it
+###################################################################################################
+#a dyad store is reconciled a block at a time and written back in the same pass, unless it is
+#reconciled incrementally
+StoreInPlace = store.isStore(DyadTable) and not StateFile
+with Telemetry.stage('readDyads') as stage:
+	arcpy.SetProgressorLabel("Loading {0} into memory...".format(DyadTable))
+	Dyads = store.DyadStore(DyadTable) if StoreInPlace else DyadBackend.readTable(DyadTable)
+	stage['rows'] = len(Dyads)
+
+arcpy.SetProgressorLabel("Reconciling recipient and provider ZCTAs...")
+with Telemetry.stage('reconcile') as stage:
+	if StoreInPlace:
+		Report = reconcile.reconcileStore(Dyads,ZCTA_Index,Crosswalk_Zips,Crosswalk_ZCTAs,DyadTable)
+	elif StateFile:
+		State = reconcile.loadState(StateFile)
+		Reconciled, Replaced, Report, GroupDigests = reconcile.reconcileIncremental(Dyads,DyadRec_field,DyadProv_field,
+			DyadVisits_Field,ZCTA_Index,Crosswalk_Zips,Crosswalk_ZCTAs,State['groups'])
+		arcpy.AddMessage("{0} recipient groups changed since the last run, {1:,} rows reconciled".format(
+			Report['groupsChanged'],Report['rowsReconciled']))
 	else:
-		for j in prov_Repeats:
-			maxVisits = 0
-			RowKeepID = 0
-			recProvQuery = DyadRec_field + " = " + str(i) + " AND " + DyadProv_field + " = " + str(j) #query
-			with arcpy.da.UpdateCursor(DyadTable,DyadTable_FieldList,recProvQuery) as cursor:
-				for row in cursor:
-					maxVisits += row[DyadTable_FieldList.index(DyadVisits_Field)]
-					row[DyadTable_FieldList.index(DyadVisits_Field)] = maxVisits
-					RowKeepID = row[0] #get object ID of the row to keep which is the row with the max visits
-					cursor.updateRow(row)
-
-			#remove duplicates
-			recProvQuery = DyadRec_field + " = " + str(i) + " AND " + DyadProv_field + " = " + str(j) #query
-			with arcpy.da.UpdateCursor(DyadTable,DyadTable_FieldList,recProvQuery) as cursor:
-				for row in cursor:
-					#if row isn't the object ID to keep, delete it.
-					if row[0] != RowKeepID:
-						arcpy.SetProgressorLabel("{0} removed, for recipient {1}".format(j,i))
-						cursor.deleteRow()
-
-	arcpy.SetProgressorPosition()
-
-###################################################################################################
-#update number of utilizers, visits, max, and dyad_max fields for recipients that have been resolved
-###################################################################################################
-arcpy.SetProgressor("step","Updating vists, max visits, number of utilizers and max dyad fields for resolved ZCTAs...",0,len(rec_resolved),1)
-for i in rec_resolved:
-	recQuery = DyadRec_field + " = " + i #query
-	maxVisits = 0
-	utilizers = 0
-	#aggregate visits and find the max number of visits
-	with arcpy.da.SearchCursor(DyadTable,DyadTable_FieldList,recQuery) as cursor:
-		for row in cursor:
-			utilizers += row[DyadTable_FieldList.index(DyadVisits_Field)] #aggregate visits for the number of uitlizers
-			if row[DyadTable_FieldList.index(DyadVisits_Field)] > maxVisits:
-				maxVisits = row[DyadTable_FieldList.index(DyadVisits_Field)]
-
-	#update the fields
-	with arcpy.da.UpdateCursor(DyadTable,DyadTable_FieldList,recQuery) as cursor:
-		for row in cursor:
-			row[DyadTable_FieldList.index("MAX_VISITS")] = maxVisits
-			row[DyadTable_FieldList.index("VISITS_DYAD")] = utilizers
-			#assign the max accordingly
-			if row[DyadTable_FieldList.index(DyadVisits_Field)] == maxVisits:
-				row[DyadTable_FieldList.index("Dyad_max")] = 1
-				cursor.updateRow(row)
-			else:
-				row[DyadTable_FieldList.index("Dyad_max")] = 0
-			cursor.updateRow(row)
-
-	arcpy.SetProgressorPosition()
+		Reconciled, Report = reconcile.reconcileDyads(Dyads,DyadRec_field,DyadProv_field,DyadVisits_Field,
+			ZCTA_Index,Crosswalk_Zips,Crosswalk_ZCTAs)
+	stage['rows'] = len(Dyads)
+del Dyads
+
+arcpy.AddMessage("{0:,} total visits found in dyad table".format(Report['visitsTotal']))#add total to messages
+arcpy.AddMessage(str(len(Report['missing'])) + " ZCTAs in Dyad Table that aren't in the ZCTA shapefile...")
+arcpy.AddMessage("{0} recipient ZCTAs resolved (found in dyad table with corresponding entry in crosswalk)...".format(len(Report['recResolved'])))
+arcpy.AddMessage("{0} ZCTAs in Dyad table, but not found in crosswalk...".format(len(Report['recUnresolved'])))
+arcpy.AddMessage("resolved provider ZCTAs: {0}".format(Report['provResolved']))
+arcpy.AddMessage("unresolved provider ZCTAs: {0}".format(Report['provUnresolved']))
+if Report['visitsTotal'] > 0:
+	arcpy.AddMessage("{0:.4%} of visits will be unaccounted for...".format(float(Report['visitsMissed'])/float(Report['visitsTotal'])))
+	#the line above only counts recipients, this one counts providers without a crosswalk entry as well
+	arcpy.AddMessage("{0:.4%} of visits have a recipient or provider that couldn't be resolved...".format(
+		float(Report['visitsLost'])/float(Report['visitsTotal'])))
+arcpy.AddMessage("{0} duplicate entries merged into {1} dyads".format(Report['merged'],Report['mergedPairs']))
+
+###################################################################################################
+#Write the reconciled dyad table back in one pass
+###################################################################################################
+arcpy.SetProgressorLabel("Writing reconciled entries to {0}...".format(DyadTable))
+with Telemetry.stage('writeDyads') as stage:
+	if StoreInPlace:
+		Written = Report['written'] #already written block by block while reconciling
+	elif StateFile:
+		#only the rows of the recipients that were reconciled are replaced, found with IN list
+		#queries on an attribute index of the recipient field
+		DyadBackend.replaceGroups(Reconciled,DyadTable,DyadRec_field,Replaced,index=True)
+		CsvBackend().writeTable(fromRows(['REC','PROV','CHANGE','FIELD','OLD','NEW'],Report['changes']),Changelog)
+		arcpy.AddMessage("{0:,} changes written to {1}".format(len(Report['changes']),Changelog))
+		Written = len(Reconciled)
+	else:
+		DyadBackend.replaceRows(Reconciled,DyadTable)
+		Written = len(Reconciled)
+	stage['rows'] = Written
+arcpy.AddMessage("{0:,} entries written to dyad table".format(Written))
 
 ####################################################################################################
 #update the Base Zipcodes using the crosswalk
 ####################################################################################################
-featureCount = int(arcpy.GetCount_management(ZCTAs).getOutput(0))
-arcpy.SetProgressor('step','updating Base ZCTAs with correct ZCTA assignment',0,featureCount,1)
-with arcpy.da.UpdateCursor(ZCTAs,[ZCTA_field]) as cursor:
-	for row in cursor:
-		try:
-			row[0] = ZipZCTA_Dict[row[0]]
-			cursor.updateRow(row)
-		except KeyError:
-			pass
-		arcpy.SetProgressorPosition()
-
+arcpy.SetProgressorLabel('updating Base ZCTAs with correct ZCTA assignment')
+with Telemetry.stage('updateBaseZCTAs') as stage:
+	if not StateFile:
+		stage['rows'] = ZCTABackend.updateValues(ZCTAs,ZCTA_field,ZCTA_field,Crosswalk_Zips,Crosswalk_ZCTAs)
+	else:
+		#the base ZCTAs only need updating when the crosswalk or the ZCTA layer changed since the last run.
+		#The layer is fingerprinted again after it's updated, so the next run compares against the
+		#updated layer
+		CrosswalkDigest = reconcile.arrayDigest(Crosswalk_Zips,Crosswalk_ZCTAs)
+		ZCTAFingerprint = ZCTABackend.fingerprint(ZCTAs)
+		if CrosswalkDigest != State['crosswalk'] or ZCTAFingerprint != State['zctas']:
+			stage['rows'] = ZCTABackend.updateValues(ZCTAs,ZCTA_field,ZCTA_field,Crosswalk_Zips,Crosswalk_ZCTAs)
+			ZCTAFingerprint = ZCTABackend.fingerprint(ZCTAs)
+		else:
+			arcpy.AddMessage("Crosswalk and ZCTAs unchanged, base ZCTAs already up to date")
+		reconcile.saveState(StateFile,{'groups':GroupDigests,'crosswalk':CrosswalkDigest,'zctas':ZCTAFingerprint})
 
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('DyadTableZCTAReconciler',os.path.dirname(DyadTable)))))
 arcpy.AddMessage("Process Complete!")
@@ -6,7 +6,8 @@
 # Link    		: http://www.ppc.uiowa.edu
 # Date    		: 2015-05-21 11:00:38
 # Version		: $1.0$
-# Description	:
+# Description	: Builds a dyad table from points with member and provider zip fields. The counting
+# is done by servicearea.dyads, this script is the toolbox wrapper.
 #--------------------------------------------------------------------------------------------------
 
 ###################################################################################################
@@ -15,8 +16,8 @@
 import os
 import arcpy
 from arcpy import env
-from operator import itemgetter
-from collections import defaultdict
+from servicearea import dyads, getBackend, telemetry
+from servicearea.backends import readPairs
 
 ###################################################################################################
 #Input Variable loading and environment declaration
@@ -25,63 +26,47 @@ points = arcpy.GetParameterAsText(0) #points with provider zip field
 memZip = arcpy.GetParameterAsText(1) #member zip field
 provZip = arcpy.GetParameterAsText(2) # provider zip field
 tableName = arcpy.GetParameterAsText(3) #empty table to be populated
-###################################################################################################
-# Defining global functions
-###################################################################################################
+processes = int(arcpy.GetParameterAsText(4) or 0) #number of processes to count with, all cores if not given
+backend = getBackend(points) #point feature classes are read with arcpy, CSV/Parquet files directly
+Telemetry = telemetry.RunReport('InitialDyadTableCreator') #stage timings written next to the dyad table
 
-#create dyad table in same workspace as input data and add fields
+#dyad table goes in same workspace as input data
 #---------------------------------------------------------------------------
 outputPath = os.path.dirname(points) #get directory of points file
 arcpy.AddMessage('outputPath: {0}'.format(outputPath)) # print path to tool
-dyadTable = arcpy.CreateTable_management(outputPath,tableName) #create table
-table_ls = ['REC_ZIP','PROV_ZIP','VISITS_DYAD','MAX_VISITS','VISITS_TOTAL'] #list of fields for table
-
-#add fields from table_ls to to dyadTable
-#---------------------------------------------------------------------------
-for field in table_ls:
-	arcpy.AddField_management(dyadTable,field,'LONG')
 
 ###################################################################################################
 #Global variables to be used in process
 ###################################################################################################
-memDict = defaultdict(list) #dictionary that will have a list of providers for each member zip/ZCTA
 fieldList = [memZip,provZip] #create list for cursors
-counterDict = defaultdict(list)#dictionary of
+
 ###################################################################################################
-#create a dictionary of member zip codes and all the provider zips for each member zip
+#count the visits for each member zip and provider zip pair. The points are split into chunks
+#counted in parallel, only the distinct pairs are held in memory, not every point
 ###################################################################################################
-featureCount = int(arcpy.GetCount_management(points).getOutput(0))
-arcpy.SetProgressor('step','getting count of all the providers for each member zip code...',0,featureCount,1)
-with arcpy.da.SearchCursor(points,fieldList) as cursor:
-	for row in cursor:
-		memDict[row[0]].append(row[1])
-		arcpy.SetProgressorPosition()
-arcpy.AddMessage('{0} member zip codes found'.format(len(memDict)))
-
+arcpy.SetProgressorLabel('getting count of all the providers for each member zip code...')
+processes = processes or dyads.multiprocessing.cpu_count()
+with Telemetry.stage('countPairs') as stage:
+	chunks = backend.pairChunks(points,fieldList,processes*4) #several chunks per process to balance the load
+	pairCounts = dyads.countPairsParallel(readPairs,chunks,processes)
+	stage['rows'] = sum(pairCounts.values())
 
 ####################################################################################################
-#find max visits and total visits for each member zip
-####################################################################################################
-#arcpy.SetProgressor('step','getting number of visits and max visits for each member zip',0,len(memDict),1)
-#for key, ls in memDict.iteritems():
-#	temp = dict((i, ls.count(i)) for i in ls)
-#	counterDict[key].extend((sum(temp.values()),max(temp.values())))
-#	arcpy.SetProgressorLabel('{0} max visits, {1} total visits for {2}'.format(max(temp.values()),sum(temp.values()),key))
-#	arcpy.SetProgressorPosition()
-#
-####################################################################################################
-#insert entries into dyad table
+#find max visits and total visits for each member zip and write the dyad table
 ####################################################################################################
-arcpy.SetProgressor('step','Building Dyad Table....',0,len(memDict),1)
-with arcpy.da.InsertCursor(dyadTable,table_ls) as cursor:
-	for key, ls in memDict.iteritems(): #pull each member zip from member dict
-		temp = dict((i,ls.count(i))for i in ls) #temp dictionary of the count
-		for k, v in temp.iteritems(): #
-			cursor.insertRow((key,k,v,max(temp.values()),sum(temp.values())))
-		arcpy.SetProgressorPosition()
+arcpy.SetProgressorLabel('Building Dyad Table....')
+with Telemetry.stage('writeTable') as stage:
+	DyadRows = dyads.dyadRows(pairCounts)
+	#a table name ending in .dyads writes an on disk dyad store instead of a geodatabase table
+	dyadTable = os.path.join(outputPath,tableName)
+	getBackend(dyadTable).writeTable(dyads.dyadTable(DyadRows),dyadTable)
+	stage['rows'] = len(DyadRows)
+arcpy.AddMessage('{0} member zip codes found'.format(len(set(row[0] for row in DyadRows))))
+arcpy.AddMessage('{0} dyads written to {1}'.format(len(DyadRows),tableName))
 
 
 ###################################################################################################
 #Final Output and cleaning of temp data/variables
 ###################################################################################################
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('InitialDyadTableCreator',outputPath))))
 arcpy.AddMessage("Process complete!")
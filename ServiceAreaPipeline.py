@@ -0,0 +1,100 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : ServiceAreaPipeline.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Runs the Tie Resolver, Dyad Table ZCTA Checker and Dyad Table ZCTA Reconciler steps
+# as one pipeline, downloading the crosswalk first when it is given as a URL. The ZCTA layer,
+# crosswalk and dyad table are read once and passed between the steps in memory, only the resolved
+# ties CSV and the reconciled dyad table are written. Steps whose inputs haven't changed since the
+# last run are skipped. The pipeline is built by servicearea.pipeline, this script is the toolbox
+# wrapper.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import arcpy
+from servicearea import getBackend, ingest, telemetry
+from servicearea.pipeline import CrosswalkDownload, preprocessingPipeline
+
+###################################################################################################
+#Input Variable loading and environment declaration
+###################################################################################################
+ZCTAs = arcpy.GetParameterAsText(0) #ZCTAs
+Crosswalk = arcpy.GetParameterAsText(1) #crosswalk table, a crosswalk.npz from the crosswalk cache or the URL of the crosswalk
+DyadTable = arcpy.GetParameterAsText(2) #dyad table
+OutputLocation = arcpy.GetParameterAsText(3) #workspace the reconciled dyad table is written to
+ReconciledName = arcpy.GetParameterAsText(4) or os.path.splitext(os.path.basename(DyadTable))[0] + "_Reconciled"
+tieTable = arcpy.GetParameterAsText(5) #optional table of recipient provider ties
+tieOutput = arcpy.GetParameterAsText(6) or "ResolvedTies.csv" #name of the resolved ties CSV
+nbrTable = arcpy.GetParameterAsText(7) #optional table of polygon neighbors
+DyadVisits_Field = arcpy.GetParameterAsText(8) or "VISITS_DYAD"
+BlockSize = int(arcpy.GetParameterAsText(9) or 100000) #tie rows resolved at a time
+Force = arcpy.GetParameterAsText(10).lower() == 'true' #run every step even if nothing has changed
+
+#the state of the last run is kept next to the output workspace, not inside a geodatabase
+StateFolder = os.path.dirname(OutputLocation) if OutputLocation.lower().endswith('.gdb') else OutputLocation
+StatePath = arcpy.GetParameterAsText(11) or os.path.join(StateFolder,'ServiceAreaPipeline.json')
+Processes = int(arcpy.GetParameterAsText(12) or 1) #processes to resolve ties with, serially if not given
+CacheLocation = arcpy.GetParameterAsText(13) or os.path.join(StateFolder,'CrosswalkCache') #folder of crosswalks downloaded from a URL
+
+if not tieOutput.lower().endswith('.csv'):
+	tieOutput = tieOutput + '.csv'
+TieFolder = StateFolder if OutputLocation.lower().endswith('.gdb') else OutputLocation #CSVs can't go in a geodatabase
+ReconciledTable = os.path.join(OutputLocation,ReconciledName)
+
+#a crosswalk given as a URL is downloaded by the pipeline and re-imported when it changes
+if ingest.isUrl(Crosswalk):
+	CrosswalkSource = (CrosswalkDownload(CacheLocation,telemetry.Progress(lambda size: arcpy.SetProgressorLabel(
+		"{0:,} kb of the crosswalk downloaded...".format(size//1024))).update),Crosswalk)
+else:
+	CrosswalkSource = (getBackend(Crosswalk),Crosswalk)
+
+###################################################################################################
+#Build the pipeline and run the steps that are out of date
+###################################################################################################
+Pipeline = preprocessingPipeline((getBackend(ZCTAs),ZCTAs),CrosswalkSource,
+	(getBackend(DyadTable),DyadTable),(getBackend(ReconciledTable),ReconciledTable),
+	tieTable=tieTable,tieOutput=os.path.join(TieFolder,tieOutput),
+	nbrTable=(getBackend(nbrTable),nbrTable) if nbrTable else None,visitsField=DyadVisits_Field,
+	blockSize=BlockSize,statePath=StatePath,
+	tieProgress=telemetry.Progress(lambda rows: arcpy.SetProgressorLabel("{0:,} tie rows processed...".format(rows))).update,
+	tieProcesses=Processes)
+
+Telemetry = telemetry.RunReport('ServiceAreaPipeline') #stage timings written next to the state file
+Report = Pipeline.run(force=Force,progress=lambda name: arcpy.SetProgressorLabel("Running {0}...".format(name)),runReport=Telemetry)
+
+###################################################################################################
+#Final Output
+###################################################################################################
+for name in Pipeline.order():
+	if Report[name]['status'] != 'unused':
+		arcpy.AddMessage("{0}: {1}".format(name,Report[name]['status']))
+
+Check = Report['check']['summary']
+if Check:
+	arcpy.AddMessage("{0} ZCTAs in Dyad Table that aren't in the ZCTA shapefile".format(len(Check['missing'])))
+	if Check['visitsTotal'] > 0 and Check['visitsMissed'] > 0:
+		arcpy.AddWarning("{0:,.0f} of {1:,.0f} visits ({2:.4%}) are in dyads with missing ZCTAs".format(
+			Check['visitsMissed'],Check['visitsTotal'],Check['visitsMissed']/Check['visitsTotal']))
+
+Reconciled = Report['reconcile']['summary']
+if Reconciled:
+	arcpy.AddMessage("{0} recipient ZCTAs resolved, {1} not found in crosswalk".format(
+		len(Reconciled['recResolved']),len(Reconciled['recUnresolved'])))
+	arcpy.AddMessage("{0} duplicate entries merged into {1} dyads, {2:,} entries written to {3}".format(
+		Reconciled['merged'],Reconciled.get('mergedPairs',0),Reconciled['written'],ReconciledTable))
+
+if tieTable and Report['ties']['summary']:
+	Ties = Report['ties']['summary']
+	arcpy.AddMessage("{0} ties found, {1} resolved by adjacency and {2} by distance".format(Ties['ties'],Ties['adjacent'],Ties['nearest']))
+	if Ties['unresolved']:
+		arcpy.AddWarning("{0} ties could not be resolved, centroids not found for: {1}".format(len(Ties['unresolved']),Ties['unresolved']))
+
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('ServiceAreaPipeline',StateFolder))))
+arcpy.AddMessage("Process complete!\nPipeline state: {0}".format(StatePath))
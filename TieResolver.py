@@ -11,6 +11,7 @@
 # common boundary with the recipient ZCTA. If none of the candidate provider
 # ZCTAs are adjacent, then the nearest is selected calculating the distance
 # between the rec_ZCTA and the prov_ZCTA
+# The resolving is done by servicearea.ties, this script is the toolbox wrapper.
 # ---------------------------------------------------------------------------
 
 ###################################################################################################
@@ -19,17 +20,15 @@
 
 import arcpy
 from arcpy import env
-import math
-import csv
 import os
-from operator import itemgetter
-from collections import defaultdict
+from servicearea import store, ties, tiecache, getBackend, telemetry
+from servicearea.tables import findField
 
 ###################################################################################################
 #Input Variable loading and environment declaration
 ###################################################################################################
-tieTable = arcpy.GetParameterAsText(0) #table of recipient provider ties
-nbrTable = arcpy.GetParameterAsText(1) #table of polygon neighbors generated from ZCTAs
+tieTable = arcpy.GetParameterAsText(0) #table of recipient provider ties, or a dyad store to find them in
+nbrTable = arcpy.GetParameterAsText(1) #optional table of polygon neighbors, built from the ZCTA geometries when not given
 ZCTAs = arcpy.GetParameterAsText(2) #ZCTAs input
 outputLocation = arcpy.GetParameterAsText(3) #location of output file
 outFile = arcpy.GetParameterAsText(4) #name of ouput file
@@ -42,196 +41,111 @@ outFile = os.path.join(outputLocation,outFile) #concantenate path and file name
 env.workspace = arcpy.GetParameterAsText(5)
 env.overwriteOutput = True
 
-###################################################################################################
-# Defining global functions
-###################################################################################################
-
-#define function that will be used to calculate the distance between paired points. Cursor data will be fed into this
-def distanceXY(lat1, long1, lat2, long2):
-
-    # Convert latitude and longitude to
-    # spherical coordinates in radians.
-    degrees_to_radians = math.pi/180.0
-
-    # phi = 90 - latitude
-    phi1 = (90.0 - lat1)*degrees_to_radians
-    phi2 = (90.0 - lat2)*degrees_to_radians
-
-    # theta = longitude
-    theta1 = long1*degrees_to_radians
-    theta2 = long2*degrees_to_radians
-
-    cos = (math.sin(phi1)*math.sin(phi2)*math.cos(theta1 - theta2) + math.cos(phi1)*math.cos(phi2))
-    arc = math.acos(cos)
-
-    #multiple by 3960 to get miles
-    arc = arc *3960
-    return arc
-
-###################################################################################################
-#Global variables to be used in process
-###################################################################################################
-tempDict = defaultdict(list) #establish default dictionary to be populated with all csv entries
-tieDict = {} #dictionary that will keep just ties
-resolvedDict = {} #dictionary to contain resolved/matched ties
-nbrTable_FieldList = [f.name for f in arcpy.ListFields(nbrTable)]
-ZCTAs_FieldList = [f.name for f in arcpy.ListFields(ZCTAs)]
-outList = [] # output list of entries that will be written to output CSV
+#number of rows resolved and written at a time, memory is bounded by this and the largest recipient group
+BlockSize = int(arcpy.GetParameterAsText(6) or 100000)
+#optional composite tie break policy, e.g. "border:2, distance:1, visits:0.5". The tool's rule is used when blank
+Policy = ties.parsePolicy(arcpy.GetParameterAsText(7))
+#optional number of ranked candidates of every tie to write to <output>_ranked.csv
+TopK = int(arcpy.GetParameterAsText(8) or 0)
+RankFile = os.path.splitext(outFile)[0] + '_ranked.csv' if TopK > 0 else None
+#number of processes to resolve blocks of ties with, resolved serially if not given
+Processes = int(arcpy.GetParameterAsText(9) or 1)
+#optional tie cache file, ties resolved by an earlier run against the same ZCTAs aren't resolved again
+CacheFile = arcpy.GetParameterAsText(10)
+CacheSize = int(arcpy.GetParameterAsText(11) or tiecache.MaxEntries) #ties kept in the cache
+Telemetry = telemetry.RunReport('TieResolver') #stage timings written next to the output CSV
+
+#a dyad store can be given in place of the tie table. Its ties are found from the mapped columns a
+#block of recipient groups at a time and written to <store name>_ties.csv in the output location,
+#which is then resolved like any other tie table
+if store.isStore(tieTable):
+	with Telemetry.stage('findTies') as stage:
+		arcpy.SetProgressorLabel("Finding ties in {0}...".format(tieTable))
+		dyadStore = tieTable
+		tieTable = os.path.join(outputLocation,os.path.splitext(os.path.basename(dyadStore.rstrip('/\\')))[0] + '_ties.csv')
+		stage['rows'] = ties.storeTieCsv(store.DyadStore(dyadStore),tieTable)
+	arcpy.AddMessage("{0:,} tied rows found in {1}, written to {2}".format(stage['rows'],dyadStore,tieTable))
 
 ###################################################################################################
 #Pull field variables from field lists
 ###################################################################################################
-src_ZCTA_field = [f for f in nbrTable_FieldList if 'src_' in f][0] #find src field within field list
-nbr_ZCTA_field = [f for f in nbrTable_FieldList if 'nbr_' in f][0] #find nbr field within field list
-ZCTA_field = [f for f in ZCTAs_FieldList if 'ZCTA' in f or 'ZIP' in f][0] #find ZCTA field within field list
-length_Field = [f for f in nbrTable_FieldList if 'LENGTH' in f][0] #find LENGTH field within field list
-
-###################################################################################################
-#read in input CSV and create dictionaries of tied Rec ZCTAs
-###################################################################################################
-
-#open tieTable csv as reader csv and create a temporary dictionary of rec and prov ZCTAs from rows
-with open(tieTable, "rb") as inFile:
-	rowCount = 0
-	#sniff into 10kb of csv to check dialect create a reader using the identified dialect and
-	dialect = csv.Sniffer().sniff(inFile.read(10*1024))
-	inFile.seek(0)
-	reader = csv.reader(inFile, dialect) #reader object
-	header = reader.next() #create header
-
-	for row in reader:
-		tempDict[row[0]].append(row[1])
-		outList.append(row)
-		rowCount +=1
-
-#create new dictionary by iterating through current one and checking for value lists greater than 1
-#lists greater than 1 indicate a tie
-tieDict = {}
-for key,value in tempDict.iteritems():
-	if len(value) > 1:
-		tieDict[key] = value
-arcpy.AddMessage(str(len(tieDict)) + " ties found in data... ")
-
-###################################################################################################
-#Find best provider match where providers are
-#adjacent/touching recipient ZCTA
-###################################################################################################
-
-#main loop to iterate through the ties dictionary and
-arcpy.SetProgressor("step","Checking for matching provider ZCTAs adjacent to recipients...",0,len(tieDict),1)
-for key,values in tieDict.iteritems():
-	srcQuery =  src_ZCTA_field + " = '" + str(key) + "'"
-	dyadBorder = 0
-
-	#first check that the rec and prov don't match. If they do, consider the tie resolved by making the provider
-	#zcta that of the recipient
-	if key in values:
-		resolvedDict[key] = values[values.index(key)]
-
+ZCTABackend = getBackend(ZCTAs) #feature classes are read with arcpy, CSV/Parquet files with WKT directly
+ZCTA_field = findField(ZCTABackend.fields(ZCTAs),['ZCTA','ZIP'],caseSensitive=True) #find ZCTA field within field list
+
+###################################################################################################
+#Load the neighbor and centroid data used to resolve ties into memory once
+###################################################################################################
+
+#only the neighbors and centroids of the ZCTAs in the tie table are needed. They're read with a few
+#IN list queries (with an attribute index on the key field) rather than the whole layer. With a tie
+#cache, the ties resolved by an earlier run against the same geometry are taken from the cache and
+#only the ZCTAs of the other ties are needed
+with Telemetry.stage('tieZCTAs') as stage:
+	arcpy.SetProgressorLabel("Finding the ZCTAs in {0}...".format(tieTable))
+	if CacheFile:
+		Geometry = [ZCTABackend.fingerprint(ZCTAs)] + ([getBackend(nbrTable).fingerprint(nbrTable)] if nbrTable else [])
+		Cache = tiecache.TieCache(CacheFile,":".join(str(g) for g in Geometry),Policy,CacheSize)
+		if Cache.invalidated:
+			arcpy.AddMessage("ZCTA geometry changed since the tie cache was written, every tie will be resolved")
+		Tie_Digests = ties.tieDigests(tieTable,bool(Policy and Policy.get('visits')),BlockSize)
+		#every tie is ranked when its candidates are written out, the cache is only added to
+		Cached = {} if RankFile else Cache.lookup(Tie_Digests)
+		Tie_ZCTAs = ties.tieZCTAs(tieTable,set(rec for rec in Tie_Digests if rec not in Cached))
+		arcpy.AddMessage("{0} of {1} ties found in the tie cache".format(len(Cached),len(Tie_Digests)))
 	else:
-		#create search cursor that will look through the neighbor table first.
-		#in the future look to see if neighbors and shared boreder length can be identified
-		#using geomtries instead of a bulky neighbor table
-		with arcpy.da.SearchCursor(nbrTable,nbrTable_FieldList,srcQuery) as cursor:
-			for row in cursor:
-				if row[nbrTable_FieldList.index(nbr_ZCTA_field)] in values:
-					if row[nbrTable_FieldList.index(length_Field)] > dyadBorder:
-						dyadBorder = row[nbrTable_FieldList.index(length_Field)]
-						provZCTA = row[nbrTable_FieldList.index(nbr_ZCTA_field)]
-						arcpy.SetProgressorLabel("Match Found!")
-						#resolvedDict[key] = provZCTA
-		if dyadBorder > 0:
-			#create match from the rec and provider sharing the most boundary length
-			resolvedDict[key] = provZCTA
-	arcpy.SetProgressorPosition() #update progressor positon
-
-arcpy.AddMessage(str(len(resolvedDict)) + " ties resolved by finding martching or adjacent provider ZCTAs..." )
-
-
-#create set of those where neighbor search is needed because provider ZCTAS
-#aren't adjacent.  Use iteritems to iterate through a dictionary correctly.
-for key,value in resolvedDict.iteritems():
-	if tieDict.has_key(key):
-		#if key is in resolved dictionary, pop identified key from tie dictionary and keep none of the values
-		tieDict.pop(key,None)
-
-arcpy.AddMessage(str(len(tieDict)) + " remaining ties to be resolved by finding nearest provider ZCTA...")
-
-###################################################################################################
-#Find best provider match - being the closest provider to the recipient ZCTA based on the
-#distance between recipient and candidate provider centroid
-###################################################################################################
-
-#loop through remaining ties to find the nearest provider ZCTA
-arcpy.SetProgressor('step','finding nearest provider ZCTAs for remaining ties...',0,len(tieDict),1)
-for key,values in tieDict.iteritems():
-	tempDict = {} #temporary dictionary to track the best recipient provider match
-	recQuery = ZCTA_field + " = '" + str(key) + "'" #query to be used for search cursor
-	provDistance = 1e309 #check variable for distance checking. set to infinity for each key value
-
-	#get recipient coordinates using Shape@TRUECENTROID
-	with arcpy.da.SearchCursor(ZCTAs,["ZCTA5CE10","SHAPE@TRUECENTROID"],recQuery) as cursor:
-		for row in cursor:
-			recCoord = row[1]
-			recX = recCoord[0] #rec lat/X var
-			recY = recCoord[1] #rec lon/Y var
-
-	#-------------------------------------------------------------------------------------------
-	#iterate through provider zctas to find coordinates and pass them through the
-	#distance function.
-	#-------------------------------------------------------------------------------------------
-	for value in values:
-		provQuery = ZCTA_field + " = '" + str(value) + "'" #queary to be used for search cursor
-		with arcpy.da.SearchCursor(ZCTAs,[ZCTA_field,"SHAPE@TRUECENTROID"],provQuery) as cursor:
-			for row in cursor:
-				provCoord = row[1] #pull coordinate pairs
-				provX = provCoord[0] #prov lat/X var
-				provY = provCoord[1] #prov long/Y var
-
-				#feed coordinates into distanceXY funcation to calculate distance between the two pairs
-				distance = distanceXY(recX,recY,provX,provY)
-				if distance < provDistance:
-					provDistance = distance # declare newly caluclate distance as the minimum distance
-					tempDict[key] = value #reassign recipient and provider paring based on caluclation
-
-	resolvedDict.update(tempDict)#update the resovled dictionary with the best fitting pair
-	arcpy.SetProgressorPosition() #update progressor position through each iteration
-
-
-
-###################################################################################################
-#write final output file to CSV
-###################################################################################################
-
-arcpy.SetProgressor("step", "writing new CSV with all ties resolved",0,rowCount,1)
-
-#open tieTable csv as reader csv and create a temporary dictionary of rec and prov ZCTAs from rows
-readerFile =  open(tieTable, "rb")
-dialect = csv.Sniffer().sniff(readerFile.read(10*1024)) #sniff into 10kb of csv to check dialect create a reader using the identified dialect and
-readerFile.seek(0) #not sure what this does, but it's important
-reader = csv.reader(readerFile, dialect) #reader object using snieefed dialect
-header = reader.next() #create header
-
-outCSV = open(outFile, 'wb') #open writer object
-writer = csv.writer(outCSV,dialect) #writer object using the reader dialect
-writer.writerow(header) #write header
-
-
-for row in reader:
-	if row[0] not in resolvedDict: #if rec ZCTA is not in the resolved Dictionary, just write the row
-		writer.writerow(row)
-
-	elif resolvedDict[row[0]] == row[1]: #if resolved dictionary value for key is equal to prov_ZCTA, write row
-		writer.writerow(row)
-
+		Cached = None
+		Tie_ZCTAs = ties.tieZCTAs(tieTable)
+	stage['rows'] = len(Tie_ZCTAs)
+
+#shared border lengths are built once and held in memory so each tie is a dictionary lookup
+with Telemetry.stage('borders') as stage:
+	if nbrTable:
+		arcpy.SetProgressorLabel("Loading neighbor table {0}...".format(nbrTable))
+		nbrBackend = getBackend(nbrTable)
+		nbrTable_FieldList = nbrBackend.fields(nbrTable)
+		nbrSrc_field = findField(nbrTable_FieldList,'src_',True)
+		Border_Dict = ties.bordersFromTable(nbrBackend.readKeys(nbrTable,nbrSrc_field,Tie_ZCTAs,index=True),nbrSrc_field,
+			findField(nbrTable_FieldList,'nbr_',True),findField(nbrTable_FieldList,'LENGTH',True))
 	else:
-		pass #pass, nothing to see hear, not even a slight weapons malfunction
-
-	arcpy.SetProgressorPosition() #udpate progressor position
-
-#close csv files.
-outCSV.close()
-readerFile.close()
-
-
+		arcpy.SetProgressorLabel("Finding adjacent ZCTAs and shared border lengths from {0}...".format(ZCTAs))
+		Border_Dict = ties.sharedBorders(ZCTABackend.readPolygons(ZCTAs,ZCTA_field,Tie_ZCTAs))
+	stage['rows'] = len(Border_Dict)
+arcpy.AddMessage("{0} ZCTAs with adjacent neighbors found".format(len(Border_Dict)))
+
+with Telemetry.stage('centroids') as stage:
+	arcpy.SetProgressorLabel("Loading ZCTA centroids from {0}...".format(ZCTAs))
+	Centroid_ZCTAs, Centroid_Coords = ZCTABackend.readCentroids(ZCTAs,ZCTA_field,Tie_ZCTAs)
+	stage['rows'] = len(Centroid_ZCTAs)
+
+###################################################################################################
+#Stream the input CSV one recipient group at a time. Ties are resolved and written out a block of
+#groups at a time so the whole file is never held in memory
+###################################################################################################
+arcpy.SetProgressor("default","Resolving ties and writing new CSV...")
+Progress = telemetry.Progress(lambda rows: arcpy.SetProgressorLabel("{0:,} rows processed...".format(rows)))
+with Telemetry.stage('resolveTies') as stage:
+	Stats = ties.resolveTieCsv(tieTable,outFile,Border_Dict,Centroid_ZCTAs,Centroid_Coords,BlockSize,progress=Progress.update,
+		policy=Policy,rankPath=RankFile,topK=TopK,processes=Processes,cached=Cached)
+	stage['rows'] = Stats['rows']
+
+#the new resolutions are added to the cache, its hit and miss counts go in the run report
+if CacheFile:
+	with Telemetry.stage('tieCache') as stage:
+		Cache.store(Tie_Digests,Stats['resolved'])
+		Cache.save()
+		stage.update(Cache.counts())
+		stage['rows'] = Cache.stored
+
+if Stats['sorted']:
+	arcpy.AddMessage("Input wasn't grouped by recipient ZCTA and was sorted first...")
+arcpy.AddMessage(str(Stats['ties']) + " ties found in data... ")
+arcpy.AddMessage(str(Stats['adjacent']) + " ties resolved by finding martching or adjacent provider ZCTAs..." )
+arcpy.AddMessage(str(Stats['nearest']) + " ties resolved by finding nearest provider ZCTA...")
+if Stats['unresolved']:
+	arcpy.AddWarning("{0} ties could not be resolved, centroids not found for: {1}".format(len(Stats['unresolved']),Stats['unresolved']))
+
+if RankFile:
+	arcpy.AddMessage("Top {0} candidates of every tie written to {1}".format(TopK,RankFile))
+
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('TieResolver',outputLocation))))
 arcpy.AddMessage("Process complete!\n" + "Output csv location: " + str(os.path.realpath(outFile)))
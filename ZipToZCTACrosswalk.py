@@ -6,9 +6,12 @@
 # Link    		: http://www.ppc.uiowa.edu
 # Date    		: 2015-01-28 15:50:59
 # Version		: $1.0$
-# Description	: Asks user to input a URL where the crosswalk table is located and uses urllib to
-# download the table and import it to a geodatabase. All instances of Zip Codes in Iowa are found
-# and written to a new table named by the user. The temporary national table is deleted.
+# Description	: Asks user to input a URL where the crosswalk table is located, downloads it in
+# resumable chunks and reads the zip, state and ZCTA columns straight from the spreadsheet or CSV
+# (servicearea.ingest). All instances of Zip Codes in the requested states (Iowa by default) are
+# found in a single pass and written to a new table for each state, named by the user.
+# The imported crosswalk is cached locally and only re-imported when the downloaded file changes.
+# The caching and state extraction is done by servicearea.crosswalk, this script is the toolbox wrapper.
 #-------------------------------------------------------------------------------------------------
 
 ###################################################################################################
@@ -16,8 +19,9 @@
 ###################################################################################################
 import os
 import arcpy
-import urllib #used to download file from url
 from arcpy import env
+from servicearea import ArcpyBackend, crosswalk as CrosswalkCache, getBackend, ingest, reconcile, telemetry
+from servicearea.tables import findField
 
 ###################################################################################################
 #Input Variable loading and environment declaration
@@ -27,6 +31,16 @@ TableLocation = os.path.realpath(str(arcpy.GetParameter(1)))#where the Zip to ZC
 TableName = str(arcpy.GetParameterAsText(2)) #name of the final table
 OutputLocation = arcpy.GetParameterAsText(3) #location where table will be saved
 ZipCodes = arcpy.GetParameterAsText(4)#Zip Codes
+CacheLocation = arcpy.GetParameterAsText(5) or os.path.join(TableLocation,'CrosswalkCache') #folder of cached crosswalks
+Offline = arcpy.GetParameterAsText(6).lower() == 'true' #use the cached crosswalk without downloading
+States = [s.strip().upper() for s in (arcpy.GetParameterAsText(7) or 'IA').split(';') if s.strip()] #state abbreviations to extract
+Telemetry = telemetry.RunReport('ZipToZCTACrosswalk') #stage timings written next to the downloaded crosswalk
+
+#one output table per state, the user's table name is used as is when there's only one state
+if len(States) == 1:
+	StateTableNames = {States[0]:TableName}
+else:
+	StateTableNames = dict((state,"{0}_{1}".format(TableName,state)) for state in States)
 
 ###################################################################################################
 #Retrieve the most recent version of the crosswalk and put in user specified directory
@@ -34,78 +48,111 @@ ZipCodes = arcpy.GetParameterAsText(4)#Zip Codes
 crosswalkName = url.split('/')[-1]#file name split at the last / to name it
 crosswalk = os.path.join(TableLocation,crosswalkName) #join path and name of the crosswalk
 arcpy.AddMessage("Native crosswalk location: {0} \nCrosswalk name: {1}".format(TableLocation,crosswalkName))
-arcpy.SetProgressorLabel("Downloading most recent version of the crosswalk...")
-urllib.urlretrieve(url,crosswalk) #retrieve actual crosswalk from the url
+CacheMeta = CrosswalkCache.loadMeta(CacheLocation,url) #metadata of the cached copy, None if not cached
+NationalArray = None #zip, state and ZCTA columns of the national crosswalk once parsed
 
-###################################################################################################
-#Convert excel Table in geodatabase, cull through it for all the Iowa Zip Codes and write them to
-#to a new table
-###################################################################################################
-arcpy.SetProgressorLabel("Exporting excel file to table in geodatabase...")
-TempTable = os.path.join(OutputLocation,'Temp_National_Table') #join path and name for the temp table
-NationalTable = arcpy.ExcelToTable_conversion(crosswalk,TempTable) #create temporary table
-NationalTable_FieldList = [f.name for f in arcpy.ListFields(NationalTable)] #create field list from table
-State_Field = [f for f in NationalTable_FieldList if "STATE" in f or "State" in f][0] #find state field
-Zip_Index = NationalTable_FieldList.index([f for f in NationalTable_FieldList if "ZIP" in f][0])
-ZCTA_Index = NationalTable_FieldList.index([f for f in NationalTable_FieldList if "ZCTA" in f][0])
-arcpy.AddMessage("State field found, named: {0}".format(State_Field))
+if not Offline:
+	arcpy.SetProgressorLabel("Downloading most recent version of the crosswalk...")
+	DownloadProgress = telemetry.Progress(lambda size: arcpy.SetProgressorLabel("{0:,} kb of the crosswalk downloaded...".format(size//1024)))
+	Download = ingest.Download(url,crosswalk,progress=DownloadProgress.update) #resumed from crosswalk.part when an earlier run was cut off
+	try:
+		with Telemetry.stage('download') as stage:
+			if ingest.isCsv(crosswalk):
+				NationalArray = CrosswalkCache.readCrosswalk(ingest.csvRows(Download)) #parsed as it arrives
+				stage['rows'] = len(NationalArray)
+			else:
+				Download.run()
+	except IOError as e:
+		if CacheMeta is None:
+			raise
+		arcpy.AddWarning("Crosswalk couldn't be downloaded ({0}), using the cached copy".format(e))
+		Offline = True
+	else:
+		if Download.resumed:
+			arcpy.AddMessage("Download resumed after {0:,} bytes".format(Download.resumed))
+elif CacheMeta is None:
+	raise IOError("No cached crosswalk found for {0} in {1}".format(url,CacheLocation))
 
-ZipCount = 0 #tracking variable for number of Zips in Iowa
+###################################################################################################
+#Read the zip, state and ZCTA columns of the crosswalk when its content has changed since it was
+#last cached, otherwise load the cached copy
+###################################################################################################
+ContentHash = CacheMeta['sha1'] if Offline else Download.sha1
+if CacheMeta is not None and CacheMeta['sha1'] == ContentHash:
+	arcpy.AddMessage("Crosswalk unchanged since {0}, loading cached copy...".format(CacheMeta['imported']))
+	with Telemetry.stage('loadCache') as stage:
+		NationalArray = CrosswalkCache.loadCrosswalk(CacheLocation,url)
+		stage['rows'] = len(NationalArray)
+	State_Field = CacheMeta['stateField']
+else:
+	with Telemetry.stage('import') as stage:
+		if NationalArray is None and ingest.isXlsx(crosswalk):
+			arcpy.SetProgressorLabel("Reading zip, state and ZCTA columns from the spreadsheet...")
+			NationalArray = CrosswalkCache.readCrosswalk(ingest.xlsxRows(crosswalk))
+		elif NationalArray is None:
+			#older .xls spreadsheets can't be read row by row, they go through a temporary table
+			arcpy.SetProgressorLabel("Exporting excel file to table in geodatabase...")
+			TempTable = os.path.join(OutputLocation,'Temp_National_Table') #join path and name for the temp table
+			NationalTable = arcpy.ExcelToTable_conversion(crosswalk,TempTable) #create temporary table
+			NationalArray = ArcpyBackend().readTable(NationalTable)
+			arcpy.AddMessage("Deleting National Table...")
+			arcpy.Delete_management(NationalTable)
+		NationalFields = list(NationalArray.dtype.names)
+		State_Field = findField(NationalFields,["STATE","State"],caseSensitive=True) #find state field
+		CrosswalkCache.saveCrosswalk(CacheLocation,url,ContentHash,NationalArray,
+			findField(NationalFields,"ZIP",caseSensitive=True),findField(NationalFields,"ZCTA",caseSensitive=True),State_Field)
+		stage['rows'] = len(NationalArray)
+	arcpy.AddMessage("Crosswalk cached in {0}".format(CrosswalkCache.cacheFolder(CacheLocation,url)))
 
-arcpy.SetProgressorLabel("finding number of zip codes in Iowa...")
-#find all the Iowa Zip Codes and count them
-with arcpy.da.SearchCursor(NationalTable,NationalTable_FieldList)as cursor:
-	for row in cursor:
-		if row[NationalTable_FieldList.index(State_Field)] == 'IA' or row[NationalTable_FieldList.index(State_Field)] == "IOWA":
-			ZipCount +=1
-arcpy.AddMessage("{0} Zip Codes found for Iowa".format(ZipCount))
+NationalTable_FieldList = list(NationalArray.dtype.names) #create field list from crosswalk
+Zip_Field = findField(NationalTable_FieldList,"ZIP",caseSensitive=True)
+ZCTA_Field = findField(NationalTable_FieldList,"ZCTA",caseSensitive=True)
+arcpy.AddMessage("State field found, named: {0}".format(State_Field))
 
 ###################################################################################################
-#Go through national table and pull all the instances of Iowa and write to a new table
+#Go through national table once and partition the rows of the requested states, building a zip to
+#ZCTA dictionary for each state along the way
 ###################################################################################################
-IowaCrosswalk = arcpy.CreateTable_management(OutputLocation,TableName,NationalTable) #create new dyad table using old as template
-IowaCrosswalk_FieldList = [f.name for f in arcpy.ListFields(IowaCrosswalk)] #create field list from crosswalk
-Zip_ZCTA_Dict = {}
+arcpy.SetProgressorLabel("Finding zip codes for {0} in national table...".format(", ".join(States)))
+with Telemetry.stage('partitionStates') as stage:
+	StateRows, StateZipZCTA = CrosswalkCache.partitionStates(NationalArray,State_Field,Zip_Field,ZCTA_Field,States)
+	stage['rows'] = len(NationalArray)
 
-arcpy.SetProgressor("step","Writing Iowa Zip codes to a new table from national table...",0,ZipCount,1)
-with arcpy.da.SearchCursor(NationalTable,NationalTable_FieldList)as cursor:
-	for row in cursor:
-		#find instances of Iowa in the state attribute and write to a new table
-		if row[NationalTable_FieldList.index(State_Field)] == 'IA' or row[NationalTable_FieldList.index(State_Field)] == "IOWA":
-			Zip_ZCTA_Dict[str(row[Zip_Index])] = str(row[ZCTA_Index]) #populate zip to ZCTA dictionary, converting data to strings
-			with arcpy.da.InsertCursor(IowaCrosswalk,IowaCrosswalk_FieldList) as iowa:
-				iowa.insertRow(row)
-			arcpy.SetProgressorPosition()
+Zip_ZCTA_Dict = {} #zips are unique nationally, so the state dictionaries can be merged
+for state in States:
+	Zip_ZCTA_Dict.update(StateZipZCTA[state])
+	arcpy.AddMessage("{0} Zip Codes found for {1}".format(len(StateRows[state]),state))
 
 ###################################################################################################
-#Delete Temp National Table - It's no longer needed
+#Write the rows for each state to a new table in one bulk write
 ###################################################################################################
-arcpy.AddMessage("Deleting National Table...")
-arcpy.Delete_management(NationalTable)
+StateCrosswalks = {}
+with Telemetry.stage('writeTables') as stage:
+	for state in States:
+		arcpy.SetProgressorLabel("Writing {0} Zip codes to a new table from national table...".format(state))
+		StateCrosswalks[state] = ArcpyBackend().writeTable(NationalArray[StateRows[state]],os.path.join(OutputLocation,StateTableNames[state]))
+		stage['rows'] += len(StateRows[state])
 
 ###################################################################################################
 #Update the ZipCode file with ZCTA assignment from crosswalk
 ###################################################################################################
-if "ZCTA" not in [f.name for f in arcpy.ListFields(ZipCodes)]: #look for ZCTA field, if not in the fild list, add it
-	arcpy.AddField_management(ZipCodes,"ZCTA","TEXT")
-ZipCodes_FieldList = [f.name for f in arcpy.ListFields(ZipCodes)]
-Zip_Index = ZipCodes_FieldList.index([f for f in ZipCodes_FieldList if 'zcta' in f.lower()][0])#pull the index of the Zip field
-ZCTA_Index = len(ZipCodes_FieldList) - 1 #ZCTAs was added last, so it's the last entry in the field list
-
-featureCount = int(arcpy.GetCount_management(ZipCodes).getOutput(0)) #get number of features in ZCTAs
+ZipBackend = getBackend(ZipCodes)
+if "ZCTA" not in ZipBackend.fields(ZipCodes): #look for ZCTA field, if not in the fild list, add it
+	ZipBackend.addField(ZipCodes,"ZCTA","TEXT")
+Zip_Field = findField(ZipBackend.fields(ZipCodes),"zip") #pull the Zip field
 
 #look through the ZCTA file and update ZCTA field from crosswalk
-arcpy.SetProgressor("step","determing Zip to ZCTA assignment from crosswalk",0,featureCount,1)
-with arcpy.da.UpdateCursor(ZipCodes,ZipCodes_FieldList) as cursor:
-	for row in cursor:
-		if row[Zip_Index] in Zip_ZCTA_Dict.keys(): #look for Zip in the Zip dictionary keys
-			row[ZCTA_Index] = Zip_ZCTA_Dict[row[Zip_Index]] #update the ZCTA field by using the dictionary
-			cursor.updateRow(row)#update row
-		arcpy.SetProgressorPosition()
+arcpy.SetProgressorLabel("determing Zip to ZCTA assignment from crosswalk")
+with Telemetry.stage('updateZipCodes') as stage:
+	Crosswalk_Zips, Crosswalk_ZCTAs = reconcile.crosswalkArrays(Zip_ZCTA_Dict) #zips are matched by code, not by text
+	Updated = stage['rows'] = ZipBackend.updateValues(ZipCodes,Zip_Field,"ZCTA",Crosswalk_Zips,Crosswalk_ZCTAs)
+arcpy.AddMessage("{0} Zip Codes assigned a ZCTA".format(Updated))
 
 ###################################################################################################
 #Final Output and cleaning of temp data/variables
 ###################################################################################################
-arcpy.AddMessage("Iowa Zip To ZCTA crosswalk Table Name:{0}".format(TableName))
-arcpy.AddMessage("Iowa Zip To ZCTA crosswalk Table Location:{0}".format(os.path.realpath(str(IowaCrosswalk))))
+for state in States:
+	arcpy.AddMessage("{0} Zip To ZCTA crosswalk Table Name:{1}".format(state,StateTableNames[state]))
+	arcpy.AddMessage("{0} Zip To ZCTA crosswalk Table Location:{1}".format(state,os.path.realpath(str(StateCrosswalks[state]))))
+arcpy.AddMessage("Run report: {0}".format(Telemetry.write(telemetry.reportPath('ZipToZCTACrosswalk',TableLocation))))
 arcpy.AddMessage("Process complete!")
\ No newline at end of file
@@ -0,0 +1,16 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : servicearea
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Core service area pre processing logic, free of arcpy. The tie resolution,
+# dyad table building, checking, reconciling and crosswalk steps work on in memory tables (numpy
+# structured arrays) and the backends module reads and writes those tables from a geodatabase
+# through arcpy, from CSV/Parquet flat files or from an in memory store. The toolbox scripts are
+# thin wrappers around this package.
+#--------------------------------------------------------------------------------------------------
+from servicearea.backends import ArcpyBackend, CsvBackend, MemoryBackend, StoreBackend, getBackend
+from servicearea import checker, crosswalk, dyads, ingest, reconcile, store, tables, telemetry, ties, tiecache, zcta, pipeline
@@ -0,0 +1,682 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : backends.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Readers and writers that move tables and ZCTA geometries between storage and the
+# in memory tables used by the core functions. ArcpyBackend works on geodatabase tables and feature
+# classes, CsvBackend on CSV (and Parquet, when pyarrow is installed) flat files and MemoryBackend
+# keeps everything in a dictionary. All three have the same methods so the tools don't need to
+# know where their data lives. StoreBackend reads and writes on disk dyad stores with the table
+# methods of the others.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import re
+import csv
+import glob
+import hashlib
+import numpy
+from servicearea import store, tables, zcta
+from servicearea.checker import notInIndex
+from servicearea.telemetry import cursorOpened
+from servicearea.csvutil import openCsv, sniffDialect, readHeader, readChunks, typedColumn
+from servicearea.ties import polygonCentroid, centroidArrays, sortedCentroids
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+###################################################################################################
+#Global variables
+###################################################################################################
+NAD83 = 4269 #geographic coordinate system of the census ZCTAs, centroids are read in it
+#keys per IN list for each kind of workspace. Enterprise geodatabases cap IN lists (at 1,000 items on
+#Oracle), file geodatabases take longer lists and dBASE tables (shapefiles) slow down on long clauses
+InListSizes = {'RemoteDatabase':1000,'LocalDatabase':2000,'FileSystem':250}
+MaxClauses = 25 #with more IN lists than this the whole table is read with one cursor and filtered
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#pick the backend for a source from its file extension, anything else is taken to be a geodatabase
+#table or feature class
+def getBackend(source):
+	if os.path.splitext(str(source))[1].lower() in ('.csv','.txt','.parquet'):
+		return CsvBackend()
+	if store.isStore(source):
+		return StoreBackend()
+	return ArcpyBackend()
+
+#read the pairs for one chunk of a table. Chunks are plain tuples so they can be sent to the worker
+#processes of dyads.countPairsParallel: ('arcpy', table, fields, where clause),
+#('csv', path, fields, start row, stop row) or ('rows', [pairs])
+def readPairs(chunk):
+	if chunk[0] == 'arcpy':
+		import arcpy
+		cursorOpened()
+		with arcpy.da.SearchCursor(chunk[1],chunk[2],chunk[3]) as cursor:
+			return [tuple(row) for row in cursor]
+	if chunk[0] == 'csv':
+		pairs, row = [], 0
+		for header, columns in readChunks(chunk[1],chunk[2]):
+			start, stop = max(chunk[3] - row,0), min(chunk[4] - row,len(columns[0]))
+			if start < stop:
+				pairs.extend(zip(*[column[start:stop] for column in columns]))
+			row += len(columns[0])
+			if row >= chunk[4]:
+				break
+		return pairs
+	return chunk[1]
+
+#split a table into row ranges of roughly equal size
+def _rowRanges(count, chunks):
+	step = max(1,(count + chunks - 1)//max(1,chunks))
+	return [(start,min(start + step,count)) for start in range(0,count,step)]
+
+#sha1 of the names, sizes and modification times of a set of files, a cheap stand in for hashing
+#their content
+def statFingerprint(paths):
+	sha = hashlib.sha1()
+	for path in sorted(paths):
+		info = os.stat(path)
+		sha.update("{0}|{1}|{2}\n".format(os.path.basename(path),info.st_size,info.st_mtime).encode('utf-8'))
+	return sha.hexdigest()
+
+#rings of a WKT polygon or multipolygon as lists of (x, y) points
+def parseWKT(text):
+	rings = []
+	for ring in re.findall(r'\(([^()]+)\)',text):
+		points = []
+		for point in ring.split(','):
+			xy = point.split()
+			points.append((float(xy[0]),float(xy[1])))
+		rings.append(points)
+	return rings
+
+#SQL literals for a set of ZCTA keys, sorted. Text fields get quoted 5 digit text, with the form
+#without leading zeros as well for fields that store it that way, numeric fields the code itself.
+#Keys that aren't ZCTAs are left out, they can't match
+def sqlLiterals(keys, text):
+	codes = zcta.index(keys)
+	if not text:
+		return sorted(str(code) for code in codes.tolist())
+	literals = set()
+	for code, padded in zip(codes.tolist(),zcta.decode(codes).tolist()):
+		literals.add("'{0}'".format(padded))
+		literals.add("'{0}'".format(code))
+	return sorted(literals)
+
+#where clauses selecting the rows whose field is one of the literals, size literals per IN list
+def inClauses(field, literals, size):
+	return ["{0} IN ({1})".format(field,",".join(literals[i:i + size])) for i in range(0,len(literals),size)]
+
+#the polygons, {ZCTA: rings}, of the ZCTAs in keys. All of them when keys is None
+def _keepPolygons(polygons, keys):
+	if keys is None:
+		return polygons
+	names = list(polygons.keys())
+	keep = ~notInIndex(zcta.encode(names),zcta.index(keys))
+	return dict((names[i],polygons[names[i]]) for i in numpy.flatnonzero(keep))
+
+#the sorted centroid ZCTAs and coordinates of the ZCTAs in keys. All of them when keys is None
+def _keepCentroids(centroids, keys):
+	if keys is None:
+		return centroids
+	codes, coords = centroids
+	keep = ~notInIndex(codes,zcta.index(keys))
+	return codes[keep], coords[keep]
+
+#rows of a table whose keyField value is one of the ZCTA keys, with the rows of each key together in
+#key order. Values and keys are matched by their ZCTA code, whatever the type of the field
+def keyRows(table, keyField, keys):
+	codes = zcta.encode(table[keyField])
+	keep = numpy.flatnonzero(~notInIndex(codes,zcta.index(keys)))
+	return table[keep[numpy.argsort(codes[keep],kind='mergesort')]]
+
+#look up zip codes in the sorted zip and ZCTA codes of a crosswalk. Returns a boolean array flagging
+#the keys that were found and the ZCTA code of each key found
+def crosswalkMatches(keys, zips, zctas):
+	position = zcta.positions(zcta.encode(keys),zips)
+	found = position >= 0
+	return found, zctas[position[found]]
+
+###################################################################################################
+#arcpy backend
+###################################################################################################
+
+#buffered writer around a single insert cursor. Use it in a with statement so the last batch is
+#written and the cursor released when the block ends:
+#	with TableWriter(table,fields) as writer:
+#		for row in rows:
+#			writer.write(row)
+class TableWriter(object):
+	def __init__(self, table, fields, batchSize=10000):
+		self.table = table
+		self.fields = fields
+		self.batchSize = max(1,int(batchSize))
+		self.rowCount = 0 #number of rows written so far
+		self._buffer = []
+		self._cursor = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType is None:
+			self.flush()
+		self.close()
+		return False
+
+	#add a row, the buffered rows are written once a full batch has built up
+	def write(self, row):
+		self._buffer.append(row)
+		if len(self._buffer) >= self.batchSize:
+			self.flush()
+
+	#add every row from an iterable
+	def writeRows(self, rows):
+		for row in rows:
+			self.write(row)
+
+	#write the buffered rows through the insert cursor, opening it on the first batch
+	def flush(self):
+		if not self._buffer:
+			return
+		if self._cursor is None:
+			import arcpy
+			cursorOpened()
+			self._cursor = arcpy.da.InsertCursor(self.table,self.fields)
+		for row in self._buffer:
+			self._cursor.insertRow(row)
+		self.rowCount += len(self._buffer)
+		self._buffer = []
+
+	#release the insert cursor so the table isn't left locked
+	def close(self):
+		if self._cursor is not None:
+			del self._cursor
+			self._cursor = None
+
+class ArcpyBackend(object):
+	name = 'arcpy'
+
+	def __init__(self):
+		import arcpy #only needed when reading from a geodatabase
+		self.arcpy = arcpy
+
+	#names of the attribute fields of a table, without the object ID and shape
+	def fields(self, source):
+		return [f.name for f in self.arcpy.ListFields(source) if f.type not in ('OID','Geometry')]
+
+	def count(self, source):
+		return int(self.arcpy.GetCount_management(source).getOutput(0))
+
+	def exists(self, source):
+		return self.arcpy.Exists(source)
+
+	#fingerprint of a table's content. Shapefiles and other file based data are fingerprinted from
+	#their files, geodatabase tables from a hash of their rows (and shape areas and lengths)
+	def fingerprint(self, source):
+		if os.path.isfile(source):
+			return statFingerprint(glob.glob(os.path.splitext(source)[0] + '.*'))
+		if not self.arcpy.Exists(source):
+			return None
+		fieldObjects = self.arcpy.ListFields(source)
+		fields = ["OID@"] + [f.name for f in fieldObjects if f.type not in ('OID','Geometry','Blob','Raster')]
+		if any(f.type == 'Geometry' for f in fieldObjects):
+			fields += ["SHAPE@AREA","SHAPE@LENGTH"]
+		sha = hashlib.sha1()
+		cursorOpened()
+		with self.arcpy.da.SearchCursor(source,fields) as cursor:
+			for row in cursor:
+				sha.update(repr(row).encode('utf-8'))
+		return sha.hexdigest()
+
+	#read a table into a structured array. Nulls are read as empty text, or 0 for numeric fields,
+	#so every column fits in an array
+	def readTable(self, source, fields=None, where=None):
+		fieldObjects = [f for f in self.arcpy.ListFields(source) if f.type not in ('OID','Geometry')]
+		fields = fields or [f.name for f in fieldObjects]
+		nullValues = dict((f.name,'' if f.type == 'String' else 0) for f in fieldObjects if f.name in fields)
+		cursorOpened()
+		return self.arcpy.da.TableToNumPyArray(source,fields,where,null_value=nullValues)
+
+	#write a structured array to a new table, replacing the table if it exists. 64 bit integer
+	#columns are written as LONG fields
+	def writeTable(self, table, target):
+		if self.arcpy.Exists(target):
+			self.arcpy.Delete_management(target)
+		names = list(table.dtype.names)
+		table = tables.fromColumns(names,[table[n].astype(numpy.int32) if table[n].dtype == numpy.int64 else table[n] for n in names])
+		self.arcpy.da.NumPyArrayToTable(table,target)
+		return target
+
+	#replace every row of an existing table with the rows of a structured array in a single pass
+	def replaceRows(self, table, target):
+		try:
+			self.arcpy.TruncateTable_management(target)
+		except self.arcpy.ExecuteError:
+			self.arcpy.DeleteRows_management(target) #truncate isn't supported for every table type
+		with TableWriter(target,list(table.dtype.names)) as writer:
+			writer.writeRows(tables.tableRows(table))
+		return target
+
+	#keys per IN list for the workspace a table is in
+	def inListSize(self, source):
+		try:
+			workspace = self.arcpy.Describe(source).path
+			while workspace and not self.arcpy.Describe(workspace).dataType == 'Workspace':
+				workspace = os.path.dirname(workspace) #tables in a feature dataset
+			return InListSizes.get(self.arcpy.Describe(workspace).workspaceType,min(InListSizes.values()))
+		except (IOError,OSError,AttributeError):
+			return min(InListSizes.values())
+
+	#add an attribute index on a field unless one exists. Indexes can't be added to tables that are
+	#locked or read only, the queries still work without one
+	def addIndex(self, source, field):
+		if any(field in [f.name for f in index.fields] for index in self.arcpy.ListIndexes(source)):
+			return
+		try:
+			self.arcpy.AddIndex_management(source,[field],"{0}_idx".format(field)[:31])
+		except self.arcpy.ExecuteError:
+			pass
+
+	#IN list where clauses selecting the rows whose keyField value is in keys, as many keys per
+	#clause as the workspace takes. None when there would be more than MaxClauses clauses, reading
+	#the whole table once is quicker then. index adds an attribute index on keyField first
+	def keyClauses(self, source, keyField, keys, index=False):
+		fieldTypes = dict((f.name,f.type) for f in self.arcpy.ListFields(source))
+		literals = sqlLiterals(keys,fieldTypes.get(keyField) == 'String')
+		size = self.inListSize(source)
+		if len(literals) > size*MaxClauses:
+			return None
+		if index and literals:
+			self.addIndex(source,keyField)
+		return inClauses(self.arcpy.AddFieldDelimiters(source,keyField),literals,size)
+
+	#rows of a table whose keyField value is in keys, read with one cursor per IN list instead of
+	#one per key. The rows of each key are together in key order, the key field is always read
+	def readKeys(self, source, keyField, keys, fields=None, index=False):
+		fields = fields and (fields if keyField in fields else list(fields) + [keyField])
+		clauses = self.keyClauses(source,keyField,keys,index)
+		if clauses is None:
+			return keyRows(self.readTable(source,fields),keyField,keys)
+		parts = [self.readTable(source,fields,clause) for clause in clauses or ["1 = 0"]]
+		return keyRows(numpy.concatenate(parts),keyField,keys)
+
+	#delete the rows whose keyField value is in keys and insert the rows of a structured array in
+	#their place, leaving the rest of the table untouched. Only the rows of the keys are visited,
+	#through IN list queries, unless there are too many keys and the whole table is scanned
+	def replaceGroups(self, table, target, keyField, keys, index=False):
+		keys = zcta.index(keys)
+		keySet = set(keys.tolist())
+		codes = {} #code of each distinct value seen, a table has few of them
+		clauses = self.keyClauses(target,keyField,keys,index)
+		for clause in [None] if clauses is None else clauses:
+			cursorOpened()
+			with self.arcpy.da.UpdateCursor(target,[keyField],clause) as cursor:
+				for row in cursor:
+					if row[0] not in codes:
+						codes[row[0]] = int(zcta.encode([row[0]])[0])
+					if codes[row[0]] in keySet:
+						cursor.deleteRow()
+		with TableWriter(target,list(table.dtype.names)) as writer:
+			writer.writeRows(tables.tableRows(table))
+		return target
+
+	def addField(self, source, name, fieldType='LONG'):
+		self.arcpy.AddField_management(source,name,fieldType)
+
+	#set valueField to the crosswalk ZCTA of every row whose keyField value is in the sorted zip and
+	#ZCTA codes of a crosswalk. Keys are matched by code, so 1001 and '01001' are the same zip, and
+	#the ZCTA is written in the form of the field. Each distinct key is looked up once. Returns the
+	#number of rows updated
+	def updateValues(self, source, keyField, valueField, zips, zctas):
+		updated = 0
+		fields = [keyField] if keyField == valueField else [keyField,valueField]
+		valueType = str if self.arcpy.ListFields(source,valueField)[0].type == 'String' else numpy.int64
+		values = {} #crosswalk ZCTA of each key value, None when it isn't in the crosswalk
+		cursorOpened()
+		with self.arcpy.da.UpdateCursor(source,fields) as cursor:
+			for row in cursor:
+				if row[0] not in values:
+					found, codes = crosswalkMatches([row[0]],zips,zctas)
+					values[row[0]] = zcta.asField(codes,valueType).tolist()[0] if found[0] else None
+				if values[row[0]] is not None:
+					row[-1] = values[row[0]]
+					cursor.updateRow(row)
+					updated += 1
+		return updated
+
+	#polygons of a feature class as {key: [ring, ...]}, with each ring a list of (x, y) points. Only
+	#the polygons of keys are read when they're given
+	def readPolygons(self, source, keyField, keys=None):
+		polygons = {}
+		clauses = None if keys is None else self.keyClauses(source,keyField,keys)
+		for clause in [None] if clauses is None else clauses:
+			cursorOpened()
+			with self.arcpy.da.SearchCursor(source,[keyField,"SHAPE@"],clause) as cursor:
+				for row in cursor:
+					if row[1] is None:
+						continue
+					rings = []
+					for part in row[1]:
+						ring = []
+						for point in part:
+							if point is None: #a None separates the outer ring from its holes
+								rings.append(ring)
+								ring = []
+							else:
+								ring.append((point.X,point.Y))
+						rings.append(ring)
+					polygons[str(row[0])] = [ring for ring in rings if ring]
+		return _keepPolygons(polygons,keys)
+
+	#true centroids of a feature class, projected to NAD83 so they are in degrees whatever the
+	#layer's projection. Only the centroids of keys are read when they're given. Returns sorted
+	#keys and a contiguous array of (X, Y)
+	def readCentroids(self, source, keyField, keys=None):
+		clauses = None if keys is None else self.keyClauses(source,keyField,keys)
+		parts = []
+		for clause in [None] if clauses is None else clauses or ["1 = 0"]:
+			cursorOpened()
+			parts.append(self.arcpy.da.FeatureClassToNumPyArray(source,[keyField,"SHAPE@TRUECENTROID"],clause,
+				spatial_reference=self.arcpy.SpatialReference(NAD83),skip_nulls=True))
+		centroidArray = numpy.concatenate(parts)
+		coords = numpy.ascontiguousarray(centroidArray["SHAPE@TRUECENTROID"],dtype=numpy.float64).reshape(-1,2)
+		return _keepCentroids(sortedCentroids(zcta.encode(centroidArray[keyField]),coords),keys)
+
+	#split a table into object ID ranges for countPairsParallel
+	def pairChunks(self, source, fields, chunks):
+		oidField = self.arcpy.Describe(source).OIDFieldName
+		low, high = None, None
+		cursorOpened()
+		with self.arcpy.da.SearchCursor(source,["OID@"]) as cursor:
+			for row in cursor:
+				if low is None or row[0] < low:
+					low = row[0]
+				if high is None or row[0] >= high:
+					high = row[0] + 1
+		if low is None:
+			return []
+		step = max(1,(high - low + chunks - 1)//chunks)
+		return [('arcpy',source,fields,"{0} >= {1} AND {0} < {2}".format(oidField,start,min(start + step,high)))
+			for start in range(low,high,step)]
+
+###################################################################################################
+#CSV/Parquet backend
+###################################################################################################
+class CsvBackend(object):
+	name = 'csv'
+
+	#geometry and centroid columns looked for in ZCTA files
+	geometryFields = ('WKT','GEOMETRY','SHAPE')
+	centroidFields = (('INTPTLON10','INTPTLAT10'),('INTPTLON','INTPTLAT'),('LON','LAT'),('X','Y'))
+
+	def _isParquet(self, path):
+		if not path.lower().endswith('.parquet'):
+			return False
+		if pyarrow is None:
+			raise ImportError("pyarrow is needed to read and write Parquet files")
+		return True
+
+	def fields(self, source):
+		if self._isParquet(source):
+			return list(pyarrow.parquet.read_schema(source).names)
+		return readHeader(source,sniffDialect(source))
+
+	def count(self, source):
+		return len(self.readTable(source))
+
+	def exists(self, source):
+		return os.path.exists(source)
+
+	def fingerprint(self, source):
+		return statFingerprint([source]) if os.path.exists(source) else None
+
+	#read a file into a structured array, typing each column as integers, floats or text
+	def readTable(self, source, fields=None, where=None):
+		if where is not None:
+			raise ValueError("where clauses aren't supported for flat files")
+		if self._isParquet(source):
+			data = pyarrow.parquet.read_table(source,columns=fields).to_pydict()
+			fields = fields or list(data.keys())
+			return tables.fromColumns(fields,[typedColumn(data[f]) for f in fields])
+
+		fields = fields or self.fields(source)
+		columns = [[] for f in fields]
+		for header, chunk in readChunks(source,fields):
+			for column, values in zip(columns,chunk):
+				column.extend(values)
+		return tables.fromColumns(fields,[typedColumn(column) for column in columns])
+
+	#write a structured array to a file, replacing the file if it exists. A file that's replaced is
+	#written back in its own dialect
+	def writeTable(self, table, target):
+		if self._isParquet(target):
+			pyarrow.parquet.write_table(pyarrow.table(dict((f,table[f].tolist()) for f in table.dtype.names)),target)
+			return target
+		dialect = csv.excel
+		if os.path.exists(target) and os.path.getsize(target):
+			try:
+				dialect = sniffDialect(target)
+			except csv.Error:
+				pass
+		with openCsv(target,'w') as outFile:
+			writer = csv.writer(outFile,dialect)
+			writer.writerow(table.dtype.names)
+			writer.writerows(tables.tableRows(table))
+		return target
+
+	def replaceRows(self, table, target):
+		return self.writeTable(table,target)
+
+	def replaceGroups(self, table, target, keyField, keys, index=False):
+		return self.writeTable(_replaceGroups(self.readTable(target),table,keyField,keys),target)
+
+	def addField(self, source, name, fieldType='LONG'):
+		table = self.readTable(source)
+		column = numpy.zeros(len(table),dtype=str if fieldType == 'TEXT' else numpy.int64)
+		self.writeTable(tables.fromColumns(list(table.dtype.names) + [name],[table[f] for f in table.dtype.names] + [column]),source)
+
+	def updateValues(self, source, keyField, valueField, zips, zctas):
+		table = self.readTable(source)
+		table, updated = _updateValues(table,keyField,valueField,zips,zctas)
+		self.writeTable(table,source)
+		return updated
+
+	#files are read whole, the rows of the keys are picked out in memory
+	def readKeys(self, source, keyField, keys, fields=None, index=False):
+		fields = fields and (fields if keyField in fields else list(fields) + [keyField])
+		return keyRows(self.readTable(source,fields),keyField,keys)
+
+	#polygons from a WKT geometry column
+	def readPolygons(self, source, keyField, keys=None):
+		table = self.readTable(source)
+		geometryField = tables.findField(table.dtype.names,self.geometryFields)
+		if keys is not None:
+			table = table[~notInIndex(zcta.encode(table[keyField]),zcta.index(keys))] #only parse the polygons needed
+		return dict((str(k),parseWKT(g)) for k, g in zip(table[keyField].tolist(),table[geometryField].tolist()))
+
+	#centroids from internal point columns when the file has them, otherwise from the polygons
+	def readCentroids(self, source, keyField, keys=None):
+		table = self.readTable(source)
+		names = [n.upper() for n in table.dtype.names]
+		for xField, yField in self.centroidFields:
+			if xField in names and yField in names:
+				x = table[table.dtype.names[names.index(xField)]]
+				y = table[table.dtype.names[names.index(yField)]]
+				coords = numpy.column_stack((x.astype(numpy.float64),y.astype(numpy.float64)))
+				return _keepCentroids(sortedCentroids(zcta.encode(table[keyField]),coords),keys)
+		polygons = self.readPolygons(source,keyField,keys)
+		return centroidArrays(dict((k,polygonCentroid(v)) for k, v in polygons.items()))
+
+	#split a file into row ranges for countPairsParallel
+	def pairChunks(self, source, fields, chunks):
+		return [('csv',source,fields,start,stop) for start, stop in _rowRanges(self.count(source),chunks)]
+
+###################################################################################################
+#in memory backend
+###################################################################################################
+
+#set valueField to the crosswalk ZCTA for rows of a structured array whose keyField is in the
+#sorted crosswalk codes, in the form of the field (see ArcpyBackend.updateValues)
+def _updateValues(table, keyField, valueField, zips, zctas):
+	hits, codes = crosswalkMatches(table[keyField],zips,zctas)
+	if hits.any():
+		dtype = table[valueField].dtype
+		values = zcta.asField(codes,dtype.kind + '5' if dtype.kind in 'SU' else dtype) #5 digit text, widened below
+		if table[valueField].dtype.kind in 'SU' and values.dtype.itemsize > table[valueField].dtype.itemsize:
+			#widen a text column that is too narrow for the new values
+			names = list(table.dtype.names)
+			table = tables.fromColumns(names,[table[n] if n != valueField else table[n].astype(values.dtype) for n in names])
+		table[valueField][hits] = values
+	return table, int(hits.sum())
+
+#rows of existing whose keyField value isn't one of the ZCTA keys, followed by the rows of table
+def _replaceGroups(existing, table, keyField, keys):
+	keep = notInIndex(zcta.encode(existing[keyField]),zcta.index(keys))
+	names = list(existing.dtype.names)
+	return tables.fromColumns(names,[numpy.concatenate((existing[n][keep],table[n])) for n in names])
+
+#stand in for a geodatabase, tables are structured arrays and ZCTA layers a dictionary of polygons
+#held in memory. Used to run the tools on machines without ArcGIS and to benchmark them
+class MemoryBackend(object):
+	name = 'memory'
+
+	def __init__(self, tables=None, polygons=None):
+		self.tables = dict(tables or {})
+		self.polygons = dict(polygons or {}) #{layer: {key: [ring, ...]}}
+
+	def fields(self, source):
+		return list(self.tables[source].dtype.names)
+
+	def count(self, source):
+		return len(self.tables[source])
+
+	def exists(self, source):
+		return source in self.tables or source in self.polygons
+
+	#hash of a table's bytes, or of a layer's polygons
+	def fingerprint(self, source):
+		if source in self.tables:
+			table = self.tables[source]
+			return hashlib.sha1(repr(table.dtype.descr).encode('utf-8') + table.tobytes()).hexdigest()
+		if source in self.polygons:
+			return hashlib.sha1(repr(sorted(self.polygons[source].items())).encode('utf-8')).hexdigest()
+		return None
+
+	def readTable(self, source, fields=None, where=None):
+		if where is not None:
+			raise ValueError("where clauses aren't supported in memory")
+		table = self.tables[source]
+		return tables.selectFields(table,fields) if fields else table.copy()
+
+	def writeTable(self, table, target):
+		self.tables[target] = table.copy()
+		return target
+
+	def replaceRows(self, table, target):
+		return self.writeTable(table,target)
+
+	def readKeys(self, source, keyField, keys, fields=None, index=False):
+		fields = fields and (fields if keyField in fields else list(fields) + [keyField])
+		return keyRows(self.readTable(source,fields),keyField,keys)
+
+	def replaceGroups(self, table, target, keyField, keys, index=False):
+		return self.writeTable(_replaceGroups(self.tables[target],table,keyField,keys),target)
+
+	def addField(self, source, name, fieldType='LONG'):
+		table = self.tables[source]
+		column = numpy.zeros(len(table),dtype=str if fieldType == 'TEXT' else numpy.int64)
+		self.tables[source] = tables.fromColumns(list(table.dtype.names) + [name],[table[f] for f in table.dtype.names] + [column])
+
+	def updateValues(self, source, keyField, valueField, zips, zctas):
+		self.tables[source], updated = _updateValues(self.tables[source],keyField,valueField,zips,zctas)
+		return updated
+
+	def readPolygons(self, source, keyField, keys=None):
+		return _keepPolygons(self.polygons[source],keys)
+
+	def readCentroids(self, source, keyField, keys=None):
+		return centroidArrays(dict((k,polygonCentroid(v)) for k, v in self.readPolygons(source,keyField,keys).items()))
+
+	#split a table into row ranges for countPairsParallel, the pairs themselves are sent to the workers
+	def pairChunks(self, source, fields, chunks):
+		table = self.tables[source]
+		return [('rows',list(zip(*[table[f][start:stop].tolist() for f in fields]))) for start, stop in _rowRanges(len(table),chunks)]
+
+###################################################################################################
+#dyad store backend
+###################################################################################################
+
+#on disk columnar dyad stores (folders named <name>.dyads), see servicearea.store. Whole tables
+#read through the backend are copied into memory, the tools read large stores a block at a time
+#with store.DyadStore instead
+class StoreBackend(object):
+	name = 'store'
+
+	def fields(self, source):
+		return [name for name, dtype in store.Columns]
+
+	def count(self, source):
+		return len(store.DyadStore(source))
+
+	def exists(self, source):
+		return os.path.exists(os.path.join(source,'store.json'))
+
+	def fingerprint(self, source):
+		return statFingerprint(glob.glob(os.path.join(source,'*'))) if self.exists(source) else None
+
+	def readTable(self, source, fields=None, where=None):
+		if where is not None:
+			raise ValueError("where clauses aren't supported for dyad stores")
+		return store.DyadStore(source).table(fields=fields)
+
+	def writeTable(self, table, target):
+		store.writeStore(target,[table])
+		return target
+
+	def replaceRows(self, table, target):
+		return self.writeTable(table,target)
+
+	#the rows of each recipient are found from the store's index of where recipients start
+	def readKeys(self, source, keyField, keys, fields=None, index=False):
+		dyadStore = store.DyadStore(source)
+		fields = fields and (fields if keyField in fields else list(fields) + [keyField])
+		if keyField != store.RecField:
+			return keyRows(dyadStore.table(fields=fields),keyField,keys)
+		groups = [dyadStore.group(key) for key in sorted(set(zcta.index(keys).tolist()))]
+		rows = numpy.concatenate([numpy.arange(start,stop) for start, stop in groups] or [numpy.zeros(0,dtype=numpy.int64)])
+		return dyadStore.table(rows,fields)
+
+	#the store is rewritten a block at a time without the rows of the replaced groups
+	def replaceGroups(self, table, target, keyField, keys, index=False):
+		dyadStore = store.DyadStore(target)
+		keys = zcta.index(keys)
+		def chunks():
+			for chunk in dyadStore.chunks():
+				yield chunk[notInIndex(chunk[store.RecField],keys)]
+			dyadStore.close()
+			yield table
+		store.writeStore(target,chunks())
+		return target
+
+	#stores have a fixed set of columns, Dyad_max among them
+	def addField(self, source, name, fieldType='LONG'):
+		if name not in self.fields(source):
+			raise ValueError("Dyad stores have a fixed set of fields, {0} can't be added".format(name))
+
+	def pairChunks(self, source, fields, chunks):
+		dyadStore = store.DyadStore(source)
+		return [('rows',list(zip(*[dyadStore[f][start:stop].tolist() for f in fields]))) for start, stop in _rowRanges(len(dyadStore),chunks)]
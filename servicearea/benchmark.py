@@ -0,0 +1,299 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : benchmark.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Benchmarks the steps of the five tools against synthetic data held in a
+# MemoryBackend. ZCTAs are square polygons on a grid over Iowa, odd codes being ZCTAs and the even
+# code after each a zip (PO box) that the crosswalk maps onto it. Neighbor tables, tie CSVs, a
+# national crosswalk, visit points and dyad tables are generated from the grid with a fixed seed
+# so runs are reproducible. Timings are written as JSON to compare across versions:
+#	python -m servicearea.benchmark --points 1000000 --dyads 1000000 --output results.json
+#	python -m servicearea.benchmark --baseline results.json
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy
+from servicearea import checker, crosswalk, dyads, reconcile, tables, ties
+from servicearea.backends import MemoryBackend, readPairs
+
+###################################################################################################
+#Global variables
+###################################################################################################
+Extent = (-96.64,40.37,-90.14,43.50) #longitude and latitude bounds of Iowa the grid is laid over
+States = ['IA','IL','MN','MO','NE','SD','WI'] #states the national crosswalk is split between
+
+###################################################################################################
+#Synthetic data
+###################################################################################################
+
+#ZCTA codes for count ZCTAs, odd codes from 10001 so the even code after each is free for a zip
+def zctaCodes(count):
+	if count > 44999:
+		raise ValueError("At most 44,999 synthetic ZCTAs fit in five digit codes")
+	return 10001 + 2*numpy.arange(count,dtype=numpy.int64)
+
+#square ZCTA polygons on a grid over the extent, as {ZCTA: [ring]}. Neighboring cells share their
+#edge points exactly, as ZCTAs from the same source data do
+def gridPolygons(count):
+	columns = int(math.ceil(math.sqrt(count*(Extent[2] - Extent[0])/(Extent[3] - Extent[1]))))
+	rows = int(math.ceil(float(count)/columns))
+	xs = numpy.linspace(Extent[0],Extent[2],columns + 1).tolist()
+	ys = numpy.linspace(Extent[1],Extent[3],rows + 1).tolist()
+	polygons = {}
+	for i, code in enumerate(zctaCodes(count).tolist()):
+		row, column = divmod(i,columns)
+		x0, x1, y0, y1 = xs[column], xs[column + 1], ys[row], ys[row + 1]
+		polygons[str(code)] = [[(x0,y0),(x0,y1),(x1,y1),(x1,y0),(x0,y0)]]
+	return polygons
+
+#polygon neighbors table (src, nbr and LENGTH fields) for a set of polygons
+def neighborTable(polygons):
+	borders = ties.sharedBorders(polygons)
+	rows = [(int(src),int(nbr),length) for src in sorted(borders) for nbr, length in sorted(borders[src].items())]
+	return tables.fromRows(['src_ZCTA5CE10','nbr_ZCTA5CE10','LENGTH'],rows)
+
+#ZCTA layer table, one row per polygon
+def zctaTable(polygons):
+	return tables.fromColumns(['ZCTA5CE10'],[numpy.array(sorted(polygons,key=int))])
+
+#national zip to ZCTA crosswalk. Every ZCTA is its own zip and has a PO box zip mapped onto it,
+#ZCTAs are split between the states in blocks
+def nationalCrosswalk(count):
+	codes = zctaCodes(count)
+	zips = numpy.concatenate((codes,codes + 1))
+	zctas = numpy.concatenate((codes,codes))
+	state = numpy.array(States)[(numpy.concatenate((numpy.arange(count),numpy.arange(count)))*len(States))//max(1,count)]
+	zipType = numpy.array(['Zip Code Area']*count + ['Post Office or large volume customer']*count)
+	order = numpy.argsort(zips,kind='mergesort')
+	return tables.fromColumns(['ZIP','PO_NAME','STATE','ZIP_TYPE','ZCTA'],
+		[numpy.char.zfill(zips[order].astype(str),5),numpy.char.add('TOWN ',zctas[order].astype(str)),state[order],
+		zipType[order],numpy.char.zfill(zctas[order].astype(str),5)])
+
+#zip codes layer to update from the crosswalk, every zip of the crosswalk without a ZCTA yet
+def zipTable(crosswalkTable):
+	return tables.fromColumns(['ZIP','ZCTA'],[crosswalkTable['ZIP'],numpy.array(['']*len(crosswalkTable))])
+
+#providers for an array of member ZCTA positions, mostly in a nearby ZCTA
+def nearbyPositions(positions, count, random, spread=25):
+	return numpy.clip(positions + random.randint(-spread,spread + 1,len(positions)),0,count - 1)
+
+#visit points with member and provider zips. Members live in any zip, ZCTA or PO box, and visit
+#providers near them
+def visitPoints(count, zctaCount, random):
+	codes = zctaCodes(zctaCount)
+	members = random.randint(0,zctaCount,count)
+	providers = nearbyPositions(members,zctaCount,random)
+	return tables.fromColumns(['MEM_ZIP','PROV_ZIP'],[codes[members] + random.randint(0,2,count),codes[providers]])
+
+#dyad table of count unique recipient/provider pairs (fewer if there aren't that many pairs among the
+#ZCTAs), with MAX_VISITS and VISITS_TOTAL filled in the way the Initial Dyad Table Creator writes them.
+#Providers are spread further from their recipients as the table grows so there are enough pairs
+def dyadTable(count, zctaCount, random):
+	codes = zctaCodes(zctaCount)
+	draws = 2*count
+	recs = random.randint(0,zctaCount,draws)
+	rec = codes[recs] + random.randint(0,2,draws) #some recipients are PO box zips the reconciler remaps
+	prov = codes[nearbyPositions(recs,zctaCount,random,max(25,count//(2*zctaCount)))]
+	pairs = numpy.unique(rec*100000 + prov)
+	if len(pairs) > count:
+		pairs = numpy.sort(random.choice(pairs,count,replace=False))
+	rec, prov = pairs//100000, pairs%100000
+	visits = random.randint(1,50,len(pairs)).astype(numpy.int64)
+	starts = reconcile.groupStarts(rec)
+	counts = numpy.diff(numpy.append(starts,len(rec)))
+	maxVisits = numpy.repeat(numpy.maximum.reduceat(visits,starts),counts)
+	totals = numpy.repeat(numpy.add.reduceat(visits,starts),counts)
+	return tables.fromColumns(['REC_ZIP','PROV_ZIP','VISITS_DYAD','MAX_VISITS','VISITS_TOTAL','Dyad_max'],
+		[rec,prov,visits,maxVisits,totals,(visits == maxVisits).astype(numpy.int16)])
+
+#tie CSV of about count rows, grouped by recipient ZCTA. Most recipients have one provider, the
+#rest two or three providers with the same number of visits
+def writeTieCsv(path, count, zctaCount, random):
+	codes = zctaCodes(zctaCount)
+	written = 0
+	with open(path,'w') as f:
+		f.write("REC_ZCTA,PROV_ZCTA,VISITS\n")
+		for position in numpy.sort(random.randint(0,zctaCount,max(1,count//2))).tolist():
+			providers = numpy.unique(nearbyPositions(numpy.repeat(position,random.choice([1,1,2,3])),zctaCount,random,3))
+			visits = random.randint(1,20)
+			for provider in providers.tolist():
+				f.write("{0},{1},{2}\n".format(codes[position],codes[provider],visits))
+				written += 1
+			if written >= count:
+				break
+	return written
+
+###################################################################################################
+#Timing
+###################################################################################################
+
+#time a function, keeping the fastest of repeat runs. Returns the result of the last run
+def timed(timings, name, repeat, func, *args):
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		result = func(*args)
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best,elapsed)
+	timings[name] = round(best,6)
+	return result
+
+#benchmark the stages of the tie resolver, resolving serially and across processes
+def benchTieResolver(backend, polygons, tieCount, zctaCount, random, folder, processes, repeat):
+	timings = {}
+	tiePath = os.path.join(folder,'ties.csv')
+	outPath = os.path.join(folder,'resolved.csv')
+	rows = writeTieCsv(tiePath,tieCount,zctaCount,random)
+	backend.writeTable(neighborTable(polygons),'neighbors')
+
+	borders = timed(timings,'sharedBorders',repeat,lambda: ties.sharedBorders(backend.readPolygons('zctas','ZCTA5CE10')))
+	timed(timings,'bordersFromTable',repeat,lambda: ties.bordersFromTable(backend.readTable('neighbors'),
+		'src_ZCTA5CE10','nbr_ZCTA5CE10','LENGTH'))
+	centroids = timed(timings,'readCentroids',repeat,backend.readCentroids,'zctas','ZCTA5CE10')
+	stats = timed(timings,'resolveTieCsv',repeat,ties.resolveTieCsv,tiePath,outPath,borders,centroids[0],centroids[1])
+	timed(timings,'resolveTieCsvParallel',repeat,lambda: ties.resolveTieCsv(tiePath,outPath,borders,centroids[0],centroids[1],
+		max(1,rows//(processes*4)),processes=processes))
+	return timings, {'tieRows':rows,'ties':stats['ties']}
+
+#benchmark the stages of the dyad table creator, counting serially and across processes
+def benchDyadCreator(backend, processes, repeat):
+	timings = {}
+	fields = ['MEM_ZIP','PROV_ZIP']
+	chunks = timed(timings,'pairChunks',repeat,backend.pairChunks,'points',fields,processes*4)
+	timed(timings,'countPairs',repeat,lambda: dyads.countPairs(pair for chunk in chunks for pair in readPairs(chunk)))
+	pairCounts = timed(timings,'countPairsParallel',repeat,dyads.countPairsParallel,readPairs,chunks,processes)
+	rows = timed(timings,'dyadRows',repeat,dyads.dyadRows,pairCounts)
+	table = timed(timings,'dyadTable',repeat,dyads.dyadTable,rows)
+	timed(timings,'writeTable',repeat,backend.writeTable,table,'newDyads')
+	return timings, {'createdDyads':len(rows)}
+
+#benchmark the stages of the crosswalk tool after the spreadsheet has been imported
+def benchCrosswalk(backend, folder, repeat):
+	timings = {}
+	url = 'http://example.com/zip_to_zcta.xlsx'
+	national = backend.readTable('crosswalk')
+	timed(timings,'saveCrosswalk',repeat,crosswalk.saveCrosswalk,folder,url,'benchmark',national,'ZIP','ZCTA','STATE')
+	national = timed(timings,'loadCrosswalk',repeat,crosswalk.loadCrosswalk,folder,url)
+	stateRows, stateZipZCTA = timed(timings,'partitionStates',repeat,crosswalk.partitionStates,national,'STATE','ZIP','ZCTA',['IA','IL'])
+	timed(timings,'writeTable',repeat,lambda: [backend.writeTable(national[stateRows[state]],'crosswalk_' + state) for state in stateRows])
+	zipZCTA = dict(stateZipZCTA['IA'])
+	zipZCTA.update(stateZipZCTA['IL'])
+	zips, zctas = reconcile.crosswalkArrays(zipZCTA)
+	timed(timings,'updateValues',repeat,lambda: backend.updateValues('zips','ZIP','ZCTA',zips,zctas))
+	return timings, {'crosswalkRows':len(national),'stateRows':sum(len(r) for r in stateRows.values())}
+
+#benchmark the stages of the dyad table checker
+def benchChecker(backend, repeat):
+	timings = {}
+	index = timed(timings,'zctaIndex',repeat,lambda: checker.zctaIndex(backend.readTable('zctas',['ZCTA5CE10'])['ZCTA5CE10']))
+	table = timed(timings,'readTable',repeat,backend.readTable,'dyads',['REC_ZIP','PROV_ZIP','VISITS_DYAD'])
+	result = timed(timings,'checkDyads',repeat,checker.checkDyads,table['REC_ZIP'],table['PROV_ZIP'],table['VISITS_DYAD'],index)
+	return timings, {'missing':len(result['missing'])}
+
+#benchmark the stages of the dyad table reconciler. The table is reconciled into a copy so every
+#repeat starts from the same data
+def benchReconciler(backend, repeat):
+	timings = {}
+	index = checker.zctaIndex(backend.readTable('zctas',['ZCTA5CE10'])['ZCTA5CE10'])
+	national = backend.readTable('crosswalk',['ZIP','ZCTA'])
+	zipZCTA = dict(zip(national['ZIP'].tolist(),national['ZCTA'].tolist()))
+	zips, zctas = timed(timings,'crosswalkArrays',repeat,reconcile.crosswalkArrays,zipZCTA)
+	table = timed(timings,'readTable',repeat,backend.readTable,'dyads')
+	reconciled, report = timed(timings,'reconcileDyads',repeat,reconcile.reconcileDyads,table,'REC_ZIP','PROV_ZIP',
+		'VISITS_DYAD',index,zips,zctas)
+	timed(timings,'replaceRows',repeat,backend.replaceRows,reconciled,'reconciledDyads')
+	digests = timed(timings,'groupDigests',repeat,reconcile.groupDigests,table,'REC_ZIP','PROV_ZIP',index,zips,zctas)
+	timed(timings,'reconcileIncremental',repeat,reconcile.reconcileIncremental,table,'REC_ZIP','PROV_ZIP',
+		'VISITS_DYAD',index,zips,zctas,digests)
+	return timings, {'merged':report['merged'],'written':len(reconciled)}
+
+#the commit the package was run from, when it's in a git checkout
+def gitVersion():
+	try:
+		with open(os.devnull,'w') as devnull:
+			return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),
+				stderr=devnull).decode('utf-8').strip()
+	except (OSError,subprocess.CalledProcessError):
+		return None
+
+#generate the synthetic data and benchmark every tool. Returns the results as a dictionary
+def runBenchmark(zctaCount=1000, points=100000, dyadCount=100000, tieRows=10000, processes=2, repeat=1, seed=0):
+	random = numpy.random.RandomState(seed)
+	folder = tempfile.mkdtemp()
+	try:
+		polygons = gridPolygons(zctaCount)
+		national = nationalCrosswalk(zctaCount)
+		backend = MemoryBackend({'zctas':zctaTable(polygons),'crosswalk':national,'zips':zipTable(national),
+			'points':visitPoints(points,zctaCount,random),'dyads':dyadTable(dyadCount,zctaCount,random)},{'zctas':polygons})
+
+		results = {}
+		sizes = {'zctas':zctaCount,'points':points,'dyads':backend.count('dyads')}
+		for tool, bench in (('TieResolver',lambda: benchTieResolver(backend,polygons,tieRows,zctaCount,random,folder,processes,repeat)),
+			('InitialDyadTableCreator',lambda: benchDyadCreator(backend,processes,repeat)),
+			('ZipToZCTACrosswalk',lambda: benchCrosswalk(backend,folder,repeat)),
+			('DyadTableZCTAChecker',lambda: benchChecker(backend,repeat)),
+			('DyadTableZCTAReconciler',lambda: benchReconciler(backend,repeat))):
+			timings, counts = bench()
+			timings['total'] = round(sum(timings.values()),6)
+			results[tool] = timings
+			sizes.update(counts)
+	finally:
+		shutil.rmtree(folder,ignore_errors=True)
+
+	return {'version':gitVersion(),'date':time.strftime('%Y-%m-%d %H:%M:%S'),'python':platform.python_version(),
+		'numpy':numpy.__version__,'platform':platform.platform(),'seed':seed,'repeat':repeat,'processes':processes,
+		'sizes':sizes,'results':results}
+
+#ratio of the baseline time to the new time for every stage found in both, above 1 is a speedup
+def compareResults(baseline, results):
+	ratios = {}
+	for tool, timings in results['results'].items():
+		for stage, seconds in timings.items():
+			old = baseline.get('results',{}).get(tool,{}).get(stage)
+			if old is not None and seconds > 0:
+				ratios["{0}.{1}".format(tool,stage)] = round(old/seconds,3)
+	return ratios
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the service area pre processing tools on synthetic data")
+	parser.add_argument('--zctas',type=int,default=1000,help="number of ZCTA polygons")
+	parser.add_argument('--points',type=int,default=100000,help="number of visit points for the dyad table creator")
+	parser.add_argument('--dyads',type=int,default=100000,help="number of dyads for the checker and reconciler")
+	parser.add_argument('--ties',type=int,default=10000,help="number of rows in the tie CSV")
+	parser.add_argument('--processes',type=int,default=2,help="processes used to count dyads and resolve ties")
+	parser.add_argument('--repeat',type=int,default=1,help="runs of each stage, the fastest is kept")
+	parser.add_argument('--seed',type=int,default=0)
+	parser.add_argument('--output',help="JSON file to write the results to, printed if not given")
+	parser.add_argument('--baseline',help="JSON results of an earlier run to compare against")
+	args = parser.parse_args(argv)
+
+	results = runBenchmark(args.zctas,args.points,args.dyads,args.ties,args.processes,args.repeat,args.seed)
+	if args.baseline:
+		with open(args.baseline) as f:
+			results['speedup'] = compareResults(json.load(f),results)
+	text = json.dumps(results,indent=2,sort_keys=True)
+	if args.output:
+		with open(args.output,'w') as f:
+			f.write(text)
+	else:
+		sys.stdout.write(text + "\n")
+	return results
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,81 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : checker.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Checks that all the ZCTAs in a dyad table are also in the ZCTA layer used to
+# generate service areas, and totals the visits that would be lost for each missing ZCTA. Dyad
+# stores too large for memory are checked a block at a time.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import numpy
+from collections import defaultdict
+from servicearea import store, zcta
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#sorted index of unique ZCTA codes to check dyad ZCTAs against
+def zctaIndex(zctas):
+	return zcta.index(zctas)
+
+#returns a boolean array flagging the values that are not found in the sorted index of ZCTAs.
+#searchsorted does a binary search for every value at once instead of scanning a list per row
+def notInIndex(values, index):
+	if len(index) == 0:
+		return numpy.ones(len(values),dtype=bool)
+	position = numpy.searchsorted(index,values) #where each value would be inserted into the index
+	position[position == len(index)] = 0 #values past the end of the index can't be in it
+	return index[position] != values
+
+#sums visits for each unique ZCTA in keys, returning the ZCTAs and their visit totals
+def visitsByZCTA(keys, visits):
+	uniqueKeys, inverse = numpy.unique(keys,return_inverse=True)
+	return uniqueKeys, numpy.bincount(inverse.ravel(),weights=visits,minlength=len(uniqueKeys))
+
+#check the recipient and provider columns of a dyad table against a sorted ZCTA index. Returns a
+#dictionary with the sorted missing ZCTAs (as 5 digit text), the visits missed for each as a
+#recipient and as a provider, the total visits and the visits missed (a dyad missing both ends is
+#counted once)
+def checkDyads(recs, provs, visits, index):
+	recs = zcta.encode(recs)
+	provs = zcta.encode(provs)
+	visits = numpy.asarray(visits,dtype=numpy.float64)
+
+	recMissing = notInIndex(recs,index) #rows where the recipient isn't in the ZCTA layer
+	provMissing = notInIndex(provs,index) #rows where the provider isn't in the ZCTA layer
+
+	#visits missed per ZCTA, split by the role the ZCTA plays in the dyad
+	recZCTAs, recVisits = visitsByZCTA(recs[recMissing],visits[recMissing])
+	provZCTAs, provVisits = visitsByZCTA(provs[provMissing],visits[provMissing])
+	recZCTAs, provZCTAs = zcta.decode(recZCTAs), zcta.decode(provZCTAs)
+
+	return {'missing':sorted(set(recZCTAs.tolist()) | set(provZCTAs.tolist())),
+		'recVisits':dict(zip(recZCTAs.tolist(),recVisits.tolist())),
+		'provVisits':dict(zip(provZCTAs.tolist(),provVisits.tolist())),
+		'visitsTotal':float(visits.sum()),
+		'visitsMissed':float(visits[recMissing | provMissing].sum())}
+
+#check a dyad store a block of recipient groups at a time, reading the mapped columns as slices.
+#Returns the same dictionary as checkDyads
+def checkStore(dyadStore, index, visitsField="VISITS_DYAD", rows=store.BlockRows):
+	recVisits, provVisits = defaultdict(float), defaultdict(float)
+	visitsTotal = visitsMissed = 0.0
+	for start, stop in dyadStore.blocks(rows):
+		block = checkDyads(dyadStore[store.RecField][start:stop],dyadStore[store.ProvField][start:stop],
+			dyadStore[visitsField][start:stop],index)
+		for key, visits in block['recVisits'].items():
+			recVisits[key] += visits
+		for key, visits in block['provVisits'].items():
+			provVisits[key] += visits
+		visitsTotal += block['visitsTotal']
+		visitsMissed += block['visitsMissed']
+	return {'missing':sorted(set(recVisits) | set(provVisits)),'recVisits':dict(recVisits),
+		'provVisits':dict(provVisits),'visitsTotal':visitsTotal,'visitsMissed':visitsMissed}
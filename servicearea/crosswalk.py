@@ -0,0 +1,188 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : crosswalk.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-28 15:50:59
+# Version		: $1.0$
+# Description	: Zip to ZCTA crosswalk handling. The imported national crosswalk is kept in a local
+# cache, one folder per source URL holding the crosswalk as a compressed numpy archive, a sorted zip
+# to ZCTA index and a small json file with the content hash of the downloaded file, so later runs
+# only re-import the spreadsheet when its content changes. The rows for any set of states are
+# pulled out of the national crosswalk in a single pass.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import json
+import time
+import hashlib
+import numpy
+from servicearea import ingest, zcta
+from servicearea.tables import findField, fromColumns
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#folder for a source URL within the cache folder
+def cacheFolder(cacheDir, url):
+	return os.path.join(cacheDir,hashlib.sha1(url.encode('utf-8')).hexdigest()[:16])
+
+#paths of the archive and metadata files for a source URL
+def cachePaths(cacheDir, url):
+	folder = cacheFolder(cacheDir,url)
+	return os.path.join(folder,'crosswalk.npz'), os.path.join(folder,'meta.json')
+
+#sha1 of a file's content, read in 1mb blocks
+def fileHash(path):
+	sha = hashlib.sha1()
+	with open(path,'rb') as f:
+		for block in iter(lambda: f.read(1024*1024),b''):
+			sha.update(block)
+	return sha.hexdigest()
+
+#metadata for the cached copy of a URL, None if nothing is cached or the archive is missing
+def loadMeta(cacheDir, url):
+	npzPath, metaPath = cachePaths(cacheDir,url)
+	if not (os.path.exists(npzPath) and os.path.exists(metaPath)):
+		return None
+	with open(metaPath) as f:
+		return json.load(f)
+
+#save an imported crosswalk array to the cache along with a sorted zip to ZCTA index. Files are
+#written under temporary names first so an interrupted run can't leave a half written cache
+def saveCrosswalk(cacheDir, url, contentHash, table, zipField, zctaField, stateField):
+	npzPath, metaPath = cachePaths(cacheDir,url)
+	if not os.path.exists(os.path.dirname(npzPath)):
+		os.makedirs(os.path.dirname(npzPath))
+
+	zips, zctas = zcta.crosswalk(table[zipField],table[zctaField]) #encoded whether imported as text or numbers
+
+	tempPath = npzPath + '.tmp.npz'
+	numpy.savez_compressed(tempPath,table=table,zips=zips,zctas=zctas)
+	if os.path.exists(npzPath):
+		os.remove(npzPath)
+	os.rename(tempPath,npzPath)
+
+	meta = {'url':url,'sha1':contentHash,'rows':len(table),'zipField':zipField,'zctaField':zctaField,
+		'stateField':stateField,'imported':time.strftime('%Y-%m-%d %H:%M:%S')}
+	with open(metaPath + '.tmp','w') as f:
+		json.dump(meta,f,indent=1)
+	if os.path.exists(metaPath):
+		os.remove(metaPath)
+	os.rename(metaPath + '.tmp',metaPath)
+	return meta
+
+#build the crosswalk table from rows of the national crosswalk (lists of strings, the header first)
+#as they're parsed, keeping only the zip, state and ZCTA columns. Rows are turned into columns
+#chunkRows at a time, so the rows of the whole spreadsheet are never held at once. Zips and ZCTAs
+#that lost their leading zeros as spreadsheet numbers are padded back to 5 digits
+def readCrosswalk(rows, chunkRows=100000):
+	rows = iter(rows)
+	header = [name.strip() for name in next(rows)]
+	names = [findField(header,"ZIP",caseSensitive=True),findField(header,["STATE","State"],caseSensitive=True),
+		findField(header,"ZCTA",caseSensitive=True)]
+	keep = [header.index(name) for name in names]
+	last = max(keep)
+
+	chunks = [[] for name in names]
+	chunk = []
+	def flush():
+		for i, column in enumerate(zip(*chunk)):
+			chunks[i].append(numpy.array([value.strip() for value in column],dtype='U'))
+		del chunk[:]
+
+	for row in rows:
+		if len(row) <= last or not any(row[i].strip() for i in keep):
+			continue #blank or short line
+		chunk.append([row[i] for i in keep])
+		if len(chunk) >= chunkRows:
+			flush()
+	if chunk:
+		flush()
+
+	columns = [numpy.concatenate(c) if c else numpy.zeros(0,dtype='U5') for c in chunks]
+	for i in (0,2):
+		codes = zcta.encode(columns[i])
+		columns[i] = numpy.where(codes != zcta.Invalid,zcta.decode(codes),columns[i])
+	return fromColumns(names,columns)
+
+#load the cached crosswalk array for a URL
+def loadCrosswalk(cacheDir, url):
+	npzPath, metaPath = cachePaths(cacheDir,url)
+	with numpy.load(npzPath) as archive:
+		return archive['table']
+
+#load the sorted zip to ZCTA index from a cache archive. Returns sorted zip codes and their ZCTA
+#codes, archives written before the index was encoded hold text and are encoded as they're loaded
+def loadIndex(npzPath):
+	with numpy.load(npzPath) as archive:
+		return zcta.crosswalk(archive['zips'],archive['zctas'])
+
+#download the crosswalk at url into its cache folder and return its sorted zip to ZCTA index. A CSV
+#is parsed as it arrives and a spreadsheet read a row at a time once it's downloaded, and either is
+#only imported again when the SHA-1 of the file differs from the cached copy's. When the download
+#fails the cached copy is used if there is one. Returns the zips, their ZCTAs and the SHA-1 of the
+#crosswalk they came from
+def fetchCrosswalk(cacheDir, url, progress=None):
+	if not (ingest.isCsv(url) or ingest.isXlsx(url)):
+		raise ValueError("{0} can't be streamed, only csv and xlsx crosswalks can".format(url))
+	folder = cacheFolder(cacheDir,url)
+	if not os.path.exists(folder):
+		os.makedirs(folder)
+	npzPath = cachePaths(cacheDir,url)[0]
+	meta = loadMeta(cacheDir,url)
+	download = ingest.Download(url,os.path.join(folder,url.split('/')[-1]),progress=progress)
+	table = None
+	try:
+		if ingest.isCsv(url):
+			table = readCrosswalk(ingest.csvRows(download)) #parsed as it arrives
+		else:
+			download.run()
+	except IOError:
+		if meta is None:
+			raise
+		return loadIndex(npzPath) + (meta['sha1'],)
+	if meta is not None and meta['sha1'] == download.sha1:
+		return loadIndex(npzPath) + (download.sha1,)
+	if table is None:
+		table = readCrosswalk(ingest.xlsxRows(download.path))
+	zipField, stateField, zctaField = table.dtype.names
+	saveCrosswalk(cacheDir,url,download.sha1,table,zipField,zctaField,stateField)
+	return zcta.crosswalk(table[zipField],table[zctaField]) + (download.sha1,)
+
+#state names as they can appear in the crosswalk state field, keyed by abbreviation
+StateNames = {'AL':'ALABAMA','AK':'ALASKA','AZ':'ARIZONA','AR':'ARKANSAS','CA':'CALIFORNIA','CO':'COLORADO',
+	'CT':'CONNECTICUT','DE':'DELAWARE','DC':'DISTRICT OF COLUMBIA','FL':'FLORIDA','GA':'GEORGIA','HI':'HAWAII',
+	'ID':'IDAHO','IL':'ILLINOIS','IN':'INDIANA','IA':'IOWA','KS':'KANSAS','KY':'KENTUCKY','LA':'LOUISIANA',
+	'ME':'MAINE','MD':'MARYLAND','MA':'MASSACHUSETTS','MI':'MICHIGAN','MN':'MINNESOTA','MS':'MISSISSIPPI',
+	'MO':'MISSOURI','MT':'MONTANA','NE':'NEBRASKA','NV':'NEVADA','NH':'NEW HAMPSHIRE','NJ':'NEW JERSEY',
+	'NM':'NEW MEXICO','NY':'NEW YORK','NC':'NORTH CAROLINA','ND':'NORTH DAKOTA','OH':'OHIO','OK':'OKLAHOMA',
+	'OR':'OREGON','PA':'PENNSYLVANIA','PR':'PUERTO RICO','RI':'RHODE ISLAND','SC':'SOUTH CAROLINA',
+	'SD':'SOUTH DAKOTA','TN':'TENNESSEE','TX':'TEXAS','UT':'UTAH','VT':'VERMONT','VA':'VIRGINIA',
+	'WA':'WASHINGTON','WV':'WEST VIRGINIA','WI':'WISCONSIN','WY':'WYOMING'}
+
+#pull the rows for the given state abbreviations out of the national crosswalk in one pass. States
+#are matched by abbreviation or full name. Returns {state: positions of its rows} and
+#{state: zip to ZCTA dictionary}
+def partitionStates(table, stateField, zipField, zctaField, states):
+	stateLookup = {} #every value of the state field to look for, mapped to the requested abbreviation
+	for state in states:
+		stateLookup[state] = state
+		if state in StateNames:
+			stateLookup[StateNames[state]] = state
+
+	stateRows = dict((state,[]) for state in states)
+	stateZipZCTA = dict((state,{}) for state in states)
+	fields = list(table.dtype.names)
+	stateIndex, zipIndex, zctaIndex = fields.index(stateField), fields.index(zipField), fields.index(zctaField)
+	for i, row in enumerate(table.tolist()):
+		state = stateLookup.get(str(row[stateIndex]).strip().upper())
+		if state is not None:
+			stateRows[state].append(i)
+			stateZipZCTA[state][str(row[zipIndex])] = str(row[zctaIndex]) #converting data to strings
+	return stateRows, stateZipZCTA
@@ -0,0 +1,125 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : csvutil.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:39:50
+# Version		: $1.0$
+# Description	: CSV helpers that behave the same under the python 2 runtime used by ArcGIS and the
+# python 3 runtime of the Linux batch workers. Dialects are sniffed once per file and cached, and
+# files are read a chunk of rows at a time straight into numpy columns, so the tie, dyad and ZCTA
+# tools all read CSVs the same way.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import csv
+import sys
+import numpy
+from itertools import chain, islice
+
+###################################################################################################
+#Global variables
+###################################################################################################
+ChunkRows = 100000 #rows parsed at a time
+Dialects = {} #dialects already sniffed, keyed by path, size and modification time
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#open a csv file for reading ('r') or writing ('w'). Python 2 needs binary mode, python 3 needs text
+#mode without newline translation
+def openCsv(path, mode='r'):
+	if sys.version_info[0] == 2:
+		return open(path,mode + 'b')
+	return open(path,mode,newline='')
+
+#sniff into 10kb of a csv to find its dialect. Each file is only sniffed once until it changes
+def sniffDialect(path):
+	info = os.stat(path)
+	key = (os.path.realpath(path),info.st_size,info.st_mtime)
+	if key not in Dialects:
+		with openCsv(path) as inFile:
+			Dialects[key] = csv.Sniffer().sniff(inFile.read(10*1024))
+	return Dialects[key]
+
+#header of a csv file
+def readHeader(path, dialect):
+	with openCsv(path) as inFile:
+		return next(csv.reader(inFile,dialect))
+
+#csv text for the python runtime, python 2's csv module reads bytes
+def _text(data):
+	if sys.version_info[0] == 2:
+		return data
+	return data.decode('utf-8','replace')
+
+#type a column (a list) of text values as integers, then floats, then text. Converting a list is
+#several times quicker than converting an array of text
+def typedColumn(values):
+	for dtype in (numpy.int64,numpy.float64):
+		try:
+			return numpy.array(values,dtype=dtype)
+		except (ValueError,TypeError):
+			pass
+	return numpy.array(values,dtype=str)
+
+#split lines of text into columns on the delimiter. Returns None when any line doesn't have width
+#fields (blank lines, ragged rows), they're left to the csv module. Every line is checked, a short
+#row and a long one can add up to the right number of fields
+def _splitColumns(text, delimiter, width):
+	if text.endswith('\n'):
+		text = text[:-1]
+	lines = text.split('\n')
+	if any(line.count(delimiter) != width - 1 for line in lines):
+		return None
+	flat = delimiter.join(lines).split(delimiter)
+	return [flat[i::width] for i in range(width)]
+
+#rows from the csv module as columns, blank rows skipped and short rows padded to width fields
+def rowColumns(rows, width):
+	rows = [row + [''] * (width - len(row)) if len(row) < width else row[:width] for row in rows if row]
+	if not rows:
+		return None
+	return [list(column) for column in zip(*rows)]
+
+#read a csv a chunk of rows at a time as columns of text, one list per field. fields picks the
+#columns by name or position, every column when not given. While the file has no quote characters
+#lines are split on the delimiter directly, from the first chunk that has one the rest of the file
+#is parsed by the csv module so quoted fields can hold delimiters and line breaks. The dialect is
+#sniffed (once) when not given. Yields (header, columns) for every chunk
+def readChunks(path, fields=None, chunkRows=ChunkRows, dialect=None):
+	dialect = dialect or sniffDialect(path)
+	delimiter = dialect.delimiter
+	quote = dialect.quotechar or ''
+	simple = not (dialect.skipinitialspace or dialect.escapechar) #can be split without the csv module
+	with open(path,'rb') as inFile:
+		header = next(csv.reader([_text(inFile.readline())],dialect))
+		width = len(header)
+		wanted = [f if isinstance(f,int) else header.index(f) for f in fields] if fields else list(range(width))
+		reader = None #the csv module's reader once a quoted field has been seen
+		while True:
+			if reader is None:
+				lines = list(islice(inFile,chunkRows))
+				if not lines:
+					break
+				text = _text(b''.join(lines)).replace('\r\n','\n')
+				columns = None
+				if simple and not (quote and quote in text):
+					columns = _splitColumns(text,delimiter,width)
+				elif quote and quote in text:
+					reader = csv.reader((_text(line) for line in chain(lines,inFile)),dialect)
+					columns = rowColumns(list(islice(reader,chunkRows)),width)
+				if columns is None and reader is None:
+					columns = rowColumns(list(csv.reader(text.split('\n'),dialect)),width)
+			else:
+				rows = list(islice(reader,chunkRows))
+				if not rows:
+					break
+				columns = rowColumns(rows,width)
+			if columns:
+				yield header, [columns[i] for i in wanted]
@@ -0,0 +1,91 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : dyads.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-05-21 11:00:38
+# Version		: $1.0$
+# Description	: Builds dyad tables from visits. The visits for each member zip and provider zip
+# pair are counted, optionally across a pool of processes over chunks of the input, and turned into
+# dyad rows with the total and max visits of each member zip.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import sys
+import multiprocessing
+from collections import defaultdict, Counter
+from servicearea import tables
+
+###################################################################################################
+#Global variables
+###################################################################################################
+DyadFields = ['REC_ZIP','PROV_ZIP','VISITS_DYAD','MAX_VISITS','VISITS_TOTAL'] #fields of a new dyad table
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#a pool of worker processes, also used to resolve ties in parallel. initializer is called in every
+#worker with initargs, which is how workers are given read only data once instead of with every task
+def processPool(processes, initializer=None, initargs=()):
+	#ArcGIS runs script tools inside its own executable, point the pool at python instead
+	if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+		multiprocessing.set_executable(os.path.join(sys.exec_prefix,'python.exe'))
+	return multiprocessing.Pool(processes,initializer,initargs)
+
+#count (member zip, provider zip) pairs from an iterable of pairs
+def countPairs(pairs):
+	return Counter(tuple(pair) for pair in pairs)
+
+#worker for the process pool. readChunk is a module level function that returns the pairs of one
+#chunk of the input, the arguments come packed in a tuple so it can be used with imap
+def _countChunk(args):
+	readChunk, chunk = args
+	return countPairs(readChunk(chunk))
+
+#count pairs across a pool of processes. readChunk(chunk) returns the pairs for one chunk, each
+#chunk is counted by a worker and the partial counts are merged in chunk order, so the result
+#matches countPairs over the whole input
+def countPairsParallel(readChunk, chunks, processes=None):
+	processes = processes or multiprocessing.cpu_count()
+	if processes <= 1 or len(chunks) <= 1:
+		pairCounts = Counter()
+		for chunk in chunks:
+			pairCounts.update(countPairs(readChunk(chunk)))
+		return pairCounts
+
+	pool = processPool(processes)
+	try:
+		pairCounts = Counter()
+		for partial in pool.imap(_countChunk,[(readChunk,chunk) for chunk in chunks]):
+			pairCounts.update(partial)
+	finally:
+		pool.close()
+		pool.join()
+	return pairCounts
+
+#sort key that lets missing (None) zips sort first without comparing None to numbers
+def _pairKey(item):
+	(member, provider), visits = item
+	return (member is not None, member, provider is not None, provider)
+
+#build the dyad rows from a Counter of (member zip, provider zip) visits. Member totals and maxima
+#are found once per member, rows are returned sorted by member then provider zip as
+#(member zip, provider zip, visits, max visits, total visits)
+def dyadRows(pairCounts):
+	memberTotal = defaultdict(int)
+	memberMax = defaultdict(int)
+	for (member, provider), visits in pairCounts.items():
+		memberTotal[member] += visits
+		if visits > memberMax[member]:
+			memberMax[member] = visits
+	return [(member,provider,visits,memberMax[member],memberTotal[member])
+		for (member, provider), visits in sorted(pairCounts.items(),key=_pairKey)]
+
+#the dyad rows as a table with the DyadFields, missing zips are written as 0
+def dyadTable(rows):
+	return tables.fromRows(DyadFields,[[0 if v is None else v for v in row] for row in rows])
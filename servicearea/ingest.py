@@ -0,0 +1,348 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : ingest.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Streaming download and parsing of source files. A download is fetched in chunks
+# into a .part file next to its destination and resumed with an HTTP range request when the
+# connection drops or the tool is run again, so a large file is never fetched twice. The chunks are
+# handed on as they arrive, so a CSV is parsed while it downloads. Spreadsheets (.xlsx) are read a
+# row at a time straight from the worksheet XML, without converting them to a table first.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import re
+import csv
+import sys
+import json
+import time
+import socket
+import hashlib
+import zipfile
+from xml.etree import ElementTree
+
+try:
+	from urllib2 import Request, urlopen, HTTPError #python 2 runtime used by ArcGIS
+	from httplib import HTTPException
+except ImportError:
+	from urllib.request import Request, urlopen
+	from urllib.error import HTTPError
+	from http.client import HTTPException
+
+###################################################################################################
+#Global variables
+###################################################################################################
+ChunkSize = 256*1024 #bytes read from the connection at a time
+Retries = 5 #consecutive failed attempts before a download gives up
+Wait = 1.0 #seconds waited after the first failure, doubled after each one after that
+Timeout = 60 #seconds a connection can stall before it counts as a failure
+SheetNamespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#file types that can be parsed as they're streamed
+def isCsv(path):
+	return os.path.splitext(str(path))[1].lower() in ('.csv','.txt')
+
+def isXlsx(path):
+	return os.path.splitext(str(path))[1].lower() in ('.xlsx','.xlsm')
+
+#sources given as a URL rather than a path
+def isUrl(source):
+	return re.match(r'(https?|ftp)://',str(source).lower()) is not None
+
+#the validator (ETag or Last-Modified) the server gives for url, None when it gives neither. Only the
+#headers of the response are read, a GET is used because not every server answers HEAD requests.
+#Raises IOError when the server can't be reached or refuses the request
+def remoteValidator(url, timeout=Timeout):
+	try:
+		response = urlopen(Request(url),timeout=timeout)
+	except HTTPException as e:
+		raise IOError("{0} couldn't be reached: {1}".format(url,e))
+	try:
+		return response.info().get('ETag') or response.info().get('Last-Modified')
+	finally:
+		response.close()
+
+#lines of text from a stream of byte blocks, split wherever the blocks end
+def _lines(blocks):
+	rest = b''
+	for block in blocks:
+		lines = (rest + block).split(b'\n')
+		rest = lines.pop()
+		for line in lines:
+			yield _text(line + b'\n')
+	if rest:
+		yield _text(rest)
+
+#csv text for the python runtime, python 2's csv module reads bytes
+def _text(line):
+	if sys.version_info[0] == 2:
+		return line
+	return line.decode('utf-8','replace')
+
+#rows of a csv as lists of strings, parsed from a stream of byte blocks (a Download or an open file)
+def csvRows(blocks):
+	mark = '\xef\xbb\xbf' if sys.version_info[0] == 2 else u'\ufeff' #byte order mark left by excel
+	first = True
+	for row in csv.reader(_lines(blocks)):
+		if first and row and row[0].startswith(mark):
+			row[0] = row[0][len(mark):]
+		first = False
+		yield row
+
+#blocks of a file on disk
+def _fileBlocks(path):
+	with open(str(path),'rb') as f:
+		for block in iter(lambda: f.read(ChunkSize),b''):
+			yield block
+
+#zero based column of a cell reference, 'C12' is 2
+def _cellColumn(reference):
+	column = 0
+	for letter in re.match('[A-Z]+',reference).group(0):
+		column = column*26 + ord(letter) - ord('A') + 1
+	return column - 1
+
+#worksheet of the first sheet in a workbook
+def _firstSheet(book):
+	names = book.namelist()
+	if 'xl/worksheets/sheet1.xml' in names:
+		return 'xl/worksheets/sheet1.xml'
+	sheets = sorted(n for n in names if n.startswith('xl/worksheets/sheet') and n.endswith('.xml'))
+	if not sheets:
+		raise ValueError("No worksheet found in {0}".format(book.filename))
+	return sheets[0]
+
+#shared strings of a workbook, the text cells of a sheet refer to them by position
+def _sharedStrings(book):
+	if 'xl/sharedStrings.xml' not in book.namelist():
+		return []
+	strings = []
+	with book.open('xl/sharedStrings.xml') as f:
+		for event, element in ElementTree.iterparse(f):
+			if element.tag == SheetNamespace + 'si':
+				strings.append(u''.join(t.text or u'' for t in element.iter(SheetNamespace + 't')))
+				element.clear()
+	return strings
+
+#rows of the first sheet of an .xlsx workbook as lists of strings. The worksheet XML is parsed a row
+#at a time and every row is cleared once it's read, so the sheet is never held in memory
+def xlsxRows(path):
+	book = zipfile.ZipFile(str(path))
+	try:
+		strings = _sharedStrings(book)
+		with book.open(_firstSheet(book)) as f:
+			parent = None
+			for event, element in ElementTree.iterparse(f,events=('start','end')):
+				if event == 'start':
+					if element.tag == SheetNamespace + 'sheetData':
+						parent = element
+					continue
+				if element.tag != SheetNamespace + 'row':
+					continue
+				row = []
+				for cell in element.iter(SheetNamespace + 'c'):
+					reference = cell.get('r')
+					column = _cellColumn(reference) if reference else len(row)
+					cellType = cell.get('t')
+					if cellType == 'inlineStr':
+						value = u''.join(t.text or u'' for t in cell.iter(SheetNamespace + 't'))
+					else:
+						v = cell.find(SheetNamespace + 'v')
+						value = v.text if v is not None and v.text is not None else u''
+						if cellType == 's' and value:
+							value = strings[int(value)]
+					row.extend([u''] * (column + 1 - len(row)))
+					row[column] = value
+				yield row
+				if parent is not None:
+					parent.clear() #drop the rows already read
+				else:
+					element.clear()
+	finally:
+		book.close()
+
+#rows of a csv or .xlsx file already on disk
+def fileRows(path):
+	if isXlsx(path):
+		return xlsxRows(path)
+	if isCsv(path):
+		return csvRows(_fileBlocks(path))
+	raise ValueError("{0} can't be streamed, only csv and xlsx files can".format(path))
+
+###################################################################################################
+#Download class
+###################################################################################################
+
+#a resumable download of url to path. Iterating over it yields the file's content in blocks from the
+#start, the part already fetched by an earlier attempt first, and only moves the finished file to
+#path once every byte has arrived. A dropped connection or a read that stalls is retried with a
+#range request for the rest of the file, waiting longer after each consecutive failure. The .part
+#file is kept when the download gives up so the next run picks up where it stopped. When the server
+#answers a retry with the whole file instead of the rest of it, the file changed after part of it
+#was handed on, so IOError is raised and the .part file dropped rather than joining two versions
+#of the file. sha1 and size are set once the download is complete, progress is called with the
+#bytes received so far
+class Download(object):
+	def __init__(self, url, path, chunkSize=ChunkSize, retries=Retries, wait=Wait, timeout=Timeout, progress=None):
+		self.url = url
+		self.path = str(path)
+		self.partPath = self.path + '.part'
+		self.chunkSize = chunkSize
+		self.retries = retries
+		self.wait = wait
+		self.timeout = timeout
+		self.progress = progress
+		self.sha1 = None
+		self.size = None
+		self.resumed = 0 #bytes taken from an earlier attempt's .part file
+		self.attempts = 0 #requests made, more than one when the download was resumed
+		self.total = None #size of the file when the server gave it
+
+	#the validator (ETag or Last-Modified) the .part file was fetched with, checked by the server so
+	#a part of an older version of the file is never resumed
+	def _loadValidator(self):
+		try:
+			with open(self.partPath + '.json') as f:
+				meta = json.load(f)
+			return meta['validator'] if meta['url'] == self.url else None
+		except (IOError,ValueError,KeyError):
+			return None
+
+	def _saveValidator(self, validator):
+		with open(self.partPath + '.json','w') as f:
+			json.dump({'url':self.url,'validator':validator},f)
+
+	#request the file from offset on. Returns the response and the offset it actually starts at,
+	#0 when the server sent the whole file
+	def _open(self, offset, validator):
+		self.attempts += 1
+		request = Request(self.url)
+		if offset:
+			request.add_header('Range','bytes={0}-'.format(offset))
+			if validator:
+				request.add_header('If-Range',validator)
+		try:
+			response = urlopen(request,timeout=self.timeout)
+		except HTTPError as e:
+			if e.code == 416 and offset: #the part on disk is no longer a prefix of the file
+				return self._open(0,validator)
+			raise
+		if offset and response.getcode() == 206:
+			total = re.search(r'/(\d+)',response.info().get('Content-Range') or '')
+			self.total = int(total.group(1)) if total else None
+			return response, offset
+		length = response.info().get('Content-Length')
+		self.total = int(length) if length else None
+		return response, 0
+
+	#wait before the next attempt, giving up after too many consecutive failures
+	def _failed(self, failures, error):
+		if failures > self.retries:
+			raise IOError("Download of {0} failed after {1} attempts: {2}".format(self.url,failures,error))
+		time.sleep(self.wait*2**(failures - 1))
+
+	def __iter__(self):
+		sha = hashlib.sha1()
+		received = os.path.getsize(self.partPath) if os.path.exists(self.partPath) else 0
+		validator = self._loadValidator() if received else None
+		failures = 0
+		while True:
+			try:
+				response, start = self._open(received,validator)
+				break
+			except HTTPError as e:
+				if e.code < 500:
+					raise
+				failures += 1
+				self._failed(failures,e)
+			except (IOError,HTTPException,socket.error) as e:
+				failures += 1
+				self._failed(failures,e)
+
+		#-------------------------------------------------------------------------------------------
+		#the part fetched by an earlier run, when the server agreed to resume it
+		#-------------------------------------------------------------------------------------------
+		if start:
+			with open(self.partPath,'rb') as f:
+				for block in iter(lambda: f.read(self.chunkSize),b''):
+					sha.update(block)
+					yield block
+			self.resumed = received
+		else:
+			received = 0
+			validator = response.info().get('ETag') or response.info().get('Last-Modified')
+			if validator:
+				self._saveValidator(validator)
+
+		#-------------------------------------------------------------------------------------------
+		#the rest from the connection, reconnecting from the last byte received when it drops
+		#-------------------------------------------------------------------------------------------
+		with open(self.partPath,'ab' if start else 'wb') as out:
+			while True:
+				try:
+					block = response.read(self.chunkSize)
+					if not block and self.total is not None and received < self.total:
+						raise IOError("connection closed at {0:,} of {1:,} bytes".format(received,self.total))
+				except (IOError,HTTPException,socket.error) as e:
+					response.close()
+					failures += 1
+					self._failed(failures,e)
+					try:
+						response, start = self._open(received,validator)
+					except (IOError,HTTPException,socket.error):
+						response, start = _Empty(), received #counted as a failure on the next read
+						continue
+					if start != received: #the file changed on the server, what was handed on can't be finished
+						response.close()
+						out.close()
+						self._discard()
+						raise IOError("{0} changed on the server during the download, run it again to fetch the new file".format(self.url))
+					continue
+				if not block:
+					break
+				failures = 0
+				out.write(block)
+				received += len(block)
+				sha.update(block)
+				if self.progress is not None:
+					self.progress(received)
+				yield block
+		response.close()
+
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(self.partPath,self.path)
+		if os.path.exists(self.partPath + '.json'):
+			os.remove(self.partPath + '.json')
+		self.sha1 = sha.hexdigest()
+		self.size = received
+
+	#drop the .part file and its validator, so the next run fetches the file from the start
+	def _discard(self):
+		for path in (self.partPath,self.partPath + '.json'):
+			if os.path.exists(path):
+				os.remove(path)
+
+	#download the whole file without looking at its content
+	def run(self):
+		for block in self:
+			pass
+		return self
+
+#stands in for a connection that couldn't be reopened, so the read loop counts the failure and retries
+class _Empty(object):
+	def read(self, size):
+		raise IOError("no connection")
+
+	def close(self):
+		pass
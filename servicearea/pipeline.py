@@ -0,0 +1,263 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : pipeline.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Runs the pre processing steps as one pipeline. Each step is a stage that names the
+# stages and sources it needs. Stages are run in dependency order and hand their results to the
+# stages after them in memory, so the ZCTA layer, crosswalk and dyad table are each read once and
+# only the final outputs are written. Final stages whose sources and settings haven't changed since
+# the last run, and whose output still exists, are skipped along with everything only they need.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import json
+import time
+import hashlib
+import numpy
+from servicearea import checker, crosswalk, ingest, reconcile, tables, ties, zcta
+from servicearea.backends import CsvBackend
+
+###################################################################################################
+#Pipeline and stage classes
+###################################################################################################
+
+#a step of the pipeline. run is called with the results of the input stages, in order. Final stages
+#are the ones the pipeline is run for, they write their target (if they have one) and return a
+#summary dictionary that is kept in the state file. sources and target are (backend, path) pairs
+class Stage(object):
+	def __init__(self, name, run, inputs=(), sources=(), target=None, params=None, final=False):
+		self.name = name
+		self.run = run
+		self.inputs = list(inputs)
+		self.sources = [s for s in sources if s[1]]
+		self.target = target
+		self.params = params or {}
+		self.final = final or target is not None
+
+class Pipeline(object):
+	def __init__(self, stages=(), statePath=None):
+		self.stages = {}
+		self.statePath = statePath #json file of fingerprints and summaries from the last run
+		for stage in stages:
+			self.add(stage)
+
+	def add(self, stage):
+		if stage.name in self.stages:
+			raise ValueError("Stage {0} added twice".format(stage.name))
+		self.stages[stage.name] = stage
+		return stage
+
+	#stage names in dependency order, inputs before the stages that use them
+	def order(self):
+		ordered = []
+		visiting = set()
+		def visit(name, path):
+			if name in ordered:
+				return
+			if name not in self.stages:
+				raise ValueError("Stage {0} needs unknown stage {1}".format(path[-1],name))
+			if name in visiting:
+				raise ValueError("Stages depend on each other: {0}".format(" -> ".join(path + [name])))
+			visiting.add(name)
+			for inputName in self.stages[name].inputs:
+				visit(inputName,path + [name])
+			visiting.discard(name)
+			ordered.append(name)
+		for name in sorted(self.stages):
+			visit(name,[])
+		return ordered
+
+	#fingerprint of every stage from its name, settings, sources and the fingerprints of its inputs.
+	#None when a source can't be fingerprinted, so the stage is always run. Each source is only
+	#fingerprinted once however many stages read it
+	def fingerprints(self):
+		sourcePrints = {}
+		prints = {}
+		for name in self.order():
+			stage = self.stages[name]
+			parts = []
+			for backend, source in stage.sources:
+				key = (backend.name,source)
+				if key not in sourcePrints:
+					sourcePrints[key] = backend.fingerprint(source)
+				parts.append(sourcePrints[key])
+			parts.extend(prints[inputName] for inputName in stage.inputs)
+			if any(part is None for part in parts):
+				prints[name] = None
+			else:
+				target = stage.target[1] if stage.target is not None else None
+				text = json.dumps([name,stage.params,target,parts],sort_keys=True)
+				prints[name] = hashlib.sha1(text.encode('utf-8')).hexdigest()
+		return prints
+
+	def loadState(self):
+		if self.statePath and os.path.exists(self.statePath):
+			with open(self.statePath) as f:
+				return json.load(f)
+		return {}
+
+	def saveState(self, state):
+		if self.statePath:
+			with open(self.statePath,'w') as f:
+				json.dump(state,f,indent=2,sort_keys=True)
+
+	#final stages that have to be run, because they are new, changed or their output is missing
+	def changedStages(self, prints, state, force=False):
+		changed = []
+		for name in self.order():
+			stage = self.stages[name]
+			if not stage.final:
+				continue
+			if (force or prints[name] is None or state.get(name,{}).get('fingerprint') != prints[name]
+				or (stage.target is not None and not stage.target[0].exists(stage.target[1]))):
+				changed.append(name)
+		return changed
+
+	#run the changed final stages and the stages they need. progress is called with each stage name
+	#before it runs, and each stage is timed in runReport (a telemetry.RunReport) when one is given.
+	#Returns {stage: {'status': 'run'|'skipped'|'unused', 'summary': ...}}
+	def run(self, force=False, progress=None, runReport=None):
+		prints = self.fingerprints()
+		state = self.loadState()
+		results = {}
+
+		def evaluate(name):
+			if name not in results:
+				stage = self.stages[name]
+				inputs = [evaluate(inputName) for inputName in stage.inputs]
+				if progress:
+					progress(name)
+				if runReport is None:
+					results[name] = stage.run(*inputs)
+				else:
+					with runReport.stage(name):
+						results[name] = stage.run(*inputs)
+			return results[name]
+
+		for name in self.changedStages(prints,state,force):
+			summary = evaluate(name)
+			state[name] = {'fingerprint':prints[name],'summary':summary,
+				'completed':time.strftime('%Y-%m-%d %H:%M:%S')}
+			self.saveState(state) #saved after every stage so finished work isn't lost to a failure
+
+		report = {}
+		for name in self.order():
+			if name in results:
+				report[name] = {'status':'run','summary':state[name]['summary'] if self.stages[name].final else None}
+			elif self.stages[name].final:
+				report[name] = {'status':'skipped','summary':state.get(name,{}).get('summary')}
+			else:
+				report[name] = {'status':'unused','summary':None}
+		return report
+
+#a crosswalk published at a URL as a pipeline source, downloaded into the crosswalk cache folder
+#cacheDir and imported when its content changes (crosswalk.fetchCrosswalk). Its fingerprint is the
+#URL with the validator the server gives for the file, or with the SHA-1 of the cached copy when the
+#server can't be reached, so the stages after the download re-run when the crosswalk changes. It
+#can't be fingerprinted, and is always fetched, when the server gives no validator
+class CrosswalkDownload(object):
+	name = 'url'
+
+	def __init__(self, cacheDir, progress=None):
+		self.cacheDir = cacheDir
+		self.progress = progress
+		self.sha1 = None #of the crosswalk last fetched
+
+	def fingerprint(self, url):
+		try:
+			validator = ingest.remoteValidator(url)
+		except IOError:
+			meta = crosswalk.loadMeta(self.cacheDir,url)
+			validator = meta and 'sha1:' + meta['sha1'] #offline, the cached copy will be used
+		if not validator:
+			return None
+		return hashlib.sha1(u'{0}|{1}'.format(url,validator).encode('utf-8')).hexdigest()
+
+	#sorted zip and ZCTA code arrays of the crosswalk
+	def index(self, url):
+		zips, zctas, self.sha1 = crosswalk.fetchCrosswalk(self.cacheDir,url,self.progress)
+		return zips, zctas
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#sorted zip and ZCTA code arrays from a crosswalk table, a crosswalk.npz in the crosswalk cache or a
+#crosswalk downloaded from a URL
+def crosswalkIndex(backend, source):
+	if isinstance(backend,CrosswalkDownload):
+		return backend.index(source)
+	if source.lower().endswith('.npz'):
+		return crosswalk.loadIndex(source)
+	fieldNames = backend.fields(source)
+	table = backend.readTable(source,[tables.findField(fieldNames,'zip'),tables.findField(fieldNames,'zcta')])
+	return zcta.crosswalk(table[table.dtype.names[0]],table[table.dtype.names[1]])
+
+#a dyad table with the VISITS_TOTAL and Dyad_max columns the reconciler writes, added as zeros if
+#the table doesn't have them yet
+def withReconcileFields(dyads, utilizersField="VISITS_TOTAL", dyadMaxField="Dyad_max"):
+	names = list(dyads.dtype.names)
+	added = [(f,dtype) for f, dtype in ((utilizersField,numpy.int32),(dyadMaxField,numpy.int16)) if f not in names]
+	if not added:
+		return dyads
+	return tables.fromColumns(names + [f for f, dtype in added],
+		[dyads[n] for n in names] + [numpy.zeros(len(dyads),dtype=dtype) for f, dtype in added])
+
+#the stages of the pre processing tools, in the order the README gives them: tie resolution,
+#crosswalk, checking and reconciling the dyad table. Tables are given as (backend, path) pairs, and
+#a crosswalk at a URL as (CrosswalkDownload, url) so the crosswalk stage downloads it. The
+#tie stages are only added when a table of ties is given, and a neighbor table replaces the borders
+#built from the ZCTA geometries when it is given. tieProgress and tieProcesses are passed on to
+#ties.resolveTieCsv
+def preprocessingPipeline(zctas, crosswalkSource, dyadTable, reconciledTable, tieTable=None, tieOutput=None,
+	nbrTable=None, visitsField="VISITS_DYAD", blockSize=100000, statePath=None, tieProgress=None, tieProcesses=1):
+	zctaBackend, zctaPath = zctas
+	dyadBackend, dyadPath = dyadTable
+	zctaField = tables.findField(zctaBackend.fields(zctaPath),['ZCTA','ZIP'],caseSensitive=True)
+	dyadFields = dyadBackend.fields(dyadPath)
+	recField = tables.findField(dyadFields,'rec')
+	provField = tables.findField(dyadFields,'prov')
+
+	def checkStage(dyads, index):
+		return checker.checkDyads(dyads[recField],dyads[provField],dyads[visitsField],index)
+
+	def reconcileStage(dyads, index, crosswalkArrays):
+		reconciled, report = reconcile.reconcileDyads(dyads,recField,provField,visitsField,index,*crosswalkArrays)
+		reconciledTable[0].writeTable(reconciled,reconciledTable[1])
+		report['written'] = len(reconciled)
+		return report
+
+	pipeline = Pipeline(statePath=statePath)
+	pipeline.add(Stage('zctaIndex',lambda: checker.zctaIndex(zctaBackend.readTable(zctaPath,[zctaField])[zctaField]),
+		sources=[zctas]))
+	pipeline.add(Stage('crosswalk',lambda: crosswalkIndex(*crosswalkSource),sources=[crosswalkSource]))
+	pipeline.add(Stage('dyads',lambda: withReconcileFields(dyadBackend.readTable(dyadPath)),sources=[dyadTable]))
+	pipeline.add(Stage('check',checkStage,inputs=['dyads','zctaIndex'],params={'visits':visitsField},final=True))
+	pipeline.add(Stage('reconcile',reconcileStage,inputs=['dyads','zctaIndex','crosswalk'],
+		params={'visits':visitsField},target=reconciledTable))
+
+	if tieTable:
+		if nbrTable:
+			nbrBackend, nbrPath = nbrTable
+			def bordersStage():
+				nbrFields = nbrBackend.fields(nbrPath)
+				return ties.bordersFromTable(nbrBackend.readTable(nbrPath),tables.findField(nbrFields,'src_',True),
+					tables.findField(nbrFields,'nbr_',True),tables.findField(nbrFields,'LENGTH',True))
+			pipeline.add(Stage('borders',bordersStage,sources=[nbrTable]))
+		else:
+			pipeline.add(Stage('borders',lambda: ties.sharedBorders(zctaBackend.readPolygons(zctaPath,zctaField)),sources=[zctas]))
+		pipeline.add(Stage('centroids',lambda: zctaBackend.readCentroids(zctaPath,zctaField),sources=[zctas]))
+
+		def tieStage(borders, centroids):
+			return ties.resolveTieCsv(tieTable,tieOutput,borders,centroids[0],centroids[1],blockSize,tieProgress,
+				processes=tieProcesses)
+		pipeline.add(Stage('ties',tieStage,inputs=['borders','centroids'],sources=[(CsvBackend(),tieTable)],
+			target=(CsvBackend(),tieOutput)))
+	return pipeline
@@ -0,0 +1,371 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : reconcile.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Reconciles a dyad table against the ZCTA layer using a zip to ZCTA crosswalk.
+# Recipients and providers missing from the ZCTA layer are remapped through the crosswalk,
+# duplicate recipient/provider pairs are merged and the visit, max visit and Dyad_max fields are
+# recalculated for the recipients affected, all as whole column operations. In incremental mode
+# only the recipient groups whose rows or crosswalk entries changed since the last run are
+# reconciled, and a changelog of the rows that changed is returned. Dyad stores are reconciled a
+# block of recipient groups at a time. The impact of reconciling can be estimated from the
+# recipient, provider and visit columns alone without changing anything.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import json
+import hashlib
+import numpy
+from servicearea import store, tables, zcta
+from servicearea.checker import notInIndex
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#sorted zip and ZCTA code arrays from a zip to ZCTA dictionary
+def crosswalkArrays(zipZCTADict):
+	return zcta.crosswalk([str(k) for k in zipZCTADict.keys()],[str(v) for v in zipZCTADict.values()])
+
+#looks up every zip code in the sorted crosswalk zips at once. Returns the position of each code in
+#the crosswalk arrays and a boolean array flagging the codes that were found
+def crosswalkLookup(codes, zips):
+	position = zcta.positions(codes,zips)
+	found = position >= 0
+	position[~found] = 0
+	return position, found
+
+#returns the start index of each run of equal keys in a sorted array
+def groupStarts(keys):
+	if len(keys) == 0:
+		return numpy.zeros(0,dtype=numpy.intp)
+	return numpy.concatenate(([0],numpy.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+#sort-merge of the recipient/provider pairs of a table. Returns the stable order of the rows by
+#recipient then provider and the start of each run of equal pairs in that order. The visits of a
+#run are summed into its first row and the rest of the run is dropped, so the first row of each
+#pair keeps its place
+def pairRuns(rec, prov):
+	order = zcta.pairOrder(rec,prov)
+	rec, prov = rec[order], prov[order]
+	pairChange = numpy.ones(len(rec),dtype=bool)
+	pairChange[1:] = (rec[1:] != rec[:-1]) | (prov[1:] != prov[:-1])
+	return order, numpy.flatnonzero(pairChange)
+
+#remap the ZCTAs of a column that are missing from the sorted ZCTA index through the crosswalk. The
+#column is encoded first, so it can be text, integer or float. Returns the remapped codes and boolean
+#arrays flagging the values that were missing, remapped, and missing without a crosswalk entry
+def remapColumn(values, index, zips, zctas):
+	codes = zcta.encode(values)
+	missing = notInIndex(codes,index)
+	position, found = crosswalkLookup(codes,zips)
+	remap = missing & found #missing ZCTAs with an entry in the crosswalk
+	remapped = codes.copy()
+	remapped[remap] = zctas[position[remap]]
+	return remapped, missing, remap, missing & ~found
+
+#remap the recipients and providers of a dyad table. Returns the remapped recipient and provider
+#codes, the visit column, the rows whose recipient or provider was remapped and the report of what
+#was found. Blank recipients and providers encode as Invalid and count as missing without an entry
+def remapDyads(dyads, recField, provField, visitsField, index, zips, zctas):
+	recIn = zcta.encode(dyads[recField])
+	provIn = zcta.encode(dyads[provField])
+	visits = dyads[visitsField].astype(numpy.int64)
+
+	rec, recMissing, recRemap, recUnresolved = remapColumn(recIn,index,zips,zctas)
+	prov, provMissing, provRemap, provUnresolved = remapColumn(provIn,index,zips,zctas)
+
+	#ZCTAs are reported as 5 digit text, each set is decoded once it has been made unique
+	def zctaSet(*columns):
+		return zcta.decode(zcta.index(numpy.concatenate(columns))).tolist()
+	report = {'missing':zctaSet(recIn[recMissing],provIn[provMissing]),
+		'recResolved':zctaSet(rec[recRemap]),
+		'recUnresolved':zctaSet(recIn[recUnresolved]),
+		'provResolved':zctaSet(prov[provRemap]),
+		'provUnresolved':zctaSet(provIn[provUnresolved]),
+		'visitsTotal':int(visits.sum()),
+		'visitsMissed':int(visits[recUnresolved].sum()),
+		'visitsLost':int(visits[recUnresolved | provUnresolved].sum())} #recipient or provider not in the crosswalk
+	return rec, prov, visits, recRemap | provRemap, report
+
+#reconcile a dyad table. dyads is a structured array holding every field that will be written back,
+#index is the sorted ZCTA index of the ZCTA layer and zips/zctas the sorted crosswalk arrays.
+#The total visits of each recipient touched are written to utilizersField, visitsField keeps the
+#visits of each dyad. Returns the reconciled table, sorted by recipient then provider, and a
+#dictionary describing what was changed
+def reconcileDyads(dyads, recField, provField, visitsField, index, zips, zctas,
+	maxField="MAX_VISITS", utilizersField="VISITS_TOTAL", dyadMaxField="Dyad_max"):
+	#---------------------------------------------------------------------------------------
+	#check for ZCTAs not in the ZCTA layer and remap them through the crosswalk
+	#---------------------------------------------------------------------------------------
+	rec, prov, visits, changed, report = remapDyads(dyads,recField,provField,visitsField,index,zips,zctas)
+
+	#---------------------------------------------------------------------------------------
+	#merge duplicate recipient/provider entries created by the remapping in one sort-merge pass
+	#---------------------------------------------------------------------------------------
+	order, pairStarts = pairRuns(rec,prov)
+	pairCounts = numpy.diff(numpy.append(pairStarts,len(order))) #number of rows merged into each kept row
+	visits = visits[order]
+	changed = changed[order]
+	if len(pairStarts):
+		visits = numpy.add.reduceat(visits,pairStarts)
+		changed = numpy.logical_or.reduceat(changed,pairStarts) | (pairCounts > 1) #duplicates already in the table change their recipient too
+	rec = rec[order[pairStarts]]
+	prov = prov[order[pairStarts]]
+	report['merged'] = len(order) - len(pairStarts)
+	report['mergedPairs'] = int((pairCounts > 1).sum())
+
+	#---------------------------------------------------------------------------------------
+	#update number of utilizers, max visits and dyad_max for recipients that were remapped or merged
+	#---------------------------------------------------------------------------------------
+	recStarts = groupStarts(rec)
+	recCounts = numpy.diff(numpy.append(recStarts,len(rec)))
+	if len(recStarts):
+		utilizers = numpy.repeat(numpy.add.reduceat(visits,recStarts),recCounts)
+		maxVisits = numpy.repeat(numpy.maximum.reduceat(visits,recStarts),recCounts)
+		recChanged = numpy.repeat(numpy.logical_or.reduceat(changed,recStarts),recCounts)
+	else:
+		utilizers = maxVisits = visits
+		recChanged = changed
+	isMax = visits == maxVisits
+
+	output = dyads[order[pairStarts]].copy()
+	for field, codes in ((recField,rec),(provField,prov)):
+		rewrite = codes != zcta.encode(output[field]) #remapped, written back in the field's own form
+		output[field][rewrite] = zcta.asField(codes[rewrite],output.dtype[field])
+	merged = pairCounts > 1
+	output[visitsField][merged] = visits[merged]
+	output[maxField][recChanged] = maxVisits[recChanged]
+	output[utilizersField][recChanged] = utilizers[recChanged]
+	output[dyadMaxField][recChanged] = isMax[recChanged]
+	return output, report
+
+###################################################################################################
+#reconciling a dyad store
+###################################################################################################
+
+#rows of a dyad store to reconcile together, a block of recipient groups at a time. Rows whose
+#recipient is remapped are found in a first pass and go with the block holding the recipient they
+#move to, so each block has every row that can merge into it. Yields the positions of each block's
+#rows, only the moved rows and one block's positions are held in memory
+def storeBlockRows(dyadStore, index, zips, zctas, rows=store.BlockRows):
+	recField = store.RecField
+	blocks = list(dyadStore.blocks(rows))
+
+	#-------------------------------------------------------------------------------------------
+	#find the rows whose recipient is remapped and the recipient they move to
+	#-------------------------------------------------------------------------------------------
+	moved, movedTo = [numpy.zeros(0,dtype=numpy.int64)], [numpy.zeros(0,dtype=numpy.int64)]
+	for start, stop in blocks:
+		rec = dyadStore[recField][start:stop]
+		remapped = remapColumn(rec,index,zips,zctas)[0]
+		changed = numpy.flatnonzero(remapped != rec)
+		moved.append(start + changed)
+		movedTo.append(remapped[changed])
+	moved, movedTo = numpy.concatenate(moved), numpy.concatenate(movedTo)
+
+	#each moved row goes to the block whose recipients cover the recipient it moves to
+	lows = numpy.array([dyadStore[recField][start] for start, stop in blocks],dtype=numpy.int64)
+	movedBlock = numpy.maximum(numpy.searchsorted(lows,movedTo,side='right') - 1,0)
+
+	for i, (start, stop) in enumerate(blocks):
+		staying = numpy.arange(start,stop)
+		staying = staying[notInIndex(staying,moved)]
+		yield numpy.concatenate((staying,moved[movedBlock == i]))
+
+#reconcile a dyad store into a new store at target (which can be the store itself) a block of
+#recipient groups at a time (see storeBlockRows), so each block is reconciled with every row that
+#can merge into it. Returns the same report as reconcileDyads with the number of rows written
+def reconcileStore(dyadStore, index, zips, zctas, target, rows=store.BlockRows, **fields):
+	recField, provField, visitsField = store.RecField, store.ProvField, "VISITS_DYAD"
+	report = {'missing':set(),'recResolved':set(),'recUnresolved':set(),'provResolved':set(),
+		'provUnresolved':set(),'visitsTotal':0,'visitsMissed':0,'visitsLost':0,'merged':0,'mergedPairs':0}
+
+	def reconciledBlocks():
+		for positions in storeBlockRows(dyadStore,index,zips,zctas,rows):
+			reconciled, blockReport = reconcileDyads(dyadStore.table(positions),recField,provField,visitsField,
+				index,zips,zctas,**fields)
+			for key, value in blockReport.items():
+				if isinstance(value,list):
+					report[key].update(value)
+				else:
+					report[key] += value
+			yield reconciled
+		dyadStore.close() #the source is released before the new store replaces it
+
+	report['written'] = store.writeStore(target,reconciledBlocks(),presorted=True)
+	for key, value in report.items():
+		if isinstance(value,set):
+			report[key] = sorted(value)
+	return report
+
+###################################################################################################
+#estimating the impact of reconciling
+###################################################################################################
+
+#what reconciling a set of dyad rows would change, from their recipient, provider and visit columns.
+#The rows must include every row that can merge with them (a whole table or a block of
+#storeBlockRows). Returns the counts and the codes and visits of the rows whose recipient, and whose
+#provider, is missing from the ZCTA layer
+def _impactCounts(rec, prov, visits, index, zips, zctas):
+	rec, prov = zcta.encode(rec), zcta.encode(prov)
+	visits = numpy.asarray(visits,dtype=numpy.float64)
+	remappedRec, recMissing, recRemap, recLost = remapColumn(rec,index,zips,zctas)
+	remappedProv, provMissing, provRemap, provLost = remapColumn(prov,index,zips,zctas)
+
+	#pairs that end up with more than one row are merged, one sort of the remapped pair keys
+	keys = numpy.sort(zcta.pairKeys(remappedRec,remappedProv))
+	pairCounts = numpy.diff(numpy.append(groupStarts(keys),len(keys)))
+	counts = {'rows':len(rec),'rowsRemapped':int((recRemap | provRemap).sum()),'recRemapped':int(recRemap.sum()),
+		'provRemapped':int(provRemap.sum()),'merged':len(keys) - len(pairCounts),'mergedPairs':int((pairCounts > 1).sum()),
+		'visitsTotal':float(visits.sum()),'visitsMissed':float(visits[recLost].sum()),
+		'provVisitsLost':float(visits[provLost].sum()),'visitsLost':float(visits[recLost | provLost].sum())}
+	return counts, (rec[recMissing],visits[recMissing]), (prov[provMissing],visits[provMissing])
+
+#rows and visits of each code in sortedCodes from (codes, visits) parts
+def _sumByCode(parts, sortedCodes):
+	codes = numpy.concatenate([p[0] for p in parts]) if parts else numpy.zeros(0,dtype=zcta.Code)
+	visits = numpy.concatenate([p[1] for p in parts]) if parts else numpy.zeros(0)
+	position = numpy.searchsorted(sortedCodes,codes)
+	return (numpy.bincount(position,minlength=len(sortedCodes)).astype(numpy.int64),
+		numpy.bincount(position,weights=visits,minlength=len(sortedCodes)))
+
+#table of every ZCTA missing from the ZCTA layer: the ZCTA, the ZCTA the crosswalk remaps it to
+#(blank when it has no entry and its visits are lost) and its rows and visits as a recipient and as
+#a provider
+def impactTable(recParts, provParts, zips, zctas):
+	codes = numpy.unique(numpy.concatenate([p[0] for p in recParts + provParts] + [numpy.zeros(0,dtype=zcta.Code)]))
+	recRows, recVisits = _sumByCode(recParts,codes)
+	provRows, provVisits = _sumByCode(provParts,codes)
+	position, found = crosswalkLookup(codes,zips)
+	remappedTo = numpy.empty(len(codes),dtype=zcta.Code)
+	remappedTo.fill(zcta.Invalid)
+	remappedTo[found] = zctas[position[found]]
+	return tables.fromColumns(['ZCTA','REMAPPED_TO','REC_ROWS','REC_VISITS','PROV_ROWS','PROV_VISITS'],
+		[zcta.decode(codes),zcta.decode(remappedTo),recRows,recVisits,provRows,provVisits])
+
+#estimate what reconciling a dyad table against a crosswalk would change, without changing the table.
+#Only the recipient, provider and visit columns are needed. Returns the rows remapped (recipient,
+#provider and either), the duplicate rows that would be merged and the pairs they merge into, the
+#total visits, the visits lost because the recipient (visitsMissed, what the reconciler reports),
+#the provider (provVisitsLost) or either (visitsLost) has no crosswalk entry, and the impact on every
+#missing ZCTA under 'zctas' (see impactTable)
+def estimateImpact(rec, prov, visits, index, zips, zctas):
+	report, recPart, provPart = _impactCounts(rec,prov,visits,index,zips,zctas)
+	report['zctas'] = impactTable([recPart],[provPart],zips,zctas)
+	return report
+
+#estimate the impact of reconciling a dyad store a block of recipient groups at a time, reading only
+#the mapped recipient, provider and visit columns. Returns the same report as estimateImpact
+def estimateStoreImpact(dyadStore, index, zips, zctas, visitsField="VISITS_DYAD", rows=store.BlockRows):
+	report = {'rows':0,'rowsRemapped':0,'recRemapped':0,'provRemapped':0,'merged':0,'mergedPairs':0,
+		'visitsTotal':0.0,'visitsMissed':0.0,'provVisitsLost':0.0,'visitsLost':0.0}
+	recParts, provParts = [], []
+	for positions in storeBlockRows(dyadStore,index,zips,zctas,rows):
+		counts, recPart, provPart = _impactCounts(dyadStore[store.RecField][positions],dyadStore[store.ProvField][positions],
+			dyadStore[visitsField][positions],index,zips,zctas)
+		for key, value in counts.items():
+			report[key] += value
+		recParts.append(recPart)
+		provParts.append(provPart)
+	report['zctas'] = impactTable(recParts,provParts,zips,zctas)
+	return report
+
+###################################################################################################
+#incremental reconciling
+###################################################################################################
+
+#sha1 of a set of arrays, used to tell when the crosswalk has changed between runs
+def arrayDigest(*arrays):
+	return hashlib.sha1(repr([numpy.asarray(a).tolist() for a in arrays]).encode('utf-8')).hexdigest()
+
+#digest of every recipient group of a dyad table. Each digest covers the group's rows, sorted by
+#provider, and the ZCTAs each row's recipient and provider remap to, so it changes when the rows or
+#the crosswalk entries they depend on change. Returns {recipient: digest}
+def groupDigests(dyads, recField, provField, index, zips, zctas):
+	rec = zcta.encode(dyads[recField])
+	prov = zcta.encode(dyads[provField])
+	order = zcta.pairOrder(rec,prov)
+	rows = dyads[order].tolist()
+	targets = list(zip(remapColumn(rec,index,zips,zctas)[0][order].tolist(),remapColumn(prov,index,zips,zctas)[0][order].tolist()))
+	starts = groupStarts(rec[order]).tolist()
+	digests = {}
+	for start, stop in zip(starts,starts[1:] + [len(order)]):
+		text = repr((rows[start:stop],targets[start:stop]))
+		digests[str(rec[order[start]])] = hashlib.sha1(text.encode('utf-8')).hexdigest()
+	return digests
+
+#reconcile only the recipient groups whose digest differs from the previous run's. Rows of unchanged
+#groups that remap into the same recipient as a changed group are reconciled with it so merged
+#visits and Dyad_max stay complete. Returns the reconciled rows, the recipients whose rows they
+#replace, a report covering the whole table (with the changelog of the replaced rows under
+#'changes') and the digests of the table once the rows are replaced
+def reconcileIncremental(dyads, recField, provField, visitsField, index, zips, zctas, previous, **fields):
+	digests = groupDigests(dyads,recField,provField,index,zips,zctas)
+	changed = numpy.array([int(r) for r, digest in digests.items() if previous.get(r) != digest],dtype=numpy.int64)
+
+	#the remapping is cheap, so the report still covers the whole table
+	rec = zcta.encode(dyads[recField])
+	remappedRec, remappedProv, visits, remapped, report = remapDyads(dyads,recField,provField,visitsField,index,zips,zctas)
+	affected = numpy.unique(remappedRec[~notInIndex(rec,numpy.unique(changed))]) #recipients the changed groups end up in
+	rows = ~notInIndex(remappedRec,affected)
+	replaced = numpy.unique(rec[rows])
+
+	reconciled, subsetReport = reconcileDyads(dyads[rows],recField,provField,visitsField,index,zips,zctas,**fields)
+	replacedKeys = set(str(r) for r in replaced.tolist())
+	newDigests = dict((r,digest) for r, digest in digests.items() if r not in replacedKeys)
+	newDigests.update(groupDigests(reconciled,recField,provField,index,zips,zctas))
+
+	report['merged'] = subsetReport['merged']
+	report['mergedPairs'] = subsetReport['mergedPairs']
+	report['groupsChanged'] = len(changed)
+	report['groupsRemoved'] = len(set(previous) - set(digests))
+	report['rowsReconciled'] = int(rows.sum())
+	report['changes'] = dyadChanges(dyads[rows],reconciled,recField,provField)
+	return reconciled, replaced, report, newDigests
+
+#changelog between the rows of the replaced recipients before and after reconciling, as
+#(rec, prov, change, field, old value, new value) rows with values as text. Rows are matched on
+#their recipient and provider; rows that no longer exist, because they were remapped or merged,
+#are 'removed', new pairs 'added' and fields that changed on a pair 'updated'
+def dyadChanges(before, after, recField, provField):
+	fields = [f for f in after.dtype.names if f not in (recField,provField)]
+	oldRows = {}
+	changes = []
+	for row in before[[recField,provField] + fields].tolist():
+		key = (str(row[0]),str(row[1]))
+		if key in oldRows:
+			changes.append((key[0],key[1],'removed','','',''))
+		else:
+			oldRows[key] = row[2:]
+	for row in after[[recField,provField] + fields].tolist():
+		key = (str(row[0]),str(row[1]))
+		if key not in oldRows:
+			changes.append((key[0],key[1],'added','','',''))
+			continue
+		old = oldRows.pop(key)
+		for field, oldValue, newValue in zip(fields,old,row[2:]):
+			if oldValue != newValue:
+				changes.append((key[0],key[1],'updated',field,str(oldValue),str(newValue)))
+	for key in sorted(oldRows):
+		changes.append((key[0],key[1],'removed','','',''))
+	return changes
+
+#state kept between incremental runs: the group digests, the crosswalk digest and the fingerprint
+#of the ZCTA layer after its base ZCTAs were last updated
+def loadState(path):
+	if path and os.path.exists(path):
+		with open(path) as f:
+			return json.load(f)
+	return {'groups':{},'crosswalk':None,'zctas':None}
+
+def saveState(path, state):
+	with open(path,'w') as f:
+		json.dump(state,f,sort_keys=True)
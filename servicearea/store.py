@@ -0,0 +1,212 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : store.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: On disk columnar dyad store for dyad tables larger than memory. A store is a folder
+# (named <name>.dyads) holding one fixed width .npy file per dyad column, sorted by recipient then
+# provider, and an index of the rows where each recipient starts. Columns are memory mapped, so the
+# checker, reconciler and tie detection read them a block of recipient groups at a time as slices of
+# the mapped files instead of loading the whole table.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import json
+import time
+import shutil
+import numpy
+from servicearea import tables, zcta
+
+###################################################################################################
+#Global variables
+###################################################################################################
+Extension = '.dyads' #folder extension a store is recognised by
+#columns of a store and their fixed width types, recipients and providers are ZCTA codes
+Columns = [('REC_ZIP',zcta.Code),('PROV_ZIP',zcta.Code),('VISITS_DYAD',numpy.int32),
+	('MAX_VISITS',numpy.int32),('VISITS_TOTAL',numpy.int32),('Dyad_max',numpy.int16)]
+RecField, ProvField = Columns[0][0], Columns[1][0]
+BlockRows = 1000000 #rows read at a time, rounded up to whole recipient groups
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+def isStore(path):
+	return str(path).rstrip('/\\').lower().endswith(Extension)
+
+def _columnPath(path, name):
+	return os.path.join(path,name + '.npy')
+
+#store columns from a chunk of a dyad table. Recipient and provider fields are found by name, the
+#other columns are taken from fields of the same name and left as zeros when the chunk has none
+def _chunkColumns(chunk):
+	names = list(chunk.dtype.names)
+	sourceFields = {RecField:tables.findField(names,'rec'),ProvField:tables.findField(names,'prov')}
+	columns = {}
+	for name, dtype in Columns:
+		field = sourceFields.get(name,name if name in names else None)
+		if field is None:
+			columns[name] = numpy.zeros(len(chunk),dtype=dtype)
+		elif name in sourceFields:
+			columns[name] = zcta.encode(chunk[field])
+		else:
+			columns[name] = numpy.asarray(chunk[field]).astype(dtype)
+	return columns
+
+#replace a folder with a newly built one
+def _replaceFolder(built, path):
+	if os.path.exists(path):
+		old = path + '.old'
+		if os.path.exists(old):
+			shutil.rmtree(old)
+		os.rename(path,old)
+		os.rename(built,path)
+		shutil.rmtree(old)
+	else:
+		os.rename(built,path)
+
+#write a store from an iterable of dyad table chunks (structured arrays), replacing the store if it
+#exists. Chunks are appended to raw column files first, so only one chunk is held in memory, then
+#sorted by recipient and provider a block at a time. Chunks that are already in order
+#(presorted) are copied across without sorting. Returns the number of rows written
+def writeStore(path, chunks, presorted=False):
+	path = str(path).rstrip('/\\')
+	building = path + '.building'
+	if os.path.exists(building):
+		shutil.rmtree(building)
+	os.makedirs(building)
+
+	#-------------------------------------------------------------------------------------------
+	#append every chunk to unsorted raw column files
+	#-------------------------------------------------------------------------------------------
+	rows = 0
+	rawFiles = dict((name,open(os.path.join(building,name + '.raw'),'wb')) for name, dtype in Columns)
+	try:
+		for chunk in chunks:
+			for name, column in _chunkColumns(chunk).items():
+				column.tofile(rawFiles[name])
+			rows += len(chunk)
+	finally:
+		for rawFile in rawFiles.values():
+			rawFile.close()
+
+	def rawColumn(name, dtype):
+		if rows == 0:
+			return numpy.zeros(0,dtype=dtype)
+		return numpy.memmap(os.path.join(building,name + '.raw'),dtype=dtype,mode='r',shape=(rows,))
+
+	#-------------------------------------------------------------------------------------------
+	#sort by recipient then provider. Only the two key columns and the sort order are held in
+	#memory, the other columns are copied into place a block at a time
+	#-------------------------------------------------------------------------------------------
+	order = None
+	if not presorted and rows:
+		order = zcta.pairOrder(numpy.array(rawColumn(RecField,zcta.Code)),numpy.array(rawColumn(ProvField,zcta.Code)))
+	for name, dtype in Columns:
+		raw = rawColumn(name,dtype)
+		column = numpy.lib.format.open_memmap(_columnPath(building,name),mode='w+',dtype=dtype,shape=(rows,))
+		for start in range(0,rows,BlockRows):
+			stop = min(start + BlockRows,rows)
+			column[start:stop] = raw[start:stop] if order is None else raw[order[start:stop]]
+		column.flush()
+		del column, raw
+		os.remove(os.path.join(building,name + '.raw'))
+	del order
+
+	#-------------------------------------------------------------------------------------------
+	#index of the rows each recipient starts at
+	#-------------------------------------------------------------------------------------------
+	recs = numpy.load(_columnPath(building,RecField),mmap_mode='r') if rows else numpy.zeros(0,dtype=zcta.Code)
+	starts = numpy.zeros(0,dtype=numpy.int64)
+	if rows:
+		starts = numpy.concatenate(([0],numpy.flatnonzero(recs[1:] != recs[:-1]) + 1)).astype(numpy.int64)
+	numpy.save(os.path.join(building,'recs.npy'),numpy.array(recs[starts]))
+	numpy.save(os.path.join(building,'offsets.npy'),numpy.append(starts,rows).astype(numpy.int64))
+	del recs
+
+	meta = {'rows':rows,'groups':len(starts),'columns':[[name,numpy.dtype(dtype).str] for name, dtype in Columns],
+		'created':time.strftime('%Y-%m-%d %H:%M:%S')}
+	with open(os.path.join(building,'store.json'),'w') as f:
+		json.dump(meta,f,indent=1)
+	_replaceFolder(building,path)
+	return rows
+
+###################################################################################################
+#Dyad store class
+###################################################################################################
+
+#an open store. store[column] is the memory mapped column, recs holds each recipient's ZCTA code
+#and offsets the row each recipient starts at, with the row count at the end
+class DyadStore(object):
+	def __init__(self, path):
+		self.path = str(path).rstrip('/\\')
+		with open(os.path.join(self.path,'store.json')) as f:
+			self.meta = json.load(f)
+		self.recs = numpy.load(os.path.join(self.path,'recs.npy'))
+		self.offsets = numpy.load(os.path.join(self.path,'offsets.npy'))
+		mode = 'r' if self.meta['rows'] else None #empty files can't be mapped
+		self.columns = dict((name,numpy.load(_columnPath(self.path,name),mmap_mode=mode)) for name, dtype in Columns)
+
+	def __len__(self):
+		return self.meta['rows']
+
+	def __getitem__(self, name):
+		return self.columns[name]
+
+	@property
+	def names(self):
+		return [name for name, dtype in Columns]
+
+	#release the mapped files so the store can be replaced
+	def close(self):
+		self.columns = {}
+
+	#(start, stop) rows of a recipient, an empty range when it isn't in the store
+	def group(self, rec):
+		i = zcta.positions(zcta.encode([rec]),self.recs)[0]
+		if i < 0:
+			return 0, 0
+		return int(self.offsets[i]), int(self.offsets[i + 1])
+
+	#(start, stop) row ranges of about rows rows that never split a recipient's group
+	def blocks(self, rows=BlockRows):
+		start = 0
+		while start < len(self):
+			stop = self.offsets[min(numpy.searchsorted(self.offsets,start + rows),len(self.offsets) - 1)]
+			yield start, int(stop)
+			start = int(stop)
+
+	#rows of the store as a structured array, a copy of the mapped columns. rows is a (start, stop)
+	#range or an array of row positions
+	def table(self, rows=None, fields=None):
+		fields = fields or self.names
+		if rows is None:
+			rows = (0,len(self))
+		if isinstance(rows,tuple):
+			return tables.fromColumns(fields,[numpy.array(self.columns[f][rows[0]:rows[1]]) for f in fields])
+		return tables.fromColumns(fields,[self.columns[f][rows] for f in fields])
+
+	#chunks of the store as structured arrays, a block at a time
+	def chunks(self, rows=BlockRows, fields=None):
+		for start, stop in self.blocks(rows):
+			yield self.table((start,stop),fields)
+
+#recipient groups with more than one provider at the group's maximum visits, the ties the Tie
+#Resolver settles. Returns the tied rows as a table of recipient, provider and visits
+def findTies(store, rows=BlockRows):
+	found = []
+	for start, stop in store.blocks(rows):
+		visits = store['VISITS_DYAD'][start:stop]
+		first = store.offsets[numpy.searchsorted(store.offsets,start):numpy.searchsorted(store.offsets,stop)] - start
+		counts = numpy.diff(numpy.append(first,stop - start))
+		isMax = visits == numpy.repeat(numpy.maximum.reduceat(visits,first),counts)
+		tied = isMax & numpy.repeat(numpy.add.reduceat(isMax.astype(numpy.int64),first) > 1,counts)
+		found.append(start + numpy.flatnonzero(tied))
+	positions = numpy.concatenate(found) if found else numpy.zeros(0,dtype=numpy.int64)
+	return store.table(positions,[RecField,ProvField,'VISITS_DYAD'])
@@ -0,0 +1,55 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : tables.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Helpers for the in memory tables passed between the core functions. A table is a
+# numpy structured array with one named field per column.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import numpy
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#find the first field name containing any of the given patterns, the way the scripts have always
+#found their rec, prov, ZCTA and zip fields. caseSensitive matches the patterns as given
+def findField(fieldNames, patterns, caseSensitive=False):
+	if isinstance(patterns,str):
+		patterns = [patterns]
+	for name in fieldNames:
+		for pattern in patterns:
+			if (pattern in name) if caseSensitive else (pattern.lower() in name.lower()):
+				return name
+	raise KeyError("No field matching {0} in {1}".format(patterns,list(fieldNames)))
+
+#build a table from a list of field names and a list of column arrays of equal length
+def fromColumns(names, columns):
+	columns = [numpy.asarray(c) for c in columns]
+	length = len(columns[0]) if columns else 0
+	table = numpy.zeros(length,dtype=[(str(n),c.dtype) for n, c in zip(names,columns)])
+	for name, column in zip(names,columns):
+		table[str(name)] = column
+	return table
+
+#build a table from rows of values, the type of each column is taken from the values
+def fromRows(names, rows):
+	rows = list(rows)
+	if not rows:
+		return numpy.zeros(0,dtype=[(str(n),numpy.int64) for n in names])
+	return fromColumns(names,[numpy.array([row[i] for row in rows]) for i in range(len(names))])
+
+#keep only the named fields of a table, in the given order
+def selectFields(table, names):
+	return fromColumns(names,[table[name] for name in names])
+
+#a table's rows as tuples, for writing through cursors and csv writers
+def tableRows(table):
+	return table.tolist()
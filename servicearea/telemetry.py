@@ -0,0 +1,132 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : telemetry.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Progress reporting and run reports shared by the tools. Progress updates are
+# throttled by time so loops can report as often as they like without the progress dialog slowing
+# them down. A run report records the wall time, rows, rows per second, cursors opened and peak
+# memory of each stage of a tool and is written as JSON when the tool finishes.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import sys
+import json
+import time
+import platform
+from contextlib import contextmanager
+
+###################################################################################################
+#Global variables
+###################################################################################################
+Counters = {'cursors':0} #running counts kept by the backends, read by the run report
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#called by the backends every time a cursor (or a table to numpy array read) is opened
+def cursorOpened():
+	Counters['cursors'] += 1
+
+#peak memory of this process in bytes, None where it can't be found
+def peakMemory():
+	try:
+		import resource
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peak if sys.platform == 'darwin' else peak*1024 #kilobytes on linux, bytes on mac
+	except ImportError:
+		pass
+	try:
+		import ctypes
+		from ctypes import wintypes
+		class ProcessMemoryCounters(ctypes.Structure):
+			_fields_ = [('cb',wintypes.DWORD),('PageFaultCount',wintypes.DWORD),
+				('PeakWorkingSetSize',ctypes.c_size_t),('WorkingSetSize',ctypes.c_size_t),
+				('QuotaPeakPagedPoolUsage',ctypes.c_size_t),('QuotaPagedPoolUsage',ctypes.c_size_t),
+				('QuotaPeakNonPagedPoolUsage',ctypes.c_size_t),('QuotaNonPagedPoolUsage',ctypes.c_size_t),
+				('PagefileUsage',ctypes.c_size_t),('PeakPagefileUsage',ctypes.c_size_t)]
+		counters = ProcessMemoryCounters()
+		counters.cb = ctypes.sizeof(counters)
+		process = ctypes.windll.kernel32.GetCurrentProcess()
+		if ctypes.windll.psapi.GetProcessMemoryInfo(process,ctypes.byref(counters),counters.cb):
+			return int(counters.PeakWorkingSetSize)
+	except (ImportError,AttributeError,OSError):
+		pass
+	return None
+
+#where a tool's run report goes: next to its output, outside of any geodatabase
+def reportPath(tool, folder):
+	folder = os.path.realpath(str(folder))
+	while folder.lower().endswith('.gdb') or os.path.isfile(folder):
+		folder = os.path.dirname(folder)
+	return os.path.join(folder,"{0}_run.json".format(tool))
+
+###################################################################################################
+#Progress and run report classes
+###################################################################################################
+
+#calls report with the latest count at most once every interval seconds, so hot loops can call
+#update for every row without flooding the progress dialog. The last count is always reported by done
+class Progress(object):
+	def __init__(self, report, interval=0.5, clock=time.time):
+		self.report = report
+		self.interval = interval
+		self.clock = clock
+		self.last = None
+		self.count = 0
+		self.reported = 0 #number of times report was actually called
+
+	def update(self, count):
+		self.count = count
+		now = self.clock()
+		if self.last is None or now - self.last >= self.interval:
+			self.last = now
+			self.reported += 1
+			self.report(count)
+
+	def done(self):
+		self.reported += 1
+		self.report(self.count)
+
+#per stage timings of one run of a tool. Use stage in a with statement, setting 'rows' on the
+#record it gives back:
+#	with Telemetry.stage('reconcile') as stage:
+#		stage['rows'] = len(Dyads)
+class RunReport(object):
+	def __init__(self, tool, clock=time.time):
+		self.tool = tool
+		self.clock = clock
+		self.started = clock()
+		self.startDate = time.strftime('%Y-%m-%d %H:%M:%S')
+		self.stages = []
+
+	@contextmanager
+	def stage(self, name, rows=0):
+		record = {'name':name,'rows':rows}
+		start = self.clock()
+		cursors = Counters['cursors']
+		try:
+			yield record
+		finally:
+			record['seconds'] = round(self.clock() - start,6)
+			record['rowsPerSecond'] = round(record['rows']/record['seconds'],1) if record['seconds'] > 0 else None
+			record['cursors'] = Counters['cursors'] - cursors
+			record['peakMemory'] = peakMemory()
+			self.stages.append(record)
+
+	def summary(self):
+		return {'tool':self.tool,'started':self.startDate,'seconds':round(self.clock() - self.started,6),
+			'rows':sum(s['rows'] for s in self.stages),'cursors':sum(s['cursors'] for s in self.stages),
+			'peakMemory':peakMemory(),'python':platform.python_version(),'stages':self.stages}
+
+	def write(self, path):
+		with open(path,'w') as f:
+			json.dump(self.summary(),f,indent=2)
+		return path
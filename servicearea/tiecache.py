@@ -0,0 +1,102 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : tiecache.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:39:50
+# Version		: $1.0$
+# Description	: Cache of tie resolutions kept between runs of the Tie Resolver. Most tied recipients
+# and their candidate providers are the same from one month's dyads to the next, so the provider
+# chosen for each tie is saved under the recipient, a digest of its sorted candidates and the tie
+# break policy.
+# The cache belongs to one version of the ZCTA geometry (and neighbor table), and is emptied when
+# their fingerprint changes. The least recently used entries are dropped once the cache is full.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import json
+from collections import OrderedDict
+
+###################################################################################################
+#Global variables
+###################################################################################################
+MaxEntries = 200000 #ties kept before the least recently used are dropped
+Version = 2 #format of the cache file, caches of another version are started again
+
+###################################################################################################
+#Tie cache class
+###################################################################################################
+
+#resolutions of ties, loaded from path when it exists. source is the fingerprint of the geometry the
+#ties were resolved against, and policy the tie break policy (None for the tool's rule). Entries are
+#held least recently used first, a hit moves an entry to the end
+class TieCache(object):
+	def __init__(self, path, source, policy=None, maxEntries=MaxEntries):
+		self.path = str(path)
+		self.source = source
+		self.policy = json.dumps(policy,sort_keys=True) if policy else ''
+		self.maxEntries = maxEntries
+		self.entries = OrderedDict()
+		self.hits = self.misses = self.stored = self.evicted = 0
+		self.invalidated = False #entries were dropped because the geometry changed
+		if os.path.exists(self.path):
+			with open(self.path) as f:
+				meta = json.load(f)
+			if meta.get('version') == Version and meta.get('source') == source:
+				self.entries.update((key,(prov,how)) for key, prov, how in meta['entries'])
+			else:
+				self.invalidated = True
+
+	def __len__(self):
+		return len(self.entries)
+
+	#key of a tie, its recipient, the policy and the digest of its sorted candidates (ties.tieDigests)
+	def key(self, rec, digest):
+		return u'|'.join((rec,self.policy,digest))
+
+	#the cached resolution of every tie found, {rec ZCTA: (provider ZCTA, 'adjacent', 'nearest' or ''
+	#when it couldn't be resolved)}, from ties given as {rec ZCTA: digest} by ties.tieDigests
+	def lookup(self, ties):
+		found = {}
+		for rec, digest in ties.items():
+			key = self.key(rec,digest)
+			if key in self.entries:
+				found[rec] = self.entries[key] = self.entries.pop(key) #most recently used
+				self.hits += 1
+			else:
+				self.misses += 1
+		return found
+
+	#add the resolutions of ties, {rec ZCTA: (provider ZCTA, how)}, dropping the least recently used
+	#entries past maxEntries
+	def store(self, ties, resolved):
+		for rec, resolution in resolved.items():
+			if rec in ties:
+				key = self.key(rec,ties[rec])
+				self.entries.pop(key,None)
+				self.entries[key] = tuple(resolution)
+				self.stored += 1
+		while len(self.entries) > self.maxEntries:
+			self.entries.popitem(last=False)
+			self.evicted += 1
+
+	#write the cache under a temporary name first so an interrupted run can't leave half a cache
+	def save(self):
+		temp = self.path + '.tmp'
+		with open(temp,'w') as f:
+			#dumps uses the C encoder, dump encodes in python a piece at a time
+			f.write(json.dumps({'version':Version,'source':self.source,
+				'entries':[[key,prov,how] for key, (prov, how) in self.entries.items()]}))
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(temp,self.path)
+		return self.path
+
+	#hit and miss counts for the run report
+	def counts(self):
+		return {'hits':self.hits,'misses':self.misses,'stored':self.stored,'evicted':self.evicted,
+			'entries':len(self.entries),'invalidated':self.invalidated}
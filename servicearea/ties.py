@@ -0,0 +1,488 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : ties.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:39:50
+# Version		: $1.0$
+# Description	: Resolves recipient ZCTAs that are tied between several provider ZCTAs. A matching
+# provider is chosen first, then the adjacent provider sharing the longest border, then the
+# nearest provider by centroid distance. Every candidate is scored and ranked in one pass, so a
+# composite policy weighing border, distance and visit share can be used instead of the rule and
+# compared against it. Tie CSVs are streamed one recipient group at a time.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import csv
+import math
+import heapq
+import hashlib
+import shutil
+import tempfile
+from itertools import compress, islice
+from operator import itemgetter
+from collections import defaultdict, deque
+import numpy
+from servicearea import dyads, store, tables, zcta
+from servicearea.checker import notInIndex
+from servicearea.csvutil import openCsv, sniffDialect, readHeader, readChunks, rowColumns
+from servicearea.reconcile import groupStarts
+
+###################################################################################################
+#Global variables
+###################################################################################################
+PolicyWeights = ('border','distance','visits') #weights a composite tie break policy can set
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#great circle distance in miles between paired points. Takes arrays of longitude (X) and latitude (Y)
+#in decimal degrees so every pair is calculated in one pass, using the haversine formula
+def distanceXY(long1, lat1, long2, lat2):
+	long1, lat1, long2, lat2 = [numpy.radians(numpy.asarray(a,dtype=numpy.float64)) for a in (long1,lat1,long2,lat2)]
+	a = numpy.sin((lat2 - lat1)/2.0)**2 + numpy.cos(lat1)*numpy.cos(lat2)*numpy.sin((long2 - long1)/2.0)**2
+	arc = 2.0*numpy.arcsin(numpy.sqrt(numpy.clip(a,0.0,1.0)))
+
+	#multiple by 3960 to get miles
+	return arc*3960
+
+#build a dictionary of shared border lengths for every pair of adjacent ZCTAs from their polygons,
+#given as {ZCTA: [ring, ...]} with each ring a list of (x, y) points. Census ZCTAs are built from
+#the same topology so neighbors share the vertices of their common border. Every edge is snapped to
+#a grid of the given tolerance and hashed, edges found in more than one ZCTA are shared border.
+#returns {ZCTA: {neighbor ZCTA: shared border length}}
+def sharedBorders(polygons, tolerance=1e-6):
+	edges = defaultdict(set) #snapped edge -> ZCTAs that have it
+	lengths = {}
+	for zcta, rings in polygons.items():
+		for ring in rings:
+			if len(ring) < 2:
+				continue
+			points = list(ring)
+			if points[0] != points[-1]:
+				points.append(points[0]) #close the ring
+			snapped = [(int(round(x/tolerance)),int(round(y/tolerance))) for x, y in points]
+			for i in range(len(points) - 1):
+				a, b = snapped[i], snapped[i+1]
+				if a == b:
+					continue
+				edge = (a,b) if a < b else (b,a)
+				edges[edge].add(zcta)
+				if edge not in lengths:
+					lengths[edge] = math.hypot(points[i+1][0] - points[i][0],points[i+1][1] - points[i][1])
+
+	borders = defaultdict(dict)
+	for edge, zctas in edges.items():
+		if len(zctas) < 2:
+			continue
+		zctas = sorted(zctas)
+		for i, a in enumerate(zctas):
+			for b in zctas[i+1:]:
+				borders[a][b] = borders[a].get(b,0.0) + lengths[edge]
+				borders[b][a] = borders[a][b]
+	return borders
+
+#area weighted centroid of a polygon's rings. Holes wind the opposite way to outer rings so their
+#signed area is subtracted. Falls back to the mean of the points for polygons without area
+def polygonCentroid(rings):
+	area = cx = cy = 0.0
+	count = sx = sy = 0.0
+	for ring in rings:
+		for i in range(len(ring) - 1):
+			(x0, y0), (x1, y1) = ring[i], ring[i+1]
+			cross = x0*y1 - x1*y0
+			area += cross
+			cx += (x0 + x1)*cross
+			cy += (y0 + y1)*cross
+		for x, y in ring:
+			sx += x
+			sy += y
+			count += 1
+	if area != 0:
+		return cx/(3.0*area), cy/(3.0*area)
+	if count:
+		return sx/count, sy/count
+	return None
+
+#sorted ZCTA codes and a contiguous array of their centroid coordinates (X, Y) from {ZCTA: (x, y)}
+def centroidArrays(centroids):
+	keys = [k for k, v in centroids.items() if v is not None]
+	coords = numpy.array([centroids[k] for k in keys],dtype=numpy.float64).reshape(-1,2)
+	return sortedCentroids(zcta.encode([str(k) for k in keys]),coords)
+
+#centroid coordinates sorted by ZCTA code, dropping ZCTAs that don't encode
+def sortedCentroids(codes, coords):
+	valid = codes != zcta.Invalid
+	codes, coords = codes[valid], coords[valid]
+	order = numpy.argsort(codes,kind='mergesort')
+	return codes[order], coords[order]
+
+#find the position of each ZCTA in the sorted centroid ZCTA codes, -1 where a ZCTA has no centroid
+def centroidIndex(values, zctas):
+	return zcta.positions(zcta.encode(values),zctas)
+
+###################################################################################################
+#ranking tie candidates
+###################################################################################################
+
+#shared border lengths as a sorted array of (ZCTA, neighbor) pair keys and the length of each, so the
+#borders of every candidate can be looked up at once
+def borderArrays(borderDict):
+	pairs = [(src,nbr,length) for src, neighbors in borderDict.items() for nbr, length in neighbors.items()]
+	srcs, nbrs = zcta.encode([str(p[0]) for p in pairs]), zcta.encode([str(p[1]) for p in pairs])
+	valid = (srcs != zcta.Invalid) & (nbrs != zcta.Invalid)
+	keys = zcta.pairKeys(srcs[valid],nbrs[valid])
+	lengths = numpy.array([p[2] for p in pairs],dtype=numpy.float64).reshape(-1)[valid]
+	order = numpy.argsort(keys,kind='mergesort')
+	return keys[order], lengths[order]
+
+#shared border length of each recipient/provider pair, 0 where they aren't adjacent
+def borderLengths(recs, provs, borders):
+	if isinstance(borders,dict):
+		borders = borderArrays(borders)
+	keys, lengths = borders
+	position = zcta.positions(zcta.pairKeys(zcta.encode(recs),zcta.encode(provs)),keys)
+	return numpy.append(lengths,0.0)[position] #position -1 picks the 0 on the end
+
+#read a tie break policy from text such as "border:2, distance:1, visits:0.5". Empty text is the
+#tool's rule: a matching provider, then the longest shared border, then the nearest provider
+def parsePolicy(text):
+	if not text or not text.strip():
+		return None
+	policy = dict((name,0.0) for name in PolicyWeights)
+	for part in text.replace(';',',').split(','):
+		if part.strip():
+			name, weight = part.split(':') if ':' in part else part.split('=')
+			name = name.strip().lower()
+			if name not in policy:
+				raise ValueError("Unknown tie break weight {0}, use {1}".format(name,", ".join(PolicyWeights)))
+			policy[name] = float(weight)
+	return policy
+
+#score and rank every candidate provider of every tied recipient in one pass. recs and provs are the
+#recipient and candidate of each tied row, visits the row's visits (only needed when the policy
+#weighs visits). With no policy candidates are ranked by the tool's rule. A composite policy scores
+#each candidate as the weighted sum of its share of the longest border among the recipient's
+#candidates, the nearest candidate's distance over its own and its share of the recipient's
+#visits. A matching provider is always ranked first and ties in score go to the nearest, then the
+#lowest, provider. Returns a table of the top k candidates of each recipient (all when k is None)
+#sorted by recipient and rank. ELIGIBLE is 0 for candidates that can't be chosen because they
+#aren't matching or adjacent and a centroid is missing
+def rankCandidates(recs, provs, borders, centroidZCTAs, centroidCoords, visits=None, policy=None, k=None):
+	recs = numpy.asarray(recs,dtype=str)
+	provs = numpy.asarray(provs,dtype=str)
+	names = ['REC','PROV','RANK','SCORE','BORDER','DISTANCE','VISIT_SHARE','ELIGIBLE']
+	if len(recs) == 0:
+		return tables.fromColumns(names,[recs,provs] + [numpy.zeros(0)]*6)
+	uniqueRecs, group = numpy.unique(recs,return_inverse=True)
+	group = group.ravel()
+	same = recs == provs
+	recCodes, provCodes = zcta.encode(recs), zcta.encode(provs) #encoded once for the border and centroid lookups
+	border = borderLengths(recCodes,provCodes,borders)
+
+	#distance between every recipient and candidate centroid, pairs missing a centroid can't be chosen
+	recPosition = centroidIndex(recCodes,centroidZCTAs)
+	provPosition = centroidIndex(provCodes,centroidZCTAs)
+	distance = numpy.empty(len(recs),dtype=numpy.float64)
+	distance.fill(numpy.inf)
+	located = (recPosition >= 0) & (provPosition >= 0)
+	recCoord = centroidCoords[recPosition[located]]
+	provCoord = centroidCoords[provPosition[located]]
+	distance[located] = distanceXY(recCoord[:,0],recCoord[:,1],provCoord[:,0],provCoord[:,1])
+
+	#-------------------------------------------------------------------------------------------
+	#per recipient longest border, nearest distance and total visits, spread back to every row
+	#-------------------------------------------------------------------------------------------
+	byGroup = numpy.argsort(group,kind='mergesort')
+	starts = groupStarts(group[byGroup])
+	maxBorder = numpy.maximum.reduceat(border[byGroup],starts)[group]
+	minDistance = numpy.minimum.reduceat(distance[byGroup],starts)[group]
+	visits = numpy.ones(len(recs)) if visits is None else numpy.asarray(visits,dtype=numpy.float64)
+	visitTotal = numpy.bincount(group,weights=visits,minlength=len(uniqueRecs))[group]
+
+	with numpy.errstate(divide='ignore',invalid='ignore'):
+		borderShare = numpy.where(maxBorder > 0,border/maxBorder,0.0)
+		closeness = numpy.where(numpy.isfinite(distance),numpy.where(distance > 0,minDistance/distance,1.0),0.0)
+		visitShare = numpy.where(visitTotal > 0,visits/visitTotal,0.0)
+
+	if policy is None:
+		#the rule's order, scored so a higher score is always ranked higher within a recipient
+		score = numpy.where(same,3.0,numpy.where(border > 0,1.0 + borderShare,closeness))
+		order = numpy.lexsort((provs,distance,-border,~same,group))
+	else:
+		score = policy.get('border',0)*borderShare + policy.get('distance',0)*closeness + policy.get('visits',0)*visitShare
+		order = numpy.lexsort((provs,distance,-score,~same,group))
+
+	rank = numpy.arange(len(order)) - numpy.repeat(starts,numpy.diff(numpy.append(starts,len(order)))) + 1
+	keep = order if k is None else order[rank <= k]
+	rank = rank if k is None else rank[rank <= k]
+	eligible = same | (border > 0) | numpy.isfinite(distance)
+	return tables.fromColumns(names,[recs[keep],provs[keep],rank,score[keep],border[keep],distance[keep],
+		visitShare[keep],eligible[keep].astype(numpy.int16)])
+
+#every recipient and provider ZCTA of a tie csv as 5 digit text, the ZCTAs whose neighbors and
+#centroids are needed to resolve it. When recs is given only the rows of those recipients count (the
+#ties that aren't cached). The rows are streamed, only the set of ZCTAs is held
+def tieZCTAs(path, recs=None):
+	found = set()
+	for header, columns in readChunks(path,[0,1]):
+		if recs is not None:
+			keep = [rec in recs for rec in columns[0]]
+			columns = [list(compress(column,keep)) for column in columns]
+		found.update(columns[0])
+		found.update(columns[1])
+	return zcta.decode(zcta.index(sorted(found))).tolist()
+
+#the visits of a block of tie csv columns as floats, from the third column when there is one. Blank
+#visits, and every row of a csv without a visits column, count as 0
+def visitColumn(columns):
+	if len(columns) < 3:
+		return numpy.zeros(len(columns[0]),dtype=numpy.float64)
+	return numpy.array([float(v) if v else 0.0 for v in columns[2]],dtype=numpy.float64)
+
+#the candidates of every tied recipient of a tie csv as {rec ZCTA: sha1 of the text of its sorted
+#candidates}, what a tie's resolution depends on besides the geometry. Each candidate is its provider
+#ZCTA, with ':' and the visits (see visitColumn) after it when the policy weighs visits. The csv is
+#streamed a block of recipient groups at a time the way resolveTieCsv reads it, only the digests are held
+def tieDigests(path, visits=False, blockSize=100000):
+	digests = {}
+	for block, blockRows in _tieBlocks(_groupedChunks(path,sniffDialect(path),blockSize)[0],blockSize):
+		recs = block[0]
+		candidates = [prov + ':' + repr(visit) for prov, visit in zip(block[1],visitColumn(block).tolist())] if visits else block[1]
+		starts = groupStarts(numpy.array(recs)).tolist()
+		for start, stop in zip(starts,starts[1:] + [len(recs)]):
+			if stop - start > 1:
+				text = ','.join(sorted(candidates[start:stop]))
+				digests[recs[start]] = hashlib.sha1(text.encode('utf-8')).hexdigest()
+	return digests
+
+#write the ties of a dyad store (store.findTies) to a tie csv of recipient and provider ZCTAs, as
+#5 digit text, and visits, the input the Tie Resolver streams. The store is read a block of
+#recipient groups at a time. Returns the number of rows written
+def storeTieCsv(dyadStore, path, rows=store.BlockRows):
+	found = store.findTies(dyadStore,rows)
+	with openCsv(path,'w') as outFile:
+		writer = csv.writer(outFile)
+		writer.writerow(['REC_ZCTA','PROV_ZCTA','VISITS'])
+		writer.writerows(zip(zcta.decode(found[store.RecField]).tolist(),zcta.decode(found[store.ProvField]).tolist(),
+			found['VISITS_DYAD'].tolist()))
+	return len(found)
+
+#check whether all the rows for each recipient ZCTA are next to each other in the csv. Only the
+#recipient column is read, and only the recipient of each run of rows is held
+def isGrouped(path, dialect):
+	runs = []
+	last = None
+	for header, columns in readChunks(path,[0],dialect=dialect):
+		recs = numpy.array(columns[0])
+		keys = recs[groupStarts(recs)]
+		if last is not None and keys[0] == last:
+			keys = keys[1:] #the run carries on from the last chunk
+		last = recs[-1]
+		runs.append(keys)
+	keys = numpy.concatenate(runs) if runs else numpy.zeros(0,dtype=str)
+	return len(numpy.unique(keys)) == len(keys)
+
+#external sort of the csv rows by recipient ZCTA for input that isn't grouped. Sorted chunks of
+#chunkSize rows are written to temporary files and merged back as a stream, rows for the same
+#recipient keep their original order. Blank rows are dropped, as they are from grouped input
+def externalSort(path, dialect, chunkSize):
+	tempDir = tempfile.mkdtemp()
+	chunkPaths = []
+	try:
+		with openCsv(path) as inFile:
+			reader = csv.reader(inFile,dialect)
+			next(reader) #skip header
+			rows = (row for row in reader if row)
+			while True:
+				chunk = list(islice(rows,chunkSize))
+				if not chunk:
+					break
+				chunk.sort(key=itemgetter(0)) #sort is stable so equal recipients stay in order
+				chunkPath = os.path.join(tempDir,"chunk{0}.csv".format(len(chunkPaths)))
+				with openCsv(chunkPath,'w') as chunkFile:
+					csv.writer(chunkFile,dialect).writerows(chunk)
+				chunkPaths.append(chunkPath)
+				del chunk
+
+		chunkFiles = [openCsv(chunkPath) for chunkPath in chunkPaths]
+		try:
+			#decorate rows with their chunk and position so the merge is stable
+			streams = [((row[0],c,i,row) for i, row in enumerate(csv.reader(f,dialect))) for c, f in enumerate(chunkFiles)]
+			for entry in heapq.merge(*streams):
+				yield entry[3]
+		finally:
+			for f in chunkFiles:
+				f.close()
+	finally:
+		shutil.rmtree(tempDir,ignore_errors=True)
+
+#resolve the ties of a block of recipient groups, given as the text columns of the csv rows with the
+#rows of each recipient together. Ties found in cached, {rec ZCTA: (provider ZCTA, 'adjacent',
+#'nearest' or '' when unresolved)}, take the cached provider without being ranked. Returns the rows
+#to keep, the ranked candidates (the top k when ranked is set, otherwise none) and the counts of the
+#block. When cached is given the counts include the resolution of every tie that was ranked
+def rankBlock(block, borders, centroidZCTAs, centroidCoords, policy=None, topK=None, cached=None):
+	recs, provs = numpy.array(block[0]), numpy.array(block[1])
+	starts = groupStarts(recs)
+	counts = numpy.diff(numpy.append(starts,len(recs)))
+	tiedRecs = recs[starts[counts > 1]]
+	hit = numpy.array([rec in cached for rec in tiedRecs.tolist()],dtype=bool) if cached else numpy.zeros(len(tiedRecs),dtype=bool)
+	groupRanked = counts > 1
+	groupRanked[groupRanked] = ~hit
+	ranking = numpy.repeat(groupRanked,counts)
+	visits = visitColumn(block)[ranking] if policy and policy.get('visits') else None
+	ranked = rankCandidates(recs[ranking],provs[ranking],borders,centroidZCTAs,centroidCoords,visits,policy,topK or 1)
+
+	#the winner of every resolved recipient, ranked is sorted by recipient. Cached winners are
+	#merged in, and rows of resolved recipients are only kept for the winning provider
+	first = (ranked['RANK'] == 1) & (ranked['ELIGIBLE'] == 1)
+	winnerRecs, winnerProvs = ranked['REC'][first], ranked['PROV'][first]
+	isAdjacent = (ranked['REC'][first] == winnerProvs) | (ranked['BORDER'][first] > 0)
+	hitRecs = tiedRecs[hit].tolist()
+	hitResolved = [rec for rec in hitRecs if cached[rec][0]]
+	if hitResolved:
+		winnerRecs = numpy.concatenate((winnerRecs,hitResolved))
+		winnerProvs = numpy.concatenate((winnerProvs,[cached[rec][0] for rec in hitResolved]))
+		order = numpy.argsort(winnerRecs,kind='mergesort')
+		winnerRecs, winnerProvs = winnerRecs[order], winnerProvs[order]
+	resolved = ~notInIndex(recs,winnerRecs)
+	kept = ~resolved
+	kept[resolved] = provs[resolved] == winnerProvs[numpy.searchsorted(winnerRecs,recs[resolved])]
+
+	unresolved = tiedRecs[notInIndex(tiedRecs,winnerRecs)].tolist()
+	adjacent = int(isAdjacent.sum()) + sum(1 for rec in hitRecs if cached[rec][1] == 'adjacent')
+	counts = {'ties':len(tiedRecs),'adjacent':adjacent,'nearest':len(tiedRecs) - adjacent - len(unresolved),'unresolved':unresolved}
+	if cached is not None:
+		counts['resolved'] = dict((rec,(prov,'adjacent' if near else 'nearest')) for rec, prov, near in
+			zip(ranked['REC'][first].tolist(),ranked['PROV'][first].tolist(),isAdjacent.tolist()))
+		counts['resolved'].update((rec,('','')) for rec in tiedRecs[~hit].tolist() if rec not in counts['resolved'])
+	return list(compress(zip(*block),kept.tolist())), tables.tableRows(ranked) if topK else [], counts
+
+#read only data of the workers resolving ties in parallel, set once per worker by _initWorker
+_WorkerData = {}
+
+def _initWorker(borders, centroidZCTAs, centroidCoords, policy, topK, cached):
+	_WorkerData.update(borders=borders,centroidZCTAs=centroidZCTAs,centroidCoords=centroidCoords,policy=policy,topK=topK,
+		cached=cached)
+
+def _rankBlockWorker(block):
+	return rankBlock(block,**_WorkerData)
+
+#chunks of text columns from a stream of csv rows (the external sort)
+def _rowChunks(rows, chunkRows, width):
+	while True:
+		columns = rowColumns(list(islice(rows,chunkRows)),width)
+		if columns is None:
+			return
+		yield columns
+
+#chunks of text columns of a tie csv with the rows of each recipient together, read as they are when
+#the csv is grouped and through the external sort when it isn't. Returns the chunks and whether the
+#rows were sorted
+def _groupedChunks(inPath, dialect, blockSize):
+	if isGrouped(inPath,dialect):
+		return (columns for fields, columns in readChunks(inPath,chunkRows=blockSize,dialect=dialect)), False
+	return _rowChunks(externalSort(inPath,dialect,blockSize),blockSize,len(readHeader(inPath,dialect))), True
+
+#blocks of about blockSize rows from chunks of text columns, as (columns, number of rows). Blocks are
+#cut at the start of the last recipient of a chunk so a recipient's rows are never split, the last
+#recipient is carried into the next block
+def _tieBlocks(chunks, blockSize):
+	pending = None
+	for columns in chunks:
+		if pending:
+			columns = [carried + column for carried, column in zip(pending,columns)]
+		recs = columns[0]
+		cut = len(recs) - 1
+		while cut > 0 and recs[cut - 1] == recs[-1]:
+			cut -= 1
+		if len(recs) < blockSize or cut == 0:
+			pending = columns
+			continue
+		yield [column[:cut] for column in columns], cut
+		pending = [column[cut:] for column in columns]
+	if pending and pending[0]:
+		yield pending, len(pending[0])
+
+#stream a tie csv one recipient group at a time, resolving ties and writing the output a block of
+#groups at a time so the whole file is never held in memory. Rows for providers that weren't chosen
+#are dropped, everything else is written in the input's dialect. progress is called with the number
+#of rows processed after each block. Ties are resolved by the tool's rule unless a composite policy
+#is given (see rankCandidates), and the top k candidates of every tie are written to rankPath when
+#it is given. With more than one process, blocks are resolved across a pool of workers that are
+#each given the borders and centroids once. Results are written in input order, so the output is
+#the same as a serial run. Ties already resolved by an earlier run can be given as cached (see
+#rankBlock), they aren't ranked again and the borders and centroids of their ZCTAs aren't needed.
+#Returns a dictionary of counts, with the resolution of every tie that was ranked under 'resolved'
+#when cached is given
+def resolveTieCsv(inPath, outPath, borderDict, centroidZCTAs, centroidCoords, blockSize=100000, progress=None,
+	policy=None, rankPath=None, topK=3, processes=1, cached=None):
+	dialect = sniffDialect(inPath) #the same dialect is used to write the output
+	stats = {'rows':0,'ties':0,'adjacent':0,'nearest':0,'unresolved':[],'sorted':False}
+	if cached is not None:
+		stats['resolved'] = {}
+	borders = borderArrays(borderDict) if isinstance(borderDict,dict) else borderDict #looked up for every block
+	shared = (borders,centroidZCTAs,centroidCoords,policy,topK if rankPath else None,cached)
+	rankFile = openCsv(rankPath,'w') if rankPath else None
+	rankWriter = csv.writer(rankFile) if rankFile else None
+
+	header = readHeader(inPath,dialect)
+	chunks, stats['sorted'] = _groupedChunks(inPath,dialect,blockSize)
+
+	def writeBlock(result, blockRows):
+		kept, ranked, counts = result
+		writer.writerows(kept)
+		if rankWriter:
+			rankWriter.writerows(ranked)
+		for name in ('ties','adjacent','nearest','unresolved'):
+			stats[name] += counts[name]
+		if 'resolved' in counts:
+			stats['resolved'].update(counts['resolved'])
+		stats['rows'] += blockRows
+		if progress:
+			progress(stats['rows'])
+
+	pool = dyads.processPool(processes,_initWorker,shared) if processes > 1 else None
+	try:
+		with openCsv(outPath,'w') as outCSV:
+			writer = csv.writer(outCSV,dialect) #writer object using the reader dialect
+			writer.writerow(header) #write header
+			if rankWriter:
+				rankWriter.writerow(['REC','PROV','RANK','SCORE','BORDER','DISTANCE','VISIT_SHARE','ELIGIBLE'])
+
+			if pool is None:
+				for block, blockRows in _tieBlocks(chunks,blockSize):
+					writeBlock(rankBlock(block,*shared),blockRows)
+			else:
+				#a few blocks per worker are in flight at once so reading stays ahead of the workers
+				#without queueing the whole file, and results are taken back in the order they were sent
+				pending = deque()
+				for block, blockRows in _tieBlocks(chunks,blockSize):
+					pending.append((pool.apply_async(_rankBlockWorker,(block,)),blockRows))
+					if len(pending) >= processes*2:
+						result, blockRows = pending.popleft()
+						writeBlock(result.get(),blockRows)
+				while pending:
+					result, blockRows = pending.popleft()
+					writeBlock(result.get(),blockRows)
+	finally:
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+		if rankFile:
+			rankFile.close()
+	return stats
+
+#load a polygon neighbors table (src, nbr and LENGTH fields) into the same structure as sharedBorders
+def bordersFromTable(table, srcField, nbrField, lengthField):
+	borders = defaultdict(dict)
+	for src, nbr, length in zip(table[srcField].tolist(),table[nbrField].tolist(),table[lengthField].tolist()):
+		if length > 0:
+			borders[str(src)][str(nbr)] = length
+	return borders
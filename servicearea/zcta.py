@@ -0,0 +1,138 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : zcta.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: One compact encoding for ZCTAs and zip codes shared by the tools. ZCTAs come in
+# as integers, floats (spreadsheet imports) or text with and without leading zeros, and are
+# encoded as uint32 codes so the ZCTA index, crosswalk, centroids and dyad columns are plain numeric
+# arrays that can be sorted, searched and joined as whole columns. Codes are decoded back to
+# 5 digit text for reports and dictionaries.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import numpy
+
+###################################################################################################
+#Global variables
+###################################################################################################
+Code = numpy.uint32 #dtype of an encoded ZCTA
+Invalid = numpy.iinfo(Code).max #code given to values that aren't a zip code (blank, text, negative)
+Powers = 10**numpy.arange(10,dtype=numpy.int64) #place values of the digits of a text ZCTA
+
+###################################################################################################
+# Defining global functions
+###################################################################################################
+
+#encode an array (or list) of ZCTAs as uint32 codes. '01001', ' 1001', 1001 and 1001.0 all encode to
+#1001, anything that isn't a whole non negative number is encoded as Invalid
+def encode(values):
+	values = numpy.asarray(values)
+	codes = numpy.empty(values.shape,dtype=Code)
+	codes.fill(Invalid)
+	if values.dtype.kind in 'iu':
+		valid = (values >= 0) & (values < Invalid)
+		codes[valid] = values[valid]
+	elif values.dtype.kind == 'f':
+		valid = numpy.isfinite(values)
+		valid[valid] = (values[valid] >= 0) & (values[valid] < Invalid) & (values[valid] == numpy.floor(values[valid]))
+		codes[valid] = values[valid]
+	elif values.size:
+		codes = _encodeText(values.ravel()).reshape(values.shape)
+	return codes
+
+#encode text ZCTAs. Plain ascii values (digits with blanks around them) are read straight from the
+#characters of the array as one block of numbers, which is several times faster than the numpy.char
+#functions, anything else is left to them
+def _encodeText(values):
+	if values.dtype.kind not in 'SU':
+		values = values.astype(str)
+	values = numpy.ascontiguousarray(values)
+	codes = numpy.empty(len(values),dtype=Code)
+	codes.fill(Invalid)
+	charSize = 1 if values.dtype.kind == 'S' else 4
+	width = values.dtype.itemsize // charSize
+	if width == 0:
+		return codes
+	chars = values.view(numpy.uint8 if charSize == 1 else numpy.uint32).reshape(len(values),width)
+	digit = (chars >= 48) & (chars <= 57)
+	plain = (digit | (chars == 0) | (chars == 32) | ((chars >= 9) & (chars <= 13))).all(axis=1)
+	count = digit.sum(axis=1)
+	first = digit.argmax(axis=1)
+	last = width - 1 - digit[:,::-1].argmax(axis=1)
+	valid = plain & (count > 0) & (count <= 9) & (last - first + 1 == count) #9 digits always fit in a code
+	power = last[:,None] - numpy.arange(width)
+	number = ((chars.astype(numpy.int64) - 48)*Powers[numpy.clip(power,0,9)]*(digit & (power >= 0))).sum(axis=1)
+	codes[valid] = number[valid]
+
+	other = ~plain
+	if other.any():
+		text = numpy.char.strip(values[other].astype(str))
+		valid = numpy.char.isdigit(text) & (numpy.char.str_len(text) <= 9)
+		otherCodes = numpy.empty(len(text),dtype=Code)
+		otherCodes.fill(Invalid)
+		otherCodes[valid] = text[valid].astype(numpy.int64)
+		codes[other] = otherCodes
+	return codes
+
+#decode codes back to 5 digit text, Invalid codes decode to an empty string
+def decode(codes):
+	codes = numpy.asarray(codes,dtype=Code)
+	if codes.size == 0:
+		return numpy.zeros(codes.shape,dtype='U5')
+	text = numpy.char.zfill(codes.astype(str),5)
+	text[codes == Invalid] = ''
+	return text
+
+#codes in the form of a column of dtype, to write them back to the field they were read from. Text
+#fields get 5 digit text so leading zeros are kept, numeric fields the codes themselves
+def asField(codes, dtype):
+	dtype = numpy.dtype(dtype)
+	if dtype.kind in 'SUO':
+		return decode(codes).astype(dtype)
+	return numpy.asarray(codes).astype(dtype)
+
+#sorted unique codes of an array of ZCTAs, without Invalid, to search other columns against
+def index(values):
+	codes = numpy.unique(encode(values))
+	return codes[codes != Invalid]
+
+#position of each code (or pair key) in a sorted array of them, -1 where it isn't there
+def positions(codes, sortedCodes):
+	codes = numpy.asarray(codes)
+	if len(sortedCodes) == 0:
+		return numpy.zeros(len(codes),dtype=numpy.intp) - 1
+	position = numpy.searchsorted(sortedCodes,codes)
+	position[position == len(sortedCodes)] = 0
+	position[sortedCodes[position] != codes] = -1
+	return position
+
+#encode a crosswalk given as zip and ZCTA columns. Returns the zip codes sorted and the ZCTA code of
+#each, rows whose zip or ZCTA doesn't encode are dropped
+def crosswalk(zips, zctas):
+	zips = encode(zips)
+	zctas = encode(zctas)
+	valid = (zips != Invalid) & (zctas != Invalid)
+	zips, zctas = zips[valid], zctas[valid]
+	order = numpy.argsort(zips,kind='mergesort')
+	return zips[order], zctas[order]
+
+#one 64 bit key for each pair of codes, ordered by the first code then the second
+def pairKeys(first, second):
+	return (numpy.asarray(first).astype(numpy.uint64) << numpy.uint64(32)) | numpy.asarray(second).astype(numpy.uint64)
+
+#stable order of rows by recipient then provider. Pairs of codes are sorted as one 64 bit key, which
+#is about twice as fast as sorting on the two columns, falling back to lexsort for values that
+#aren't codes
+def pairOrder(rec, prov):
+	rec, prov = numpy.asarray(rec), numpy.asarray(prov)
+	if len(rec) == 0:
+		return numpy.zeros(0,dtype=numpy.intp)
+	if min(rec.min(),prov.min()) >= 0 and max(rec.max(),prov.max()) <= Invalid:
+		return numpy.argsort(pairKeys(rec,prov),kind='mergesort')
+	return numpy.lexsort((prov,rec))
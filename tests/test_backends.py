@@ -0,0 +1,56 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : test_backends.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Tests of the backends outside of ArcGIS: zip codes must be matched to the crosswalk
+# by ZCTA code, whatever the type of the key field, and ZCTAs written in the form of the field.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from servicearea import tables, zcta
+from servicearea.backends import CsvBackend, MemoryBackend
+
+###################################################################################################
+#Tests
+###################################################################################################
+class UpdateValuesTest(unittest.TestCase):
+	def setUp(self):
+		self.zips, self.zctas = zcta.crosswalk(['01001','01002','52240'],['01001','01001','52241'])
+
+	def test_numeric_field_matches_leading_zeros(self):
+		backend = MemoryBackend({'zctas':tables.fromColumns(['ZCTA'],[numpy.array([1001,1002,52240,9])])})
+		self.assertEqual(backend.updateValues('zctas','ZCTA','ZCTA',self.zips,self.zctas),3)
+		self.assertEqual(backend.tables['zctas']['ZCTA'].tolist(),[1001,1001,52241,9])
+
+	def test_text_field_keeps_leading_zeros(self):
+		backend = MemoryBackend({'zips':tables.fromColumns(['ZIP','ZCTA'],
+			[numpy.array(['1002','01002','52240','x']),numpy.array(['']*4)])})
+		self.assertEqual(backend.updateValues('zips','ZIP','ZCTA',self.zips,self.zctas),3)
+		self.assertEqual(backend.tables['zips']['ZCTA'].tolist(),['01001','01001','52241',''])
+
+	def test_csv_file(self):
+		folder = tempfile.mkdtemp()
+		try:
+			path = os.path.join(folder,'zips.csv')
+			with open(path,'w') as f:
+				f.write('ZIP,ZCTA\n01002,0\n52240,0\n99999,0\n')
+			backend = CsvBackend()
+			self.assertEqual(backend.updateValues(path,'ZIP','ZCTA',self.zips,self.zctas),2)
+			self.assertEqual(backend.readTable(path)['ZCTA'].tolist(),[1001,52241,0])
+		finally:
+			shutil.rmtree(folder)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,57 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : test_checker.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Tests of the checker: the ZCTAs missing from the ZCTA layer and their visits must be
+# found with one binary search of the sorted index for every row, whatever form the ZCTAs are in,
+# and checking a dyad store a block at a time must find the same as checking the whole table.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from servicearea import benchmark, checker, store, zcta
+
+###################################################################################################
+#Tests
+###################################################################################################
+class CheckerTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.dyads = benchmark.dyadTable(3000,200,numpy.random.RandomState(0))
+		codes = benchmark.zctaCodes(200)
+		self.index = checker.zctaIndex(codes[numpy.arange(200) % 20 != 0])
+		self.result = checker.checkDyads(self.dyads['REC_ZIP'],self.dyads['PROV_ZIP'],self.dyads['VISITS_DYAD'],self.index)
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def test_finds_missing_zctas(self):
+		missing = set(zcta.decode(self.dyads['REC_ZIP']).tolist()) | set(zcta.decode(self.dyads['PROV_ZIP']).tolist())
+		missing -= set(zcta.decode(self.index).tolist())
+		self.assertEqual(self.result['missing'],sorted(missing))
+		self.assertGreater(self.result['visitsMissed'],0)
+		self.assertEqual(self.result['visitsTotal'],float(self.dyads['VISITS_DYAD'].sum()))
+
+	def test_text_matches_numbers(self):
+		result = checker.checkDyads(zcta.decode(self.dyads['REC_ZIP']),self.dyads['PROV_ZIP'].astype(numpy.float64),
+			self.dyads['VISITS_DYAD'],self.index)
+		self.assertEqual(result,self.result)
+
+	def test_store_matches_table(self):
+		path = os.path.join(self.folder,'dyads' + store.Extension)
+		store.writeStore(path,[self.dyads[:1000],self.dyads[1000:]])
+		self.assertEqual(checker.checkStore(store.DyadStore(path),self.index,rows=250),self.result)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,92 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : test_csvutil.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Tests of the chunked csv reader: splitting lines on the delimiter and handing quoted
+# chunks to the csv module must read the same rows as the csv module alone, ragged rows included.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+from servicearea import csvutil
+
+###################################################################################################
+#Tests
+###################################################################################################
+class ReadChunksTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def write(self, name, text):
+		path = os.path.join(self.folder,name)
+		with open(path,'wb') as f:
+			f.write(text.encode('utf-8'))
+		return path
+
+	#rows as the csv module reads them, blank rows skipped
+	def expected(self, path):
+		with csvutil.openCsv(path) as f:
+			rows = [row for row in csv.reader(f,csvutil.sniffDialect(path)) if row]
+		return rows[0], rows[1:]
+
+	#rows read by readChunks, chunkRows lines at a time
+	def chunkRows(self, path, fields=None, chunkRows=7, dialect=None):
+		rows = []
+		for header, columns in csvutil.readChunks(path,fields,chunkRows,dialect):
+			rows.extend(list(row) for row in zip(*columns))
+		return header, rows
+
+	def test_plain_lines(self):
+		lines = ['REC_ZCTA,PROV_ZCTA,VISITS'] + ['{0:05d},{1:05d},{2}'.format(i*37 % 99999,i*11 % 99999,i % 13) for i in range(100)]
+		path = self.write('plain.csv','\n'.join(lines) + '\n')
+		self.assertEqual(self.chunkRows(path),self.expected(path))
+
+	def test_windows_line_endings(self):
+		lines = ['REC_ZCTA,PROV_ZCTA,VISITS'] + ['{0:05d},{1:05d},{2}'.format(i,i + 1,i % 5) for i in range(50)]
+		path = self.write('windows.csv','\r\n'.join(lines) + '\r\n')
+		self.assertEqual(self.chunkRows(path),self.expected(path))
+
+	def test_quoted_fields_after_first_chunk(self):
+		lines = ['ZIP,PO_NAME,STATE,ZCTA'] + ['{0:05d},TOWN {0},IA,{0:05d}'.format(i) for i in range(30)]
+		lines += ['{0:05d},"Town, {0}",IA,{0:05d}'.format(i) for i in range(30,40)]
+		lines += ['00050,"Two\nLines",IA,00050','00051,"Say ""Hi""",IA,00051']
+		lines += ['{0:05d},TOWN {0},IA,{0:05d}'.format(i) for i in range(52,70)]
+		path = self.write('quoted.csv','\n'.join(lines) + '\n')
+		header, rows = self.chunkRows(path)
+		self.assertEqual((header,rows),self.expected(path))
+		self.assertEqual(rows[30][1],'Town, 30')
+		self.assertEqual(rows[40][1],'Two\nLines')
+
+	def test_blank_and_short_rows(self):
+		path = self.write('ragged.csv','REC_ZCTA,PROV_ZCTA,VISITS\n00501,01001,3\n\n00502,01002\n00503,01003,4\n')
+		header, rows = self.chunkRows(path,chunkRows=2,dialect=csv.excel) #too ragged to sniff
+		self.assertEqual(rows,[['00501','01001','3'],['00502','01002',''],['00503','01003','4']])
+
+	def test_short_row_then_long_row(self):
+		path = self.write('uneven.csv','REC_ZCTA,PROV_ZCTA,VISITS\n00501,01001\n00502,01002,4,9\n00503,01003,5\n')
+		header, rows = self.chunkRows(path,dialect=csv.excel)
+		self.assertEqual(rows,[['00501','01001',''],['00502','01002','4'],['00503','01003','5']])
+
+	def test_fields_by_name_and_position(self):
+		lines = ['REC_ZCTA,PROV_ZCTA,VISITS'] + ['{0:05d},{1:05d},{2}'.format(i,i + 1,i % 5) for i in range(20)]
+		path = self.write('fields.csv','\n'.join(lines) + '\n')
+		header, rows = self.expected(path)
+		self.assertEqual(self.chunkRows(path,['VISITS','REC_ZCTA'])[1],[[row[2],row[0]] for row in rows])
+		self.assertEqual(self.chunkRows(path,[1])[1],[[row[1]] for row in rows])
+
+if __name__ == '__main__':
+	unittest.main()
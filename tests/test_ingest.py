@@ -0,0 +1,185 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : test_ingest.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Tests of the resumable download against a local HTTP server that answers range
+# requests, checks If-Range against its ETag, and can drop the connection part way through a
+# response or change the file between requests.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler #python 2 runtime used by ArcGIS
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from servicearea import crosswalk, ingest
+
+###################################################################################################
+#Local stand in for the crosswalk server
+###################################################################################################
+
+#serves server.data with server.etag. The first server.drops responses are cut off after
+#server.dropAfter bytes, and server.changeTo (data, etag) replaces the file after the first cut
+class _Handler(BaseHTTPRequestHandler):
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		server = self.server
+		data, start = server.data, 0
+		requested = re.match(r'bytes=(\d+)-',self.headers.get('Range') or '')
+		validator = self.headers.get('If-Range')
+		server.requests.append((requested.group(1) if requested else None,validator))
+		if requested and (validator is None or validator == server.etag):
+			start = int(requested.group(1))
+			if start >= len(data):
+				self.send_response(416)
+				self.end_headers()
+				return
+			self.send_response(206)
+			self.send_header('Content-Range','bytes {0}-{1}/{2}'.format(start,len(data) - 1,len(data)))
+		else:
+			self.send_response(200)
+		self.send_header('Content-Length',str(len(data) - start))
+		self.send_header('ETag',server.etag)
+		self.end_headers()
+		body = data[start:]
+		if server.drops and len(body) > server.dropAfter:
+			server.drops -= 1
+			self.wfile.write(body[:server.dropAfter])
+			self.wfile.flush()
+			self.close_connection = True
+			if server.changeTo:
+				server.data, server.etag = server.changeTo
+				server.changeTo = None
+			return
+		self.wfile.write(body)
+
+def _serve(data, etag='"v1"', drops=0, dropAfter=0, changeTo=None):
+	server = HTTPServer(('127.0.0.1',0),_Handler)
+	server.data, server.etag = data, etag
+	server.drops, server.dropAfter, server.changeTo = drops, dropAfter, changeTo
+	server.requests = []
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+#a crosswalk csv of rows zip codes, with the byte order mark excel leaves
+def _crosswalkCsv(rows, seed=0):
+	lines = ['ZIP_CODE,PO_NAME,STATE,ZIP_TYPE,ZCTA']
+	for i in range(rows):
+		zip = (i*7919 + seed) % 99000 + 501
+		lines.append('{0:05d},"Town, {1}",IA,Post Office,{0:05d}'.format(zip,i))
+	return (u'﻿' + u'\r\n'.join(lines) + u'\r\n').encode('utf-8')
+
+###################################################################################################
+#Tests
+###################################################################################################
+class DownloadTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.path = os.path.join(self.folder,'crosswalk.csv')
+		self.servers = []
+
+	def tearDown(self):
+		for server in self.servers:
+			server.shutdown()
+			server.server_close()
+		shutil.rmtree(self.folder)
+
+	def serve(self, data, **kwargs):
+		server = _serve(data,**kwargs)
+		self.servers.append(server)
+		return server
+
+	def download(self, server, **kwargs):
+		url = 'http://127.0.0.1:{0}/crosswalk.csv'.format(server.server_port)
+		return ingest.Download(url,self.path,chunkSize=4096,wait=0,**kwargs)
+
+	def assertComplete(self, download, data):
+		with open(self.path,'rb') as f:
+			self.assertEqual(f.read(),data)
+		self.assertEqual(download.sha1,hashlib.sha1(data).hexdigest())
+		self.assertEqual(download.size,len(data))
+		self.assertFalse(os.path.exists(self.path + '.part'))
+		self.assertFalse(os.path.exists(self.path + '.part.json'))
+
+	def test_resumes_dropped_connections(self):
+		data = _crosswalkCsv(5000)
+		server = self.serve(data,drops=2,dropAfter=50000)
+		download = self.download(server)
+		blocks = list(download)
+		self.assertEqual(b''.join(blocks),data)
+		self.assertComplete(download,data)
+		self.assertEqual(download.attempts,3)
+		self.assertEqual([start for start, validator in server.requests],[None,'50000','100000'])
+		self.assertEqual([validator for start, validator in server.requests],[None,'"v1"','"v1"'])
+
+	def test_parses_while_resuming(self):
+		data = _crosswalkCsv(5000)
+		server = self.serve(data,drops=3,dropAfter=30000)
+		table = crosswalk.readCrosswalk(ingest.csvRows(self.download(server)))
+		expected = crosswalk.readCrosswalk(ingest.fileRows(self.path))
+		self.assertEqual(len(table),5000)
+		self.assertEqual(table.tolist(),expected.tolist())
+
+	def test_resumes_part_file_of_earlier_run(self):
+		data = _crosswalkCsv(5000)
+		server = self.serve(data)
+		with open(self.path + '.part','wb') as f:
+			f.write(data[:12345])
+		with open(self.path + '.part.json','w') as f:
+			json.dump({'url':self.download(server).url,'validator':'"v1"'},f)
+		download = self.download(server).run()
+		self.assertEqual(download.resumed,12345)
+		self.assertComplete(download,data)
+
+	def test_restarts_stale_part_file(self):
+		data = _crosswalkCsv(5000,seed=1)
+		server = self.serve(data,etag='"v2"')
+		with open(self.path + '.part','wb') as f:
+			f.write(_crosswalkCsv(5000)[:12345])
+		with open(self.path + '.part.json','w') as f:
+			json.dump({'url':self.download(server).url,'validator':'"v1"'},f)
+		download = self.download(server).run()
+		self.assertEqual(download.resumed,0)
+		self.assertComplete(download,data)
+
+	def test_changed_file_raises(self):
+		data, changed = _crosswalkCsv(5000), _crosswalkCsv(5000,seed=1)
+		server = self.serve(data,drops=1,dropAfter=50000,changeTo=(changed,'"v2"'))
+		download = self.download(server)
+		received = []
+		with self.assertRaises(IOError):
+			for block in download:
+				received.append(block)
+		self.assertEqual(b''.join(received),data[:50000])
+		self.assertIsNone(download.sha1)
+		self.assertFalse(os.path.exists(self.path))
+		self.assertFalse(os.path.exists(self.path + '.part'))
+		self.assertFalse(os.path.exists(self.path + '.part.json'))
+
+		#the next run fetches the new file from the start
+		download = self.download(server).run()
+		self.assertEqual(download.resumed,0)
+		self.assertComplete(download,changed)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,162 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : test_reconcile.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Tests of the reconciler: duplicate dyads must be merged and their recipients'
+# totals recalculated, reconciling a dyad store a block at a time or only the changed recipient
+# groups must give the same rows as reconciling the whole table, the impact estimate must match
+# what reconciling reports, and text ZCTA fields must keep their leading zeros when remapped or
+# replaced.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from servicearea import benchmark, reconcile, store, tables, zcta
+from servicearea.backends import MemoryBackend
+
+###################################################################################################
+#Synthetic data
+###################################################################################################
+
+#a dyad table with its ZCTA index and crosswalk. Every 20th ZCTA is left out of the ZCTA layer and
+#every 17th crosswalk entry is dropped, so rows are remapped, merged and lost
+def _sample(count=3000, zctaCount=200, seed=0):
+	random = numpy.random.RandomState(seed)
+	dyads = benchmark.dyadTable(count,zctaCount,random)
+	codes = benchmark.zctaCodes(zctaCount)
+	index = zcta.index(codes[numpy.arange(zctaCount) % 20 != 0])
+	national = benchmark.nationalCrosswalk(zctaCount)
+	national = national[numpy.arange(len(national)) % 17 != 0]
+	zips, zctas = zcta.crosswalk(national['ZIP'],national['ZCTA'])
+	return dyads, index, zips, zctas
+
+#rows of a table as sorted tuples of integers, to compare tables of different field types
+def _rows(table, fields=None):
+	fields = fields or [name for name, dtype in store.Columns]
+	columns = [zcta.encode(table[f]) if f in (store.RecField,store.ProvField) else table[f] for f in fields]
+	return sorted(zip(*[numpy.asarray(c).astype(numpy.int64).tolist() for c in columns]))
+
+###################################################################################################
+#Tests
+###################################################################################################
+class ReconcileTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.dyads, self.index, self.zips, self.zctas = _sample()
+		self.reconciled, self.report = reconcile.reconcileDyads(self.dyads,'REC_ZIP','PROV_ZIP','VISITS_DYAD',
+			self.index,self.zips,self.zctas)
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def test_sample_is_remapped_and_merged(self):
+		self.assertGreater(self.report['merged'],0)
+		self.assertGreater(self.report['visitsLost'],0)
+		self.assertEqual(len(self.reconciled),len(self.dyads) - self.report['merged'])
+		self.assertEqual(int(self.reconciled['VISITS_DYAD'].sum()),self.report['visitsTotal'])
+
+	def test_existing_duplicates_are_merged(self):
+		index = zcta.index([1001,1002])
+		zips, zctas = zcta.crosswalk([],[])
+		dyads = tables.fromColumns(['REC_ZIP','PROV_ZIP','VISITS_DYAD','MAX_VISITS','VISITS_TOTAL','Dyad_max'],
+			[numpy.array([1001,1001,1001,1002]),numpy.array([1002,1002,1001,1002]),numpy.array([3,4,5,2]),
+			numpy.array([5,5,5,2]),numpy.array([12,12,12,2]),numpy.array([0,0,1,1],dtype=numpy.int16)])
+		reconciled, report = reconcile.reconcileDyads(dyads,'REC_ZIP','PROV_ZIP','VISITS_DYAD',index,zips,zctas)
+		self.assertEqual((report['merged'],report['mergedPairs']),(1,1))
+		self.assertEqual(reconciled.tolist(),[(1001,1001,5,7,12,0),(1001,1002,7,7,12,1),(1002,1002,2,2,2,1)])
+
+	def test_store_matches_table(self):
+		source = os.path.join(self.folder,'dyads' + store.Extension)
+		target = os.path.join(self.folder,'reconciled' + store.Extension)
+		store.writeStore(source,[self.dyads[:1000],self.dyads[1000:]])
+		report = reconcile.reconcileStore(store.DyadStore(source),self.index,self.zips,self.zctas,target,rows=250)
+		reconciled = store.DyadStore(target)
+		self.assertEqual(_rows(reconciled.table()),_rows(self.reconciled))
+		self.assertEqual(report['written'],len(self.reconciled))
+		for key, value in self.report.items():
+			self.assertEqual(report[key],value,key)
+
+	def test_incremental_matches_table(self):
+		reconciled, replaced, report, digests = reconcile.reconcileIncremental(self.dyads,'REC_ZIP','PROV_ZIP',
+			'VISITS_DYAD',self.index,self.zips,self.zctas,{})
+		self.assertEqual(_rows(reconciled),_rows(self.reconciled))
+		self.assertEqual(replaced.tolist(),zcta.index(self.dyads['REC_ZIP']).tolist())
+		for key, value in self.report.items():
+			self.assertEqual(report[key],value,key)
+
+		#the reconciled table has nothing left to reconcile
+		again, replaced, report, digests = reconcile.reconcileIncremental(reconciled,'REC_ZIP','PROV_ZIP',
+			'VISITS_DYAD',self.index,self.zips,self.zctas,digests)
+		self.assertEqual(report['groupsChanged'],0)
+		self.assertEqual(report['rowsReconciled'],0)
+		self.assertEqual(len(again),0)
+
+	def test_incremental_reconciles_changed_groups(self):
+		reconciled, replaced, report, digests = reconcile.reconcileIncremental(self.dyads,'REC_ZIP','PROV_ZIP',
+			'VISITS_DYAD',self.index,self.zips,self.zctas,{})
+		changed = reconciled.copy()
+		first = changed['REC_ZIP'][0]
+		changed['VISITS_DYAD'][changed['REC_ZIP'] == first] += 1
+		rows, replaced, report, digests = reconcile.reconcileIncremental(changed,'REC_ZIP','PROV_ZIP','VISITS_DYAD',
+			self.index,self.zips,self.zctas,digests)
+		self.assertEqual(report['groupsChanged'],1)
+		self.assertEqual(replaced.tolist(),[first])
+		whole = reconcile.reconcileDyads(changed,'REC_ZIP','PROV_ZIP','VISITS_DYAD',self.index,self.zips,self.zctas)[0]
+		self.assertEqual(_rows(rows),_rows(whole[whole['REC_ZIP'] == first]))
+
+	def test_impact_matches_reconcile(self):
+		impact = reconcile.estimateImpact(self.dyads['REC_ZIP'],self.dyads['PROV_ZIP'],self.dyads['VISITS_DYAD'],
+			self.index,self.zips,self.zctas)
+		for key in ('merged','mergedPairs','visitsTotal','visitsMissed','visitsLost'):
+			self.assertEqual(impact[key],self.report[key],key)
+		self.assertEqual(impact['zctas']['ZCTA'].tolist(),self.report['missing'])
+
+	def test_store_impact_matches_table(self):
+		source = os.path.join(self.folder,'dyads' + store.Extension)
+		store.writeStore(source,[self.dyads])
+		impact = reconcile.estimateImpact(self.dyads['REC_ZIP'],self.dyads['PROV_ZIP'],self.dyads['VISITS_DYAD'],
+			self.index,self.zips,self.zctas)
+		storeImpact = reconcile.estimateStoreImpact(store.DyadStore(source),self.index,self.zips,self.zctas,rows=250)
+		self.assertEqual(storeImpact['zctas'].tolist(),impact['zctas'].tolist())
+		for key, value in impact.items():
+			if key != 'zctas':
+				self.assertEqual(storeImpact[key],value,key)
+
+class TextFieldTest(unittest.TestCase):
+	def setUp(self):
+		self.index = zcta.index(['00501','01001','01002'])
+		self.zips, self.zctas = zcta.crosswalk(['00502','01003'],['00501','01001'])
+		self.dyads = tables.fromColumns(['REC_ZIP','PROV_ZIP','VISITS_DYAD','MAX_VISITS','VISITS_TOTAL','Dyad_max'],
+			[numpy.array(['00502','00501','','01001']),numpy.array(['01001','01001','01002','01003']),
+			numpy.array([3,4,5,2]),numpy.array([3,4,5,2]),numpy.array([3,4,5,2]),numpy.ones(4,dtype=numpy.int16)])
+
+	def test_remapped_text_keeps_leading_zeros(self):
+		reconciled, report = reconcile.reconcileDyads(self.dyads,'REC_ZIP','PROV_ZIP','VISITS_DYAD',
+			self.index,self.zips,self.zctas)
+		self.assertEqual(reconciled.dtype,self.dyads.dtype)
+		self.assertEqual(reconciled[['REC_ZIP','PROV_ZIP','VISITS_DYAD','VISITS_TOTAL']].tolist(),
+			[('00501','01001',7,7),('01001','01001',2,2),('','01002',5,5)])
+		self.assertEqual(report['missing'],['00502','01003'])
+		self.assertEqual((report['merged'],report['mergedPairs']),(1,1))
+		self.assertEqual((report['visitsMissed'],report['visitsLost']),(5,5))
+
+	def test_replace_groups_matches_codes(self):
+		backend = MemoryBackend({'dyads':self.dyads})
+		replacement = self.dyads[:1].copy()
+		replacement['REC_ZIP'] = '00501'
+		backend.replaceGroups(replacement,'dyads','REC_ZIP',numpy.array([501,502]))
+		self.assertEqual(sorted(backend.tables['dyads']['REC_ZIP'].tolist()),['','00501','01001'])
+
+if __name__ == '__main__':
+	unittest.main()
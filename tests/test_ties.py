@@ -0,0 +1,173 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Name          : test_ties.py
+# Author  		: Mark Pooley (mark-pooley@uiowa.edu)
+# Link    		: http://www.ppc.uiowa.edu
+# Date    		: 2015-01-20 12:30:08
+# Version		: $1.0$
+# Description	: Tests of the tie resolver: ties streamed from input that isn't grouped by recipient
+# must be resolved the same as from grouped input, a pool of processes or the tie cache must write
+# the same file as a serial run without it, tie digests must not depend on the order of the rows,
+# blank or missing visits must count as 0, and the ties of a dyad store must be found.
+#--------------------------------------------------------------------------------------------------
+
+###################################################################################################
+#Import python modules
+###################################################################################################
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from servicearea import benchmark, reconcile, store, tiecache, ties, zcta
+from servicearea.backends import MemoryBackend
+
+###################################################################################################
+#Tests
+###################################################################################################
+class ResolveTieCsvTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.tiePath = os.path.join(self.folder,'ties.csv')
+		benchmark.writeTieCsv(self.tiePath,2000,100,numpy.random.RandomState(0))
+		self.backend = MemoryBackend(polygons={'zctas':benchmark.gridPolygons(100)})
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def path(self, name):
+		return os.path.join(self.folder,name)
+
+	def read(self, name):
+		with open(self.path(name),'rb') as f:
+			return f.read()
+
+	#a copy of the tie csv with its rows shuffled, ending in a blank line
+	def shuffled(self, name):
+		with open(self.tiePath) as f:
+			header, rows = f.readline(), f.readlines()
+		numpy.random.RandomState(1).shuffle(rows)
+		with open(self.path(name),'w') as f:
+			f.write(header)
+			f.writelines(rows)
+			f.write('\n')
+		return self.path(name)
+
+	#resolve the ties of inPath (the tie csv when not given) against the geometry of zctas (every
+	#ZCTA when not given)
+	def resolve(self, name, zctas=None, inPath=None, **kwargs):
+		borders = ties.sharedBorders(self.backend.readPolygons('zctas','ZCTA5CE10',zctas))
+		centroidZCTAs, centroidCoords = self.backend.readCentroids('zctas','ZCTA5CE10',zctas)
+		return ties.resolveTieCsv(inPath or self.tiePath,self.path(name),borders,centroidZCTAs,centroidCoords,blockSize=50,**kwargs)
+
+	def test_unsorted_matches_grouped(self):
+		grouped = self.resolve('grouped.csv')
+		unsorted = self.resolve('unsorted.csv',inPath=self.shuffled('shuffled.csv'))
+		self.assertFalse(grouped['sorted'])
+		self.assertTrue(unsorted['sorted'])
+		self.assertGreater(grouped['ties'],0)
+		for key in ('rows','ties','adjacent','nearest','unresolved'):
+			self.assertEqual(unsorted[key],grouped[key],key)
+		self.assertEqual(sorted(self.read('unsorted.csv').splitlines()),sorted(self.read('grouped.csv').splitlines()))
+
+	def test_pool_matches_serial(self):
+		serial = self.resolve('serial.csv')
+		pooled = self.resolve('pooled.csv',processes=2)
+		self.assertGreater(serial['ties'],0)
+		self.assertEqual(pooled,serial)
+		self.assertEqual(self.read('pooled.csv'),self.read('serial.csv'))
+
+	def test_cache_matches_uncached(self):
+		uncached = self.resolve('uncached.csv')
+		digests = ties.tieDigests(self.tiePath)
+		self.assertEqual(len(digests),uncached['ties'])
+
+		#the first run resolves every tie and fills the cache
+		cache = tiecache.TieCache(self.path('ties.cache'),'geometry')
+		cached = cache.lookup(digests)
+		self.assertEqual(cached,{})
+		first = self.resolve('first.csv',cached=cached)
+		cache.store(digests,first['resolved'])
+		cache.save()
+		self.assertEqual(self.read('first.csv'),self.read('uncached.csv'))
+
+		#the next runs find every tie in the cache and need none of the geometry
+		for processes in (1,2):
+			cache = tiecache.TieCache(self.path('ties.cache'),'geometry')
+			cached = cache.lookup(digests)
+			self.assertEqual(len(cached),len(digests))
+			self.assertEqual(ties.tieZCTAs(self.tiePath,set(rec for rec in digests if rec not in cached)),[])
+			name = 'cached{0}.csv'.format(processes)
+			stats = self.resolve(name,[],cached=cached,processes=processes)
+			self.assertEqual(stats['resolved'],{})
+			self.assertEqual(self.read(name),self.read('uncached.csv'))
+
+	def test_cache_dropped_when_geometry_changes(self):
+		digests = ties.tieDigests(self.tiePath)
+		cache = tiecache.TieCache(self.path('ties.cache'),'geometry')
+		cache.store(digests,self.resolve('first.csv',cached={})['resolved'])
+		cache.save()
+		cache = tiecache.TieCache(self.path('ties.cache'),'other geometry')
+		self.assertTrue(cache.invalidated)
+		self.assertEqual(cache.lookup(digests),{})
+
+	def test_digests_ignore_row_order(self):
+		shuffled = self.shuffled('shuffled.csv')
+		self.assertEqual(ties.tieDigests(shuffled,blockSize=50),ties.tieDigests(self.tiePath,blockSize=50))
+		self.assertEqual(ties.tieDigests(shuffled,True,50),ties.tieDigests(self.tiePath,True,50))
+
+	#a copy of the tie csv with every other row's visits set to visits, or with only its first two
+	#columns when visits isn't given
+	def rewritten(self, name, visits=None):
+		with open(self.tiePath) as f:
+			rows = [line.rstrip('\n').split(',') for line in f]
+		with open(self.path(name),'w') as f:
+			for i, row in enumerate(rows):
+				if visits is None:
+					row = row[:2]
+				elif i % 2:
+					row = row[:2] + [visits]
+				f.write(','.join(row) + '\n')
+		return self.path(name)
+
+	def test_missing_visits_count_as_zero(self):
+		policy = ties.parsePolicy('border:1,visits:1')
+		zeroed, blank = self.rewritten('zeroed.csv','0'), self.rewritten('blank.csv','')
+		expected = self.resolve('zeroed.out.csv',inPath=zeroed,policy=policy)
+		stats = self.resolve('blank.out.csv',inPath=blank,policy=policy)
+		self.assertGreater(expected['ties'],0)
+		for key in ('rows','ties','adjacent','nearest','unresolved'):
+			self.assertEqual(stats[key],expected[key],key)
+		self.assertEqual(self.read('blank.out.csv').count(b'\n'),self.read('zeroed.out.csv').count(b'\n'))
+		self.assertEqual(ties.tieDigests(blank,True),ties.tieDigests(zeroed,True))
+
+		twoColumns = self.rewritten('twoColumns.csv')
+		stats = self.resolve('twoColumns.out.csv',inPath=twoColumns,policy=policy)
+		self.assertEqual((stats['rows'],stats['ties']),(expected['rows'],expected['ties']))
+		self.assertEqual(sorted(ties.tieDigests(twoColumns,True)),sorted(ties.tieDigests(twoColumns)))
+
+	def test_store_ties(self):
+		dyads = benchmark.dyadTable(3000,100,numpy.random.RandomState(0))
+		dyads['VISITS_DYAD'] = dyads['VISITS_DYAD'] % 4 #few visit counts, so many recipients are tied
+		storePath = self.path('dyads' + store.Extension)
+		store.writeStore(storePath,[dyads])
+		written = ties.storeTieCsv(store.DyadStore(storePath),self.path('storeTies.csv'),rows=200)
+
+		#the rows at their recipient's maximum visits, of recipients with more than one of them
+		starts = reconcile.groupStarts(dyads['REC_ZIP'])
+		counts = numpy.diff(numpy.append(starts,len(dyads)))
+		isMax = dyads['VISITS_DYAD'] == numpy.repeat(numpy.maximum.reduceat(dyads['VISITS_DYAD'],starts),counts)
+		tied = isMax & numpy.repeat(numpy.add.reduceat(isMax.astype(numpy.int64),starts) > 1,counts)
+		expected = ['{0},{1},{2}'.format(rec,prov,visits) for rec, prov, visits in zip(zcta.decode(dyads['REC_ZIP'][tied]).tolist(),
+			zcta.decode(dyads['PROV_ZIP'][tied]).tolist(),dyads['VISITS_DYAD'][tied].tolist())]
+		self.assertGreater(written,0)
+		self.assertEqual(written,len(expected))
+		self.assertEqual(self.read('storeTies.csv').decode('utf-8').splitlines()[1:],expected)
+
+		stats = self.resolve('storeResolved.csv',inPath=self.path('storeTies.csv'))
+		self.assertEqual(stats['ties'],len(numpy.unique(dyads['REC_ZIP'][tied])))
+
+if __name__ == '__main__':
+	unittest.main()